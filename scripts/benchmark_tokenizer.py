@@ -0,0 +1,122 @@
+import re
+import json
+import time
+import argparse
+from pathlib import Path
+from dataraider.postprocess import KEYS, tokenize_chemicals
+
+"""
+Microbenchmark of the chemical string tokenizer of postprocessing against the previous
+character loop, over the chemical strings of reaction dictionaries produced by DataRaider
+"""
+
+
+def legacy_split_chemical(value:str):
+    """
+    Previous splitting of _split_chemical, kept as the baseline of the benchmark
+
+    :param value: A string containing chemicals and their quantities
+    :type value: str
+
+    :return: A list of tuples where each tuple contains the chemical name and its quantity
+    :rtype: list[tuple[str, str]]
+    """
+    components = []
+    current_component = []
+    bracket_level = 0
+    result = []
+    for char in value:
+        if char in "([":
+            bracket_level += 1
+        elif char in ")]":
+            bracket_level -= 1
+
+        if char == ',' and bracket_level == 0:
+            components.append(''.join(current_component).strip())
+            current_component = []
+        else:
+            current_component.append(char)
+    if current_component:
+        components.append(''.join(current_component).strip())
+
+    for component in components:
+        match = re.match(r'(.+?)(\s*(\([^\)]+\)|\[[^\]]+\]))?\s*$', component)
+        if match:
+            chemical_name = match.group(1).strip()
+            quantity = match.group(2).strip().replace('(', '').replace(')', '').replace('[', '').replace(']', '') if match.group(2) else None
+            result.append((chemical_name, quantity))
+    return result
+
+
+def load_corpus(json_directories:list, keys:list=KEYS):
+    """
+    Collects the chemical strings of all reaction dictionaries in the given directories
+
+    :param json_directories: Directories of DataRaider JSON outputs
+    :type json_directories: list[str]
+    :param keys: Keys of the chemical entities, defaults to KEYS
+    :type keys: list[str]
+
+    :return: Returns the chemical strings
+    :rtype: list[str]
+    """
+    corpus = []
+    for json_directory in json_directories:
+        for file_path in sorted(Path(json_directory).glob("*.json")):
+            try:
+                with open(file_path, "r") as file:
+                    rxn_dict = json.load(file)
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                continue
+            if not isinstance(rxn_dict, dict):
+                continue
+            for runs_key, runs in rxn_dict.items():
+                if "optimization" not in runs_key.lower() or not isinstance(runs, dict):
+                    continue
+                for entry in runs.values():
+                    if isinstance(entry, dict):
+                        corpus.extend(entry[key] for key in keys if isinstance(entry.get(key), str) and entry[key])
+    return corpus
+
+
+def time_function(function, corpus:list, repeat:int):
+    """
+    Times the best of repeat passes of function over the corpus
+
+    :return: Returns the best time per string in microseconds
+    :rtype: float
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for value in corpus:
+            function(value)
+        best = min(best, time.perf_counter() - start)
+    return best / len(corpus) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the chemical string tokenizer of postprocessing.")
+    parser.add_argument("json_dirs", type=str, nargs="*", help="Directories of DataRaider JSON outputs", default=None)
+    parser.add_argument("--repeat", type=int, help="Number of timed passes over the corpus", default=20)
+    parser.add_argument("--scale", type=int, help="Number of copies of the corpus per pass", default=100)
+    args = parser.parse_args()
+
+    json_dirs = args.json_dirs or [Path(__file__).resolve().parent.parent / "Assets"]
+    corpus = load_corpus(json_dirs)
+    if not corpus:
+        print(f"No chemical strings found in {', '.join(map(str, json_dirs))}")
+        return
+    mismatches = [value for value in corpus if tokenize_chemicals(value) != legacy_split_chemical(value)]
+    print(f"{len(corpus)} chemical strings, {len(set(corpus))} unique, {len(mismatches)} tokenized differently")
+    for value in sorted(set(mismatches))[:10]:
+        print(f"  {value!r}: {legacy_split_chemical(value)} -> {tokenize_chemicals(value)}")
+
+    corpus = corpus * args.scale
+    legacy = time_function(legacy_split_chemical, corpus, args.repeat)
+    compiled = time_function(tokenize_chemicals, corpus, args.repeat)
+    print(f"character loop: {legacy:.2f} us/string, compiled tokenizer: {compiled:.2f} us/string ({legacy / compiled:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
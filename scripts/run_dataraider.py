@@ -6,14 +6,22 @@ from pathlib import Path
 # from methods_dataraider import RxnOptDataProcessor
 # sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from dataraider.processor_info import DataRaiderInfo
-from dataraider.reaction_dictionary_formating import construct_initial_prompt
-from dataraider.process_images import batch_process_images, clear_temp_files
+from dataraider.reaction_dictionary_formating import construct_initial_prompt, build_response_schema
+from dataraider.process_images import batch_process_images, batch_process_images_async, batch_process_images_pipeline, clear_temp_files
 from dataraider.filter_image import filter_images, check_segmentation
-from huggingface_hub import hf_hub_download
+from dataraider.response_cache import ResponseCache
+from dataraider.batch_requests import BATCH_STAGES, write_batch, collect_batch_results
+from dataraider.image_dedup import deduplicate_images, duplicate_images, link_duplicate_results
+from dataraider.reaction_record import SNAPSHOT_FOLDER
+from dataraider.pubchem_cache import PubChemCache, set_pubchem_cache, get_pubchem_cache
+from dataraider.chemical_dictionary import ChemicalDictionary, set_chemical_dictionary
+from dataraider.pubchem_client import AsyncPubChemClient, set_pubchem_client
+from dataraider.alias_store import AliasStore, set_alias_store, get_alias_store
+from dataraider.prediction_cache import PredictionCache
+from mermaidapi import get_provider, set_ledger_path, set_provider, set_rate_limits
 from dotenv import load_dotenv
 
 load_dotenv()
-ckpt_path = hf_hub_download("yujieq/RxnScribe", "pix2seq_reaction_full.ckpt")
 # package_dir = os.path.dirname(__file__)  # This points to the current file's directory
         
 def load_config(config_file):
@@ -52,6 +60,9 @@ def main():
     parser.add_argument("--json_dir", type=str, help="Directory to save processed JSON data", default=None)
     parser.add_argument("--keys", type=str, nargs='+', help="List of keys to extract", default=None)
     parser.add_argument("--new_keys", type=str, nargs='+', help="List of new keys for data extraction", default=None)
+    parser.add_argument("--batch_stage", type=str, choices=BATCH_STAGES, help="Write the requests of this stage to a batch file instead of calling the API", default=None)
+    parser.add_argument("--batch_file", type=str, help="Path of the batch JSONL file written with --batch_stage", default="dataraider_batch.jsonl")
+    parser.add_argument("--collect_results", type=str, help="Path of a batch results file to ingest", default=None)
     # parser.add_argument("--api_key", type=str, help="API key", default=None)
     
     args = parser.parse_args()
@@ -69,31 +80,153 @@ def main():
     
     keys = config.get('keys', ["Entry", "Catalyst", "Ligand", "Cathode", "Solvents", "Footnote"])
     new_keys = config.get('new_keys', None)
+    dataraider_config = config.get('dataraider', {})
+    rate_limits = config.get('rate_limits', {})
+    set_rate_limits(rate_limits.get('requests_per_minute'), rate_limits.get('tokens_per_minute'))
+    set_ledger_path(config.get('ledger'))
+    set_provider(config.get('provider'))
+    provider = get_provider()
     # api_key = config.get('api_key', None)
-    api_key = os.environ.get("OPENAI_API_KEY")
-    if not api_key:
-        print("API key not found. Please set the OPENAI_API_KEY environment variable.")
+    api_key = provider.api_key()
+    if provider.requires_key and not api_key:
+        print(f"API key not found. Please set the {provider.api_key_env} environment variable.")
         return
 
-    info = DataRaiderInfo(api_key=api_key, device="cpu", ckpt_path=ckpt_path)
+    response_cache = None
+    if dataraider_config.get('response_cache'):
+        response_cache = ResponseCache(dataraider_config['response_cache'],
+                                       max_size_mb=dataraider_config.get('response_cache_max_mb', 1024),
+                                       replay=dataraider_config.get('response_cache_replay', False))
+
+    if dataraider_config.get('chemical_dictionary'):
+        chemical_dictionary = ChemicalDictionary.load(dataraider_config['chemical_dictionary'])
+        set_chemical_dictionary(chemical_dictionary)
+        print(f"Loaded {len(chemical_dictionary)} chemical names from {dataraider_config['chemical_dictionary']}")
+    if dataraider_config.get('alias_store'):
+        alias_store = AliasStore(dataraider_config['alias_store'],
+                                 ttl_days=dataraider_config.get('pubchem_cache_ttl_days', 180))
+        set_alias_store(alias_store)
+        print(f"Loaded {len(alias_store)} chemical aliases from {dataraider_config['alias_store']}")
+    if dataraider_config.get('pubchem_cache'):
+        set_pubchem_cache(PubChemCache(dataraider_config['pubchem_cache'],
+                                       ttl_days=dataraider_config.get('pubchem_cache_ttl_days', 180),
+                                       negative_ttl_days=dataraider_config.get('pubchem_negative_ttl_days', 14)))
+    if dataraider_config.get('async_pubchem') and not dataraider_config.get('corpus_resolution', False):
+        print("WARNING: async_pubchem only applies with corpus_resolution, chemicals will be resolved one at a time.\n")
+    elif dataraider_config.get('async_pubchem'):
+        set_pubchem_client(AsyncPubChemClient(workers=dataraider_config.get('pubchem_concurrency', 5)))
+
+    prediction_cache = PredictionCache(dataraider_config['rxnscribe_cache']) if dataraider_config.get('rxnscribe_cache') else None
+
+    extraction_encoding = None
+    if dataraider_config.get('compact_extraction_images'):
+        extraction_encoding = {"formats": tuple(dataraider_config.get('extraction_image_formats', ["png", "webp", "jpeg"])),
+                               "quality": dataraider_config.get('extraction_image_quality', 90),
+                               "min_psnr": dataraider_config.get('extraction_min_psnr', 40)}
+
+    info = DataRaiderInfo(api_key=api_key, device="cpu", ckpt_path=dataraider_config.get('rxnscribe_checkpoint') or None,
+                          request_timeout=dataraider_config.get('request_timeout', 300),
+                          max_retries=dataraider_config.get('max_retries', 5),
+                          max_connections=max(16, dataraider_config.get('max_concurrent_requests', 8)),
+                          response_cache=response_cache,
+                          hedge_quantile=dataraider_config.get('hedge_quantile', 0.95) if dataraider_config.get('hedge_requests') else None,
+                          max_hedge_rate=dataraider_config.get('max_hedge_rate', 0.05),
+                          extraction_encoding=extraction_encoding,
+                          rxnscribe_worker=dataraider_config.get('rxnscribe_worker') or None,
+                          rxnscribe_threads=dataraider_config.get('rxnscribe_threads') or None,
+                          prediction_cache=prediction_cache)
     
     # Construct the initial reaction data extraction prompt
     print('\n############################ Starting up DataRaider ############################ ')
     print("Constructing your custom reaction data extraction prompt\n")
     construct_initial_prompt(prompt_dir, keys, new_keys)
     
+    deduplicate = dataraider_config.get('deduplicate_images', False)
+    if deduplicate and args.batch_stage in (None, "filter") and not args.collect_results:
+        print('Setting aside near-duplicate images.\n')
+        deduplicate_images(image_dir,
+                           max_distance=dataraider_config.get('dedup_max_distance', 6),
+                           method=dataraider_config.get('dedup_method', "phash"))
+
+    if args.batch_stage:
+        print(f'Writing {args.batch_stage} requests to batch file.\n')
+        filter_kwargs = {}
+        if args.batch_stage in ("filter", "check_segmentation"):
+            prefix = "filter" if args.batch_stage == "filter" else "check"
+            filter_kwargs = {"detail": dataraider_config.get(f'{prefix}_detail', "low"),
+                             "max_image_side": dataraider_config.get(f'{prefix}_max_image_side', 512)}
+        if args.batch_stage == "filter" and deduplicate:
+            filter_kwargs["skip_images"] = duplicate_images(image_dir)
+        write_batch(info, args.batch_stage, args.batch_file, image_dir, prompt_dir, json_dir, **filter_kwargs)
+        return
+
+    if args.collect_results:
+        print(f'Collecting batch results from {args.collect_results}.\n')
+        collect_batch_results(info, args.collect_results, image_dir, json_dir)
+        if deduplicate:
+            link_duplicate_results(image_dir, json_dir)
+        return
+
     print('Filtering relevant images.\n')
-    filter_images(info, prompt_dir, "filter_image_prompt", image_dir)
+    filter_images(info, prompt_dir, "filter_image_prompt", image_dir,
+                  detail=dataraider_config.get('filter_detail', "low"),
+                  max_image_side=dataraider_config.get('filter_max_image_side', 512),
+                  skip_images=duplicate_images(image_dir) if deduplicate else None)
     
     print('Checking if images are segmented properly\n')
-    check_segmentation(info,prompt_dir, image_dir, check_prompt ="check_image_prompt")
+    check_segmentation(info,prompt_dir, image_dir, check_prompt ="check_image_prompt",
+                       detail=dataraider_config.get('check_detail', "low"),
+                       max_image_side=dataraider_config.get('check_max_image_side', 512))
     
     print('\nProcessing relevant images.\n')
-    batch_process_images(info, image_dir, prompt_dir, "get_data_prompt", "update_dict_prompt", json_dir)
+    response_schema = build_response_schema(prompt_dir, keys, new_keys) if dataraider_config.get('structured_output') else None
+    snapshot_dir = json_dir / SNAPSHOT_FOLDER if dataraider_config.get('record_snapshots') else None
+    if dataraider_config.get('adaptive_concurrency') and dataraider_config.get('engine', "serial") == "serial":
+        print("WARNING: adaptive_concurrency only applies to the async and pipeline engines, requests will be sent one at a time.\n")
+    if dataraider_config.get('engine', "serial") == "async":
+        batch_process_images_async(info, image_dir, prompt_dir, "get_data_prompt", "update_dict_prompt", json_dir,
+                                   max_concurrent_requests=dataraider_config.get('max_concurrent_requests', 8),
+                                   response_schema=response_schema,
+                                   adaptive_concurrency=dataraider_config.get('adaptive_concurrency', False),
+                                   concurrency_metrics_path=dataraider_config.get('concurrency_metrics') or None,
+                                   snapshot_directory=snapshot_dir,
+                                   corpus_resolution=dataraider_config.get('corpus_resolution', False),
+                                   smiles_batch_size=dataraider_config.get('rxnscribe_batch_size') or None)
+    elif dataraider_config.get('engine', "serial") == "pipeline":
+        batch_process_images_pipeline(info, image_dir, prompt_dir, "get_data_prompt", "update_dict_prompt", json_dir,
+                                      stage_workers={"extract": dataraider_config.get('max_concurrent_requests', 8), **dataraider_config.get('stage_workers', {})},
+                                      queue_size=dataraider_config.get('pipeline_queue_size', 4),
+                                      response_schema=response_schema,
+                                      adaptive_concurrency=dataraider_config.get('adaptive_concurrency', False),
+                                      concurrency_metrics_path=dataraider_config.get('concurrency_metrics') or None,
+                                      snapshot_directory=snapshot_dir,
+                                      corpus_resolution=dataraider_config.get('corpus_resolution', False),
+                                      smiles_batch_size=dataraider_config.get('rxnscribe_batch_size') or None)
+    else:
+        batch_process_images(info, image_dir, prompt_dir, "get_data_prompt", "update_dict_prompt", json_dir,
+                             response_schema=response_schema, snapshot_directory=snapshot_dir,
+                             corpus_resolution=dataraider_config.get('corpus_resolution', False),
+                             smiles_batch_size=dataraider_config.get('rxnscribe_batch_size') or None)
     
+    if deduplicate:
+        link_duplicate_results(image_dir, json_dir)
+
+    print('\nAPI call statistics')
+    info.client.print_summary()
+    pubchem_stats = get_pubchem_cache().stats()
+    print(f"PubChem cache: {pubchem_stats['memory_hits']} in-memory hits, {pubchem_stats['disk_hits']} on-disk hits "
+          f"({pubchem_stats['negative_hits']} known misses), {pubchem_stats['misses']} lookups, {pubchem_stats['entries']} entries")
+    alias_store = get_alias_store()
+    print(f"Chemical aliases: {len(alias_store)} aliases, hits per source {alias_store.stats()}")
+    alias_store.close()
+    if prediction_cache is not None:
+        prediction_stats = prediction_cache.stats()
+        print(f"RxnScribe cache: {prediction_stats['hits']} hits, {prediction_stats['misses']} misses, {prediction_stats['entries']} entries")
+
     print()
     print('\nClearing temporary files and custom prompts')
     clear_temp_files(prompt_dir, image_dir)
+    info.model.close()
 
 
 if __name__ == "__main__":
@@ -7,6 +7,7 @@ import os
 from enum import Enum, auto 
 
 from shutil import copyfile
+from mermaidapi import set_ledger_path, set_provider, set_rate_limits
 
 SCRIPT_PATH = Path(os.path.abspath(__file__))
 CFG_PATH = SCRIPT_PATH.parent / "startup.json"
@@ -114,6 +115,12 @@ def exec_run(args):
     config_path = args.config if args.config else CFG_PATH
     cfg = load_json_config(args.config)
 
+    # Exported to the environment so that all three subprocesses share the limits
+    rate_limits = cfg.get("rate_limits", {})
+    set_rate_limits(rate_limits.get("requests_per_minute"), rate_limits.get("tokens_per_minute"))
+    set_ledger_path(cfg.get("ledger"))
+    set_provider(cfg.get("provider"))
+
     print("\n### Running VisualHeist ###\n")
     run_subprocess("scripts/run_visualheist.py", ["--config", str(config_path)], python=True)
     print("\n### Done running VisualHeist ###\n")
@@ -1,9 +1,17 @@
 from .processor_info import DataRaiderInfo
-from .reaction_dictionary_formating import construct_initial_prompt
-from .process_images import batch_process_images, clear_temp_files
+from .reaction_dictionary_formating import construct_initial_prompt, build_response_schema
+from .process_images import batch_process_images, batch_process_images_async, batch_process_images_pipeline, clear_temp_files
+from .image_dedup import deduplicate_images, link_duplicate_results
+from .reaction_record import ReactionRecord
 
 __version__ = "0.1"
 __all__ = {"DataRaiderInfo", 
            "construct_initial_prompt", 
+           "build_response_schema", 
            "batch_process_images", 
-           "clear_temp_files"}
\ No newline at end of file
+           "batch_process_images_async", 
+           "batch_process_images_pipeline", 
+           "clear_temp_files",
+           "deduplicate_images",
+           "link_duplicate_results",
+           "ReactionRecord"}
\ No newline at end of file
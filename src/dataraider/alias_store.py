@@ -0,0 +1,319 @@
+import json
+import time
+import sqlite3
+import argparse
+import threading
+from pathlib import Path
+
+"""
+Module for the store of chemical aliases learned from resolved entities and manual corrections
+"""
+
+MANUAL = "manual"
+
+_default_store = None
+
+
+class AliasStore():
+    """
+    Store of chemical name to SMILES aliases consulted before resolving a chemical. Every name resolved
+    through PubChem is added with its provenance, so that it is not resolved again in later runs, and
+    manual corrections override any learned alias (a learned alias never replaces a manual one). Learned
+    aliases expire after ttl_days like the PubChem lookups they come from, so that they are eventually
+    resolved again; manual corrections never expire. Each alias counts how often it was used. All aliases
+    are held in memory; new aliases are written to the SQLite database right away and hit counts when
+    flush is called. Without a store_path the store only lives for the current process.
+
+    :param store_path: Path to the SQLite database file, defaults to None (in-memory only)
+    :type store_path: str, optional
+    :param ttl_days: Lifetime of a learned alias in days, defaults to 180
+    :type ttl_days: float
+    """
+
+    def __init__(self, store_path:str=None, ttl_days:float=180):
+        """Constructor method
+        """
+        self.store_path = Path(store_path) if store_path else None
+        self.ttl = ttl_days * 86400
+        self._aliases = {}
+        self._pending_hits = {}
+        self._lock = threading.Lock()
+        self._connection = None
+        if self.store_path is not None:
+            self.store_path.parent.mkdir(parents=True, exist_ok=True)
+            self._connection = sqlite3.connect(str(self.store_path), timeout=30, check_same_thread=False)
+            with self._connection:
+                self._connection.execute(
+                    "CREATE TABLE IF NOT EXISTS aliases ("
+                    "name TEXT PRIMARY KEY, smiles TEXT NOT NULL, source TEXT NOT NULL, "
+                    "hits INTEGER NOT NULL DEFAULT 0, added REAL NOT NULL)")
+            for name, smiles, source, hits, added in self._connection.execute(
+                    "SELECT name, smiles, source, hits, added FROM aliases"):
+                self._aliases[name] = {"smiles": smiles, "source": source, "hits": hits, "added": added}
+
+    def __len__(self):
+        return len(self._aliases)
+
+    def __contains__(self, name:str):
+        return self.get(name, count=False) is not None
+
+    def _expired(self, alias:dict):
+        """
+        Helper function checking whether a learned alias has outlived the ttl
+        """
+        return alias["source"] != MANUAL and time.time() - alias["added"] > self.ttl
+
+    def get(self, name:str, count:bool=True, manual_only:bool=False):
+        """
+        Looks up the SMILES of a chemical name and counts the hit
+
+        :param name: Chemical name
+        :type name: str
+        :param count: Whether to count the hit, defaults to True
+        :type count: bool
+        :param manual_only: Whether to only consider manual corrections, defaults to False
+        :type manual_only: bool
+
+        :return: Returns the SMILES, or None if the name has no alias or only an expired one
+        :rtype: str
+        """
+        with self._lock:
+            alias = self._aliases.get(name)
+            if alias is None or self._expired(alias) or (manual_only and alias["source"] != MANUAL):
+                return None
+            if not count:
+                return alias["smiles"]
+            alias["hits"] += 1
+            self._pending_hits[name] = self._pending_hits.get(name, 0) + 1
+            return alias["smiles"]
+
+    def add(self, name:str, smiles:str, source:str="pubchem"):
+        """
+        Adds an alias. Learned aliases never replace a manual correction, and adding an alias that is
+        already known with the same SMILES only renews it if it expired.
+
+        :param name: Chemical name
+        :type name: str
+        :param smiles: SMILES of the chemical
+        :type smiles: str
+        :param source: Provenance of the alias, e.g. "pubchem", "dictionary" or "manual", defaults to "pubchem"
+        :type source: str
+
+        :return: Returns True if the alias was added or changed
+        :rtype: bool
+        """
+        if not name or not smiles:
+            return False
+        with self._lock:
+            alias = self._aliases.get(name)
+            if alias is not None and (alias["source"] == MANUAL and source != MANUAL
+                                      or alias["smiles"] == smiles and alias["source"] == source and not self._expired(alias)):
+                return False
+            hits = alias["hits"] if alias is not None else 0
+            self._store(name, {"smiles": smiles, "source": source, "hits": hits, "added": time.time()})
+            return True
+
+    def correct(self, name:str, smiles:str):
+        """
+        Records a manual correction, which takes precedence over any alias learned for the name
+
+        :param name: Chemical name
+        :type name: str
+        :param smiles: Correct SMILES of the chemical
+        :type smiles: str
+        """
+        self.add(name, smiles, MANUAL)
+
+    def remove(self, name:str):
+        """
+        Removes the alias of a name, e.g. a wrong learned alias
+
+        :param name: Chemical name
+        :type name: str
+        """
+        with self._lock:
+            self._aliases.pop(name, None)
+            self._pending_hits.pop(name, None)
+            if self._connection is not None:
+                with self._connection:
+                    self._connection.execute("DELETE FROM aliases WHERE name = ?", (name,))
+
+    def _store(self, name:str, alias:dict):
+        """
+        Helper function to insert or replace an alias. Must be called with the lock held.
+        """
+        self._aliases[name] = alias
+        self._pending_hits.pop(name, None)
+        if self._connection is not None:
+            with self._connection:
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO aliases (name, smiles, source, hits, added) VALUES (?, ?, ?, ?, ?)",
+                    (name, alias["smiles"], alias["source"], alias["hits"], alias["added"]))
+
+    def flush(self):
+        """
+        Writes the hit counts gathered since the last flush to the database
+        """
+        with self._lock:
+            if self._connection is not None and self._pending_hits:
+                with self._connection:
+                    self._connection.executemany("UPDATE aliases SET hits = hits + ? WHERE name = ?",
+                                                 [(hits, name) for name, hits in self._pending_hits.items()])
+            self._pending_hits = {}
+
+    def export(self, path:str):
+        """
+        Exports all aliases with their provenance and hit counts to a JSON lines file
+
+        :param path: Path of the export file
+        :type path: str
+
+        :return: Returns the number of aliases exported
+        :rtype: int
+        """
+        with self._lock:
+            aliases = sorted(self._aliases.items())
+        with open(path, "w", encoding="utf-8") as file:
+            for name, alias in aliases:
+                file.write(json.dumps({"name": name, **alias}, ensure_ascii=False) + "\n")
+        return len(aliases)
+
+    def import_aliases(self, path:str):
+        """
+        Imports aliases exported by another deployment. Manual corrections take precedence over learned
+        aliases on either side, otherwise existing aliases are kept. Hit counts of aliases known on both
+        sides are kept at the higher count.
+
+        :param path: Path of the export file
+        :type path: str
+
+        :return: Returns the number of aliases added or changed
+        :rtype: int
+        """
+        changed = 0
+        with open(path, "r", encoding="utf-8") as file:
+            for line in file:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                name, smiles, source = record.get("name"), record.get("smiles"), record.get("source", "import")
+                if not name or not smiles:
+                    continue
+                with self._lock:
+                    alias = self._aliases.get(name)
+                    if alias is None or (source == MANUAL and alias["source"] != MANUAL):
+                        self._store(name, {"smiles": smiles, "source": source,
+                                           "hits": record.get("hits", 0), "added": record.get("added", time.time())})
+                        changed += 1
+                    elif alias["smiles"] == smiles and record.get("hits", 0) > alias["hits"]:
+                        self._store(name, dict(alias, hits=record["hits"]))
+        return changed
+
+    def most_used(self, count:int=20):
+        """
+        Lists the most used aliases
+
+        :param count: Number of aliases to list, defaults to 20
+        :type count: int
+
+        :return: Returns (name, alias) pairs by decreasing hit count
+        :rtype: list[tuple[str, dict]]
+        """
+        with self._lock:
+            aliases = [(name, dict(alias)) for name, alias in self._aliases.items()]
+        return sorted(aliases, key=lambda item: -item[1]["hits"])[:count]
+
+    def stats(self):
+        """
+        Reports the aliases per provenance
+
+        :return: Returns the number of aliases and of hits per source
+        :rtype: dict[str, dict]
+        """
+        stats = {}
+        with self._lock:
+            for alias in self._aliases.values():
+                source = stats.setdefault(alias["source"], {"aliases": 0, "hits": 0})
+                source["aliases"] += 1
+                source["hits"] += alias["hits"]
+        return stats
+
+    def close(self):
+        """
+        Flushes the hit counts and closes the database connection
+        """
+        self.flush()
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+def get_alias_store():
+    """
+    Returns the process-wide alias store consulted when resolving chemicals
+
+    :return: Returns the store set with set_alias_store, or an in-memory store if none was set
+    :rtype: AliasStore
+    """
+    global _default_store
+    if _default_store is None:
+        _default_store = AliasStore()
+    return _default_store
+
+
+def set_alias_store(store:AliasStore):
+    """
+    Sets the process-wide alias store consulted when resolving chemicals
+
+    :param store: The store, or None to go back to an in-memory store
+    :type store: AliasStore
+    """
+    global _default_store
+    _default_store = store
+
+
+def main(argv:list=None):
+    """
+    Command line entry point to correct, list, export and import the aliases of a store
+
+    :param argv: Command line arguments, defaults to sys.argv[1:]
+    :type argv: list[str], optional
+    """
+    parser = argparse.ArgumentParser(prog="dataraider-aliases", description="Manage the chemical alias store of DataRaider.")
+    parser.add_argument("store", type=str, help="Path of the alias store (the alias_store setting)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    correct = commands.add_parser("correct", help="Record a manual correction")
+    correct.add_argument("name", type=str)
+    correct.add_argument("smiles", type=str)
+    remove = commands.add_parser("remove", help="Remove the alias of a name")
+    remove.add_argument("name", type=str)
+    show = commands.add_parser("list", help="List the most used aliases")
+    show.add_argument("--top", type=int, default=20)
+    export = commands.add_parser("export", help="Export all aliases to a JSON lines file")
+    export.add_argument("path", type=str)
+    load = commands.add_parser("import", help="Import aliases from a JSON lines file")
+    load.add_argument("path", type=str)
+    args = parser.parse_args(argv)
+
+    store = AliasStore(args.store)
+    try:
+        if args.command == "correct":
+            store.correct(args.name, args.smiles)
+            print(f"{args.name} -> {args.smiles}")
+        elif args.command == "remove":
+            store.remove(args.name)
+        elif args.command == "list":
+            for name, alias in store.most_used(args.top):
+                print(f"{alias['hits']:>8}  {alias['source']:<10}  {name}  {alias['smiles']}")
+            print(f"{len(store)} aliases: {store.stats()}")
+        elif args.command == "export":
+            print(f"Exported {store.export(args.path)} aliases to {args.path}")
+        elif args.command == "import":
+            print(f"Imported {store.import_aliases(args.path)} aliases from {args.path}")
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -2,21 +2,66 @@ import os
 import requests
 import glob
 import json
-import base64
+import time
 from .processor_info import DataRaiderInfo
-from .reaction_dictionary_formating import reformat_json
+from .image_encoding import encode_image, compact_encode_image
+from .reaction_dictionary_formating import schema_errors
+from .reaction_record import ReactionRecord
 from pathlib import Path
 
 """
 Module for OpenAI API access
 """
 
+def save_reaction_data(response_path:str, reaction_data:str):
+    """
+    Saves the raw reaction dictionary returned by the VLM and cleans it into proper JSON
+
+    :param response_path: Path of the JSON file to write
+    :type response_path: str
+    :param reaction_data: Content of the VLM response
+    :type reaction_data: str
+
+    :return: Returns nothing, all data saved in JSON
+    :rtype: None
+    """
+    response_path = Path(response_path)
+    record = ReactionRecord(response_path.stem, response_path.parent)
+    cleaned = record.update_from_response(reaction_data, "get_data")
+    record.save()
+    print("Reaction dictionary saved")
+    if cleaned:
+        print("Reaction data cleaned.")
+
+
+def save_footnote_update(response_path:str, reaction_data:str):
+    """
+    Saves the reaction dictionary updated with footnote information and cleans it into proper JSON
+
+    :param response_path: Path of the JSON file to overwrite
+    :type response_path: str
+    :param reaction_data: Content of the VLM response
+    :type reaction_data: str
+
+    :return: Returns nothing, all data saved in JSON
+    :rtype: None
+    """
+    response_path = Path(response_path)
+    record = ReactionRecord(response_path.stem, response_path.parent)
+    cleaned = record.update_from_response(reaction_data, "update_footnotes")
+    record.save()
+    print(f"Reaction dictionary has been updated with footnote description.")
+    if cleaned:
+        print("Updated reaction dictionary has been cleaned.")
+
+
 def update_dict_with_footnotes( 
                     info:DataRaiderInfo,
                     prompt_directory:str, 
                     update_dict_prompt:str, 
                     image_name:str, 
-                    json_directory:str):
+                    json_directory:str,
+                    record:ReactionRecord=None):
         """
         Updates the reaction dictionary with information from the footnote dictionary
         
@@ -30,8 +75,10 @@ def update_dict_with_footnotes(
         :type image_name: str
         :param json_directory: Path to directory of reaction dictionary
         :type update_dict_prompt: str
+        :param record: In-memory reaction record to update, defaults to None (read from and saved to the JSON file)
+        :type record: ReactionRecord, optional
         
-        :return: Returns nothing, all data saved in JSON
+        :return: Returns nothing, the record is updated (or the JSON saved)
         :rtype: None
         """
         # Get user prompt file
@@ -40,14 +87,13 @@ def update_dict_with_footnotes(
         with open(user_prompt_path, "r") as file:
             user_message = file.read().strip()
         
-        # Get Json file
-        json_directory = Path(json_directory)
-        json_path = json_directory / f"{image_name}.json"
-        with open(json_path, "r") as file2:
-            json_dict = file2.read().strip()
-
-        # Replace existing json file with updated json file
-        response_path = json_path
+        # Get reaction dictionary
+        standalone = record is None
+        if standalone:
+            record = ReactionRecord.load(image_name, json_directory)
+        if record.empty:
+            raise FileNotFoundError(f"No reaction dictionary for {image_name}")
+        json_dict = record.text()
 
         # Construct message
         messages = [
@@ -66,12 +112,7 @@ def update_dict_with_footnotes(
             }
         ]
 
-        # API request headers and payload
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {info.api_key}"
-        }
-
+        # API request payload
         payload = {
             "model": info.vlm_model,
             "messages": messages,
@@ -80,33 +121,88 @@ def update_dict_with_footnotes(
 
         # Send API request
         try:
-            response = requests.post("https://api.openai.com/v1/chat/completions", headers=headers, json=payload)
-            response.raise_for_status()  # Raise error if the request failed
-            reaction_data = response.json()['choices'][0]['message']['content']
-
-            # Save response
-            with open(response_path, 'w') as json_file:
-                json.dump(reaction_data, json_file)
-            print(f"Reaction dictionary has been updated with footnote description.")
-
-            # Clean response
-            try:
-                reformat_json(response_path)
-                print("Updated reaction dictionary has been cleaned.")
-            except Exception as e:
-                print("Updated reaction dictionary not cleaned.Error: {e}")
+            response = info.client.chat_completion(payload, stage="update_footnotes", subject=image_name)
+            if response is None: # Request deferred to a batch file
+                return
+            reaction_data = response['choices'][0]['message']['content']
+            if record.update_from_response(reaction_data, "update_footnotes"):
+                print("Reaction dictionary has been updated with footnote description.")
+            if standalone:
+                record.save()
         
         except requests.exceptions.RequestException as e:
             print(f"Error during API request: {e}")
 
 
+def _build_extraction_messages(user_message:str, 
+                               image_name:str, 
+                               image_directory:str,
+                               image_encoding:dict=None):
+    """
+    Helper function to build the extraction request from the prompt, all subfigures and the image caption
+
+    :param user_message: User message prompt
+    :type user_message: str
+    :param image_name: Name of image
+    :type image_name: str
+    :param image_directory: Root directory where the original images are stored
+    :type image_directory: str
+    :param image_encoding: Keyword arguments of compact_encode_image, defaults to None (subfigures sent as stored)
+    :type image_encoding: dict, optional
+
+    :return: Returns the request messages, or None if the image has no subfigures
+    :rtype: list[dict]
+    """
+    image_directory = Path(image_directory)
+
+    # Get all subfigures files 
+    image_paths = sorted((image_directory / "cropped_images").glob(f"{image_name}_*.png"))
+    if not image_paths:
+        print(f"No subimages found for {image_name}")
+        return None
+    
+    if image_encoding is None:
+        encoded_images = [encode_image(image_path) for image_path in image_paths]
+    else:
+        start = time.perf_counter()
+        encoded = [compact_encode_image(image_path, **image_encoding) for image_path in image_paths]
+        original_bytes = sum(original_size for _, _, original_size, _ in encoded)
+        encoded_bytes = sum(encoded_size for _, _, _, encoded_size in encoded)
+        print(f"Encoded {len(encoded)} subfigures of {image_name}: {original_bytes / 1024:.0f} KB -> "
+              f"{encoded_bytes / 1024:.0f} KB ({1 - encoded_bytes / max(1, original_bytes):.0%} saved) "
+              f"in {time.perf_counter() - start:.2f}s")
+        encoded_images = [(image_data, mime_type) for image_data, mime_type, _, _ in encoded]
+
+    image_caption_path = image_directory / f"{image_name}.txt"
+
+    # Create base message
+    messages = [{
+        "role": "user",
+        "content": [{"type": "text", "text": user_message}]
+    }]
+
+    # Add each encoded image as a separate entry
+    messages[0]["content"].extend({
+        "type": "image_url",
+        "image_url": {"url": f"data:{mime_type};base64,{image_data}"}
+    } for image_data, mime_type in encoded_images)
+    
+    # If the image caption file exists, append it to the messages content
+    if image_caption_path.exists():
+        with open(image_caption_path, "r") as file:
+            image_caption = file.read().strip()
+        messages[0]["content"].append({"type": "text","text": image_caption})
+    return messages
+
+
 def adaptive_get_data( 
                     info:DataRaiderInfo,
                     prompt_directory:str, 
                     get_data_prompt:str, 
                     image_name:str, 
                     image_directory:str, 
-                    json_directory:str):
+                    json_directory:str,
+                    record:ReactionRecord=None):
     """
     Retrieves a reaction dictionary from all subfigures and dumps into a JSON
 
@@ -122,84 +218,133 @@ def adaptive_get_data(
     :type image_directory: str
     :param json_directory: Output directory to save all output json files 
     :type json_directory: str
+    :param record: In-memory reaction record to fill, defaults to None (saved to the JSON file)
+    :type record: ReactionRecord, optional
 
-    :return: Returns nothing, all data saved in JSON
+    :return: Returns nothing, the record is filled (or the JSON saved)
     :rtype: None
     """   
     prompt_directory = Path(prompt_directory)
-    image_directory = Path(image_directory)
     json_directory = Path(json_directory)
-    
-    # Get all subfigures files 
-    image_paths = sorted((image_directory / "cropped_images").glob(f"{image_name}_*.png"))
-    if not image_paths:
-        print(f"No subimages found for {image_name}")
-        return
-    
-    def encode_image(image_path):
-        with open(image_path, "rb") as image_file:
-            return base64.b64encode(image_file.read()).decode('utf-8')
-        
-    base64_images = [encode_image(image_path) for image_path in image_paths]
 
     # Get user prompt file
     user_prompt_path = prompt_directory / f"{get_data_prompt}.txt"
     with open(user_prompt_path, "r") as file:
         user_message = file.read().strip()
 
-    # Get response file paths
-    json_directory.mkdir(parents=True, exist_ok=True)
+    messages = _build_extraction_messages(user_message, image_name, image_directory, info.extraction_encoding)
+    if messages is None:
+        return
 
-    image_caption_path = image_directory / f"{image_name}.txt"
-    response_path = json_directory / f"{image_name}.json"
+    # API request payload
+    payload = {
+        "model": info.vlm_model,
+        "messages": messages,
+        "max_tokens": 4000
+    }
+    # Send API request
+    try:
+        response = info.client.chat_completion(payload, stage="get_data", subject=image_name)
+        if response is None: # Request deferred to a batch file
+            return
+        reaction_data = response['choices'][0]['message']['content']
+        if record is None:
+            json_directory.mkdir(parents=True, exist_ok=True)
+            save_reaction_data(json_directory / f"{image_name}.json", reaction_data)
+        elif record.update_from_response(reaction_data, "get_data"):
+            print("Reaction data cleaned.")
+    
+    except requests.exceptions.RequestException as e:
+        print(f"Error during API request: {e}")
 
-    # Create base message
-    messages = [{
-        "role": "user",
-        "content": [{"type": "text", "text": user_message}]
-    }]
 
-    # Add each encoded image as a separate entry
-    messages[0]["content"].extend({
-        "type": "image_url",
-        "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}
-    } for base64_image in base64_images)
-    
-    # If the image caption file exists, append it to the messages content
-    if image_caption_path.exists():
-        with open(image_caption_path, "r") as file:
-            image_caption = file.read().strip()
-        messages[0]["content"].append({"type": "text","text": image_caption})
+def structured_get_data( 
+                    info:DataRaiderInfo,
+                    prompt_directory:str, 
+                    get_data_prompt:str, 
+                    image_name:str, 
+                    image_directory:str, 
+                    json_directory:str,
+                    response_schema:dict,
+                    structured_prompt:str="structured_output_prompt",
+                    record:ReactionRecord=None):
+    """
+    Retrieves a reaction dictionary with footnotes already applied in a single request, 
+    using a JSON-schema-constrained response, and dumps it into a JSON
 
-    # API request headers and payload
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {info.api_key}"
-    }
+    :param info: Global information required for processing
+    :type info: DataRaiderInfo
+    :param prompt_directory: Directory path to user message prompt
+    :type prompt_directory: str
+    :param get_data_prompt: File name of user message prompt to get reaction conditions
+    :type get_data_prompt: str
+    :param image_name: Name of image
+    :type image_name: str
+    :param image_directory: Root directory where the original images are stored
+    :type image_directory: str
+    :param json_directory: Output directory to save all output json files 
+    :type json_directory: str
+    :param response_schema: JSON schema of the response, see build_response_schema
+    :type response_schema: dict
+    :param structured_prompt: File name of the prompt asking to apply footnotes before answering, defaults to "structured_output_prompt"
+    :type structured_prompt: str
+    :param record: In-memory reaction record to fill, defaults to None (saved to the JSON file)
+    :type record: ReactionRecord, optional
+
+    :return: Returns True if a valid reaction dictionary was saved, False if the response failed 
+        validation (use the two-step flow instead) and None if the request itself failed or was deferred
+    :rtype: bool
+    """   
+    prompt_directory = Path(prompt_directory)
+    json_directory = Path(json_directory)
+
+    # Get user prompt files
+    user_message = ""
+    for prompt in (get_data_prompt, structured_prompt):
+        with open(prompt_directory / f"{prompt}.txt", "r") as file:
+            user_message += file.read().strip() + "\n\n"
 
+    messages = _build_extraction_messages(user_message.strip(), image_name, image_directory, info.extraction_encoding)
+    if messages is None:
+        return None
+
+    # API request payload
     payload = {
         "model": info.vlm_model,
         "messages": messages,
-        "max_tokens": 4000
+        "max_tokens": 4000,
+        "response_format": {
+            "type": "json_schema",
+            "json_schema": {"name": "reaction_dictionary", "schema": response_schema, "strict": True}
+        }
     }
     # Send API request
     try:
-        response = requests.post("https://api.openai.com/v1/chat/completions", headers=headers, json=payload)
-        response.raise_for_status()  # Raise error if the request failed
-        reaction_data = response.json()['choices'][0]['message']['content']
-
-        # Save responses
-        with open(response_path, 'w') as json_file:
-            json.dump(reaction_data, json_file)
-        print("Reaction dictionary saved")
-
-        # Clean response: 
-        try: 
-            reformat_json(response_path)
-            print("Reaction data cleaned.")
-
-        except Exception as e: 
-            print(f"Reaction data not cleaned. Error: {e}")
-    
+        response = info.client.chat_completion(payload, stage="get_data_structured", subject=image_name)
+        if response is None: # Request deferred to a batch file
+            return None
+        reaction_data = response['choices'][0]['message'].get('content')
     except requests.exceptions.RequestException as e:
-        print(f"Error during API request: {e}")
\ No newline at end of file
+        print(f"Error during API request: {e}")
+        return None
+
+    # Validate response
+    try:
+        data = json.loads(reaction_data)
+    except (TypeError, json.JSONDecodeError) as e:
+        print(f"Structured response for {image_name} is not valid JSON. Error: {e}")
+        return False
+    errors = schema_errors(data, response_schema)
+    if errors:
+        print(f"Structured response for {image_name} does not match the schema: {'; '.join(errors[:5])}")
+        return False
+
+    runs = {str(idx + 1): run for idx, run in enumerate(data["Optimization Runs"])}
+    standalone = record is None
+    if standalone:
+        record = ReactionRecord(image_name, json_directory)
+    record.update({"Optimization Runs": runs}, "get_data_structured")
+    if standalone:
+        record.save()
+    print("Reaction dictionary with footnotes applied saved.")
+    return True
@@ -0,0 +1,454 @@
+import io
+import json
+import time
+import random
+import threading
+import requests
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from requests.adapters import HTTPAdapter
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from mermaidapi import estimate_tokens, get_ledger, get_provider, get_rate_limiter
+from mermaidapi.ledger import usage_tokens
+from mermaidapi.singleflight import SingleFlight
+from .response_cache import CacheMissError, ResponseCache
+
+"""
+Module for the pooled HTTP client shared by all DataRaider API calls
+"""
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class _TimedBody(io.BytesIO):
+    """
+    Request body recording when the connection starts and finishes reading it, to time the upload
+    """
+
+    def __init__(self, data:bytes):
+        super().__init__(data)
+        self.size = len(data)
+        self.started = None
+        self.finished = None
+
+    def read(self, size=-1):
+        chunk = super().read(size)
+        now = time.perf_counter()
+        if self.started is None:
+            self.started = now
+        if self.finished is None and self.tell() >= self.size:
+            self.finished = now
+        return chunk
+
+    @property
+    def upload_seconds(self):
+        """Time between the first and the last read of the body, or None if it was not fully read"""
+        if self.finished is None:
+            return None
+        return self.finished - self.started
+
+
+def _parse_retry_after(response):
+    """
+    Helper function to read the server-requested wait time from a response
+
+    :param response: Response of a failed request
+    :type response: requests.Response
+
+    :return: Returns the number of seconds to wait, or None if the server did not specify one
+    :rtype: float
+    """
+    retry_after_ms = response.headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+    retry_after = response.headers.get("Retry-After")
+    if not retry_after:
+        return None
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+    try:
+        retry_date = parsedate_to_datetime(retry_after)
+        return max(0.0, (retry_date - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+class APIClient():
+    """
+    HTTP client with keep-alive connection pooling, timeouts and retries for chat completion requests.
+    Requests go to the chat completions endpoint of the provider, which also sets the authentication
+    header and may override the model of each stage.
+    Failed requests (429, 5xx, connection errors and timeouts) are retried with exponential backoff
+    and jitter, honouring the Retry-After header when the server sends one.
+    If a response cache is given, identical requests are served from it instead of the API.
+    Identical requests in flight at the same time (e.g. the same figure saved twice) are sent once,
+    the duplicates wait for the response of the first and are counted as deduplicated.
+    While a batch writer is set, requests are written to its batch file instead of being sent.
+    Every attempt first acquires from the rate limiter shared with all other processes calling the API,
+    reserving the prompt and max_tokens budget, and the reservation is corrected to the reported usage.
+    If a concurrency controller is set, every attempt also holds one of its slots and reports its
+    latency and outcome to it, so the number of requests in flight adapts to the API's health.
+    If hedging is enabled, a request still unanswered after the hedge_quantile latency of its stage
+    is sent a second time and the first response wins, as long as at most max_hedge_rate of the
+    requests have been hedged.
+    Latency, retry count and token usage of every call are recorded in `records` and appended
+    to the call ledger shared with all other processes calling the API.
+
+    :param api_key: API key, defaults to the one read by the provider
+    :type api_key: str, optional
+    :param url: Chat completions endpoint, defaults to the one of the provider
+    :type url: str, optional
+    :param timeout: Connect and read timeouts in seconds, defaults to (10, 300)
+    :type timeout: tuple[float, float]
+    :param max_retries: Maximum number of retries per call, defaults to 5
+    :type max_retries: int
+    :param backoff_base: Base delay in seconds of the exponential backoff, defaults to 1.0
+    :type backoff_base: float
+    :param backoff_max: Maximum delay in seconds between two attempts, defaults to 60.0
+    :type backoff_max: float
+    :param pool_size: Number of pooled keep-alive connections, defaults to 16
+    :type pool_size: int
+    :param cache: Cache of chat completion responses, defaults to None
+    :type cache: ResponseCache, optional
+    :param rate_limiter: Cross-process rate limiter, defaults to the one configured from the environment
+    :type rate_limiter: mermaidapi.RateLimiter, optional
+    :param concurrency: Adaptive limit on requests in flight, defaults to None (no limit)
+    :type concurrency: mermaidapi.AIMDController, optional
+    :param ledger: Ledger every call is appended to, defaults to the one configured from the environment
+    :type ledger: mermaidapi.CallLedger, optional
+    :param provider: OpenAI-compatible endpoint, authentication and per-stage models, defaults to the one
+        configured from the environment
+    :type provider: mermaidapi.Provider, optional
+    :param hedge_quantile: Latency quantile of a stage after which a duplicate request is sent,
+        e.g. 0.95, defaults to None (no hedging)
+    :type hedge_quantile: float, optional
+    :param max_hedge_rate: Maximum fraction of requests that are hedged, defaults to 0.05
+    :type max_hedge_rate: float
+    :param hedge_min_samples: Number of answered requests of a stage needed before its requests are hedged, defaults to 20
+    :type hedge_min_samples: int
+    """
+
+    def __init__(self,
+                 api_key:str=None,
+                 url:str=None,
+                 timeout:tuple=(10, 300),
+                 max_retries:int=5,
+                 backoff_base:float=1.0,
+                 backoff_max:float=60.0,
+                 pool_size:int=16,
+                 cache=None,
+                 rate_limiter=None,
+                 concurrency=None,
+                 ledger=None,
+                 provider=None,
+                 hedge_quantile:float=None,
+                 max_hedge_rate:float=0.05,
+                 hedge_min_samples:int=20):
+        """Constructor method
+        """
+        self.provider = provider or get_provider()
+        self.url = url or self.provider.chat_url
+        self.cache = cache
+        self.rate_limiter = rate_limiter or get_rate_limiter()
+        self.concurrency = concurrency
+        self.ledger = ledger or get_ledger()
+        self.batch_writer = None
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.records = []
+        self._lock = threading.Lock()
+        self._in_flight = SingleFlight()
+        self.hedge_quantile = hedge_quantile
+        self.max_hedge_rate = max_hedge_rate
+        self.hedge_min_samples = hedge_min_samples
+        self.sent = 0
+        self.hedges = 0
+        self.hedges_won = 0
+        self._hedge_pool = ThreadPoolExecutor(max_workers=2 * pool_size) if hedge_quantile else None
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({
+            "Content-Type": "application/json",
+            **self.provider.auth_headers(api_key)
+        })
+
+    def _backoff_delay(self, attempt:int, response=None):
+        """
+        Helper function to compute the wait time before the next attempt
+
+        :param attempt: Number of attempts already retried
+        :type attempt: int
+        :param response: Response of the failed attempt, if any
+        :type response: requests.Response, optional
+
+        :return: Returns the delay in seconds
+        :rtype: float
+        """
+        if response is not None:
+            retry_after = _parse_retry_after(response)
+            if retry_after is not None:
+                return retry_after + random.uniform(0, self.backoff_base)
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def _record(self, stage, subject, start, retries, status, cached=False, model=None, usage=None, deduplicated=False, hedge=False,
+                request_bytes=0, upload_seconds=None):
+        """
+        Helper function to store the latency, retry count, token usage and request size of a finished call
+        """
+        latency = time.perf_counter() - start
+        with self._lock:
+            self.records.append({
+                "stage": stage,
+                "subject": subject,
+                "model": model,
+                **usage_tokens(usage),
+                "latency": latency,
+                "retries": retries,
+                "status": status,
+                "cached": cached,
+                "deduplicated": deduplicated,
+                "hedge": hedge,
+                "request_bytes": request_bytes,
+                "upload_seconds": upload_seconds
+            })
+        self.ledger.record(stage, subject, model, latency, retries=retries, status=status, usage=usage,
+                           cached=cached, deduplicated=deduplicated, hedge=hedge,
+                           request_bytes=request_bytes, upload_seconds=upload_seconds)
+
+    def chat_completion(self,
+                        payload:dict,
+                        stage:str=None,
+                        subject:str=None):
+        """
+        Sends a chat completion request, retrying on rate limits, server errors and dropped connections
+
+        :param payload: JSON payload of the request
+        :type payload: dict
+        :param stage: Name of the pipeline stage issuing the request, used for statistics
+        :type stage: str, optional
+        :param subject: Name of the image the request is about, used for statistics
+        :type subject: str, optional
+
+        :raises requests.exceptions.RequestException: If the request still fails after all retries
+        :raises CacheMissError: If the cache is in replay mode and holds no response for the request
+
+        :return: Returns the decoded JSON response, or None if the request was deferred to a batch file
+        :rtype: dict
+        """
+        payload = self.provider.apply(payload, stage)
+        if self.batch_writer is not None:
+            self.batch_writer.add(payload, stage, subject)
+            return None
+
+        start = time.perf_counter()
+        key = ResponseCache.request_key(payload)
+        if self.cache is not None:
+            cached_response = self.cache.get(key)
+            if cached_response is not None:
+                self._record(stage, subject, start, 0, 200, cached=True, model=payload.get("model"))
+                return cached_response
+            if self.cache.replay:
+                self._record(stage, subject, start, 0, None, cached=True, model=payload.get("model"))
+                raise CacheMissError(f"No cached response for {subject} ({stage}) in replay mode")
+
+        sent = []
+
+        def send():
+            sent.append(True)
+            return self._send_and_cache(key, payload, stage, subject, start)
+
+        try:
+            response_data, shared = self._in_flight.do(key, send)
+        except Exception:
+            if not sent:  # The duplicated request failed, the failure is recorded by the sender
+                self._record(stage, subject, start, 0, None, model=payload.get("model"), deduplicated=True)
+            raise
+        if shared:
+            self._record(stage, subject, start, 0, 200, model=response_data.get("model") or payload.get("model"), deduplicated=True)
+        return response_data
+
+    def _send_and_cache(self, key, payload, stage, subject, start):
+        """
+        Helper function to send a request and store its response in the cache
+        """
+        response_data = self._hedged_post(payload, stage, subject, start)
+        if self.cache is not None:
+            self.cache.put(key, response_data)
+        return response_data
+
+    def _hedge_delay(self, stage):
+        """
+        Helper function to compute how long a request of a stage waits before it is hedged
+
+        :return: Returns the hedge_quantile latency of the stage's answered requests, or None if the stage
+            has too few samples or the hedge budget is spent
+        :rtype: float
+        """
+        with self._lock:
+            self.sent += 1
+            if self.hedges >= self.max_hedge_rate * self.sent:
+                return None
+            latencies = sorted(record["latency"] for record in self.records[-1000:]
+                               if record["stage"] == stage and record["status"] == 200
+                               and not (record["cached"] or record["deduplicated"] or record["hedge"]))
+        if len(latencies) < self.hedge_min_samples:
+            return None
+        return latencies[min(len(latencies) - 1, int(self.hedge_quantile * len(latencies)))]
+
+    def _hedged_post(self, payload, stage, subject, start):
+        """
+        Helper function to send a request, and a duplicate if it is still unanswered after the hedge delay.
+        Returns the first successful response.
+        """
+        delay = self._hedge_delay(stage) if self._hedge_pool is not None else None
+        if delay is None:
+            return self._post(payload, stage, subject, start)
+        primary = self._hedge_pool.submit(self._post, payload, stage, subject, start)
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            return primary.result()
+        with self._lock:
+            if self.hedges >= self.max_hedge_rate * self.sent:
+                hedge = None
+            else:
+                self.hedges += 1
+                hedge = self._hedge_pool.submit(self._post, payload, stage, subject, time.perf_counter(), True)
+        if hedge is None:
+            return primary.result()
+        pending = {primary, hedge}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        with self._lock:
+                            self.hedges_won += 1
+                    return future.result()
+        return primary.result()  # Both failed, raise the error of the original request
+
+    def _post(self, payload, stage, subject, start, hedge=False):
+        """
+        Helper function to send a request to the API with retries
+        """
+        retries = 0
+        tokens = estimate_tokens(payload)
+        data = json.dumps(payload).encode("utf-8")
+        while True:
+            self.rate_limiter.acquire(tokens)
+            body = _TimedBody(data)
+            sent = {"request_bytes": body.size}
+            try:
+                response = self._send(body)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if retries >= self.max_retries:
+                    self._record(stage, subject, start, retries, None, model=payload.get("model"), hedge=hedge, **sent)
+                    raise
+                delay = self._backoff_delay(retries)
+                print(f"Request failed ({type(e).__name__}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+                retries += 1
+                continue
+
+            if response.status_code in RETRY_STATUS_CODES and retries < self.max_retries:
+                delay = self._backoff_delay(retries, response)
+                print(f"Request failed (HTTP {response.status_code}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+                retries += 1
+                continue
+
+            sent["upload_seconds"] = body.upload_seconds
+            if not response.ok:
+                self._record(stage, subject, start, retries, response.status_code, model=payload.get("model"), hedge=hedge, **sent)
+            response.raise_for_status()  # Raise error if the request failed
+            response_data = response.json()
+            if response_data.get("usage"):
+                used = usage_tokens(response_data["usage"])
+                self.rate_limiter.reconcile(tokens, used["prompt_tokens"] + used["completion_tokens"])
+            self._record(stage, subject, start, retries, response.status_code,
+                         model=response_data.get("model") or payload.get("model"),
+                         usage=response_data.get("usage"), hedge=hedge, **sent)
+            return response_data
+
+    def _send(self, body):
+        """
+        Helper function to send a single attempt, holding a slot of the concurrency controller if one is set
+        """
+        if self.concurrency is None:
+            return self.session.post(self.url, data=body, timeout=self.timeout)
+        with self.concurrency.slot():
+            attempt_start = time.perf_counter()
+            try:
+                response = self.session.post(self.url, data=body, timeout=self.timeout)
+            except requests.exceptions.Timeout:
+                self.concurrency.record(time.perf_counter() - attempt_start, ok=False, throttled=True)
+                raise
+            except requests.exceptions.ConnectionError:
+                self.concurrency.record(time.perf_counter() - attempt_start, ok=False)
+                raise
+            self.concurrency.record(time.perf_counter() - attempt_start,
+                                    ok=response.ok,
+                                    throttled=response.status_code == 429)
+            return response
+
+    def summary(self):
+        """
+        Summarizes the recorded calls per stage
+
+        :return: Returns a dictionary mapping each stage to its number of calls, failures, retries, cache hits,
+            deduplicated calls, hedges, tokens, mean latency, bytes sent and mean upload time
+        :rtype: dict
+        """
+        with self._lock:
+            records = list(self.records)
+        summary = {}
+        for record in records:
+            stats = summary.setdefault(record["stage"], {"calls": 0, "failures": 0, "retries": 0, "cache_hits": 0,
+                                                         "deduplicated": 0, "hedges": 0, "prompt_tokens": 0,
+                                                         "completion_tokens": 0, "mean_latency": 0.0,
+                                                         "request_bytes": 0, "uploads": 0, "mean_upload": 0.0})
+            stats["calls"] += 1
+            stats["deduplicated"] += record["deduplicated"]
+            stats["hedges"] += record["hedge"]
+            stats["prompt_tokens"] += record["prompt_tokens"]
+            stats["completion_tokens"] += record["completion_tokens"]
+            stats["cache_hits"] += record["cached"] and record["status"] == 200
+            stats["retries"] += record["retries"]
+            stats["failures"] += record["status"] != 200
+            stats["mean_latency"] += (record["latency"] - stats["mean_latency"]) / stats["calls"]
+            stats["request_bytes"] += record["request_bytes"]
+            if record["upload_seconds"] is not None:
+                stats["uploads"] += 1
+                stats["mean_upload"] += (record["upload_seconds"] - stats["mean_upload"]) / stats["uploads"]
+        return summary
+
+    def print_summary(self):
+        """
+        Prints the per-stage call statistics
+        """
+        for stage, stats in self.summary().items():
+            print(f"{stage}: {stats['calls']} calls, {stats['failures']} failed, {stats['retries']} retries, "
+                  f"{stats['cache_hits']} cache hits, {stats['deduplicated']} deduplicated, {stats['hedges']} hedges, {stats['prompt_tokens']} prompt and "
+                  f"{stats['completion_tokens']} completion tokens, mean latency {stats['mean_latency']:.2f}s, "
+                  f"{stats['request_bytes'] / 1024 / 1024:.1f} MB sent, mean upload {stats['mean_upload']:.2f}s")
+        if self.cache is not None:
+            cache_stats = self.cache.stats()
+            print(f"Response cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, "
+                  f"{cache_stats['evictions']} evictions, {cache_stats['entries']} entries "
+                  f"({cache_stats['size_bytes'] / 1024 / 1024:.1f} MB)")
+        if self._hedge_pool is not None:
+            print(f"Hedged requests: {self.hedges} of {self.sent} hedged "
+                  f"({self.hedges / max(1, self.sent):.1%}), {self.hedges_won} hedges won")
+        if self.concurrency is not None:
+            metrics = self.concurrency.metrics()
+            print(f"Adaptive concurrency: limit {metrics['limit']}, {metrics['increases']} increases, "
+                  f"{metrics['decreases']} decreases, median latency {metrics['median_latency']:.2f}s")
@@ -0,0 +1,263 @@
+import json
+import uuid
+import threading
+from pathlib import Path
+from .processor_info import DataRaiderInfo
+from .image_cropping import crop_image
+from .api_access import adaptive_get_data, update_dict_with_footnotes, save_reaction_data, save_footnote_update
+from .filter_image import filter_images, check_segmentation, sort_filtered_image, sort_segmented_image
+from .reaction_dictionary_formating import update_dict_with_smiles, postprocess_dict
+
+"""
+Offline batch submission of VLM requests in the OpenAI batch format.
+Requests are written to a JSONL file instead of being sent, and a collector later
+ingests the batch results file and produces the same outputs as the interactive pipeline.
+"""
+
+BATCH_STAGES = ["filter", "check_segmentation", "get_data", "update_footnotes"]
+ID_SEPARATOR = "::"
+
+
+class BatchWriter():
+    """
+    Collects chat completion requests into a JSONL batch file.
+    Each line follows the OpenAI batch input format and its custom_id is "<stage>::<subject>".
+
+    :param batch_path: Path of the batch JSONL file to write
+    :type batch_path: str
+    """
+
+    def __init__(self, batch_path:str):
+        """Constructor method
+        """
+        self.batch_path = Path(batch_path)
+        self.batch_path.parent.mkdir(parents=True, exist_ok=True)
+        self.batch_path.write_text("")
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def add(self,
+            payload:dict,
+            stage:str,
+            subject:str):
+        """
+        Appends a request to the batch file
+
+        :param payload: JSON payload of the request
+        :type payload: dict
+        :param stage: Name of the pipeline stage issuing the request
+        :type stage: str
+        :param subject: Name of the image the request is about
+        :type subject: str
+        """
+        request = {
+            "custom_id": f"{stage}{ID_SEPARATOR}{subject}",
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": payload
+        }
+        with self._lock:
+            with open(self.batch_path, "a") as batch_file:
+                batch_file.write(json.dumps(request) + "\n")
+            self.count += 1
+
+
+def write_batch(info:DataRaiderInfo,
+                stage:str,
+                batch_path:str,
+                image_directory:str,
+                prompt_directory:str,
+                json_directory:str,
+                prompt:str=None,
+                **kwargs):
+    """
+    Writes the requests of one pipeline stage into a batch file instead of calling the API
+
+    :param info: Global information required for processing
+    :type info: DataRaiderInfo
+    :param stage: Stage to write requests for, one of BATCH_STAGES
+    :type stage: str
+    :param batch_path: Path of the batch JSONL file to write
+    :type batch_path: str
+    :param image_directory: Root directory where the original images are stored
+    :type image_directory: str
+    :param prompt_directory: Directory path to user message prompt
+    :type prompt_directory: str
+    :param json_directory: Output directory to save all output json files
+    :type json_directory: str
+    :param prompt: File name of the user message prompt of the stage, defaults to the prompt used by run_dataraider
+    :type prompt: str, optional
+    :param kwargs: Additional keyword arguments passed to the filter stages (detail, max_image_side)
+
+    :raises ValueError: If stage is not one of BATCH_STAGES
+
+    :return: Returns the number of requests written
+    :rtype: int
+    """
+    image_directory = Path(image_directory)
+    json_directory = Path(json_directory)
+    writer = BatchWriter(batch_path)
+    info.client.batch_writer = writer
+    try:
+        if stage == "filter":
+            filter_images(info, prompt_directory, prompt or "filter_image_prompt", image_directory, **kwargs)
+        elif stage == "check_segmentation":
+            check_segmentation(info, prompt_directory, image_directory, check_prompt=prompt or "check_image_prompt", **kwargs)
+        elif stage == "get_data":
+            relevant_directory = image_directory / "relevant_images"
+            for image_name in _image_names(relevant_directory):
+                crop_image(image_name, relevant_directory)
+                adaptive_get_data(info, prompt_directory, prompt or "get_data_prompt", image_name, relevant_directory, json_directory)
+        elif stage == "update_footnotes":
+            for json_path in sorted(json_directory.glob("*.json")):
+                update_dict_with_footnotes(info, prompt_directory, prompt or "update_dict_prompt", json_path.stem, json_directory)
+        else:
+            raise ValueError(f"Unknown batch stage {stage}. Choose from {BATCH_STAGES}.")
+    finally:
+        info.client.batch_writer = None
+    print(f"{writer.count} {stage} requests written to {writer.batch_path}")
+    return writer.count
+
+
+def _image_names(image_directory:Path):
+    """
+    Helper function to list the names of all images in a directory
+    """
+    image_extensions = {".png", ".jpg", ".jpeg", ".webp"}
+    if not image_directory.exists():
+        return []
+    return sorted(file.stem for file in image_directory.iterdir()
+                  if file.is_file() and file.suffix.lower() in image_extensions)
+
+
+def _find_image(image_directory:Path, file_name:str):
+    """
+    Helper function to locate an image named in a custom_id
+    """
+    path = image_directory / file_name
+    return path if path.exists() else None
+
+
+def read_batch_results(results_path:str):
+    """
+    Reads a batch results file
+
+    :param results_path: Path of the batch output JSONL file
+    :type results_path: str
+
+    :return: Yields the stage, subject and response content (None for failed requests) of every result
+    :rtype: Iterator[tuple[str, str, str]]
+    """
+    with open(results_path, "r") as results_file:
+        for line in results_file:
+            if not line.strip():
+                continue
+            result = json.loads(line)
+            stage, _, subject = result["custom_id"].partition(ID_SEPARATOR)
+            response = result.get("response") or {}
+            if result.get("error") or response.get("status_code") != 200:
+                print(f"Batch request {result['custom_id']} failed: {result.get('error') or response.get('status_code')}")
+                yield stage, subject, None
+                continue
+            yield stage, subject, response["body"]["choices"][0]["message"]["content"]
+
+
+def collect_batch_results(info:DataRaiderInfo,
+                          results_path:str,
+                          image_directory:str,
+                          json_directory:str):
+    """
+    Ingests a batch results file and writes the same outputs as the interactive pipeline.
+    Filter results sort the images into relevant and irrelevant folders, segmentation checks move
+    improperly segmented images aside, extraction results are saved as reaction dictionaries and
+    footnote updates are saved and then postprocessed and completed with reaction SMILES.
+
+    :param info: Global information required for processing
+    :type info: DataRaiderInfo
+    :param results_path: Path of the batch output JSONL file
+    :type results_path: str
+    :param image_directory: Root directory where the original images are stored
+    :type image_directory: str
+    :param json_directory: Output directory to save all output json files
+    :type json_directory: str
+
+    :return: Returns the number of results collected per stage
+    :rtype: dict[str, int]
+    """
+    image_directory = Path(image_directory)
+    json_directory = Path(json_directory)
+    relevant_directory = image_directory / "relevant_images"
+    counts = {}
+    for stage, subject, content in read_batch_results(results_path):
+        if content is None:
+            continue
+        if stage == "filter":
+            (image_directory / "relevant_images").mkdir(parents=True, exist_ok=True)
+            (image_directory / "irrelevant_images").mkdir(parents=True, exist_ok=True)
+            file = _find_image(image_directory, subject)
+            if file is None:
+                continue
+            sort_filtered_image(file, image_directory, content)
+        elif stage == "check_segmentation":
+            improperly_segmented_folder = relevant_directory / "improperly_segmented_images"
+            improperly_segmented_folder.mkdir(parents=True, exist_ok=True)
+            file = _find_image(relevant_directory, subject)
+            if file is None:
+                continue
+            sort_segmented_image(file, improperly_segmented_folder, content)
+        elif stage == "get_data":
+            json_directory.mkdir(parents=True, exist_ok=True)
+            save_reaction_data(json_directory / f"{subject}.json", content)
+        elif stage == "update_footnotes":
+            save_footnote_update(json_directory / f"{subject}.json", content)
+            try:
+                postprocess_dict(subject, json_directory)
+                update_dict_with_smiles(info, subject, relevant_directory, json_directory)
+            except Exception as e:
+                print(f"Error completing {subject}: {e}")
+                continue
+        else:
+            print(f"Unknown batch stage {stage} for {subject}, skipping.")
+            continue
+        counts[stage] = counts.get(stage, 0) + 1
+    print(f"Collected batch results: {counts}")
+    return counts
+
+
+def simulate_batch_results(batch_path:str,
+                           results_path:str,
+                           respond):
+    """
+    Local stand-in for the batch API. Answers every request of a batch file with respond and
+    writes the answers in the OpenAI batch output format, so the collector can be tested offline.
+
+    :param batch_path: Path of the batch JSONL file
+    :type batch_path: str
+    :param results_path: Path of the batch output JSONL file to write
+    :type results_path: str
+    :param respond: Callable that takes a request body and returns a chat completion response,
+        e.g. a canned responder or APIClient.chat_completion pointed at a local server
+    :type respond: Callable[[dict], dict]
+
+    :return: Returns nothing, all results saved in results_path
+    :rtype: None
+    """
+    with open(batch_path, "r") as batch_file, open(results_path, "w") as results_file:
+        for line in batch_file:
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            try:
+                result = {"status_code": 200,
+                          "request_id": uuid.uuid4().hex,
+                          "body": respond(request["body"])}
+                error = None
+            except Exception as e:
+                result = None
+                error = {"code": type(e).__name__, "message": str(e)}
+            results_file.write(json.dumps({
+                "id": f"batch_req_{uuid.uuid4().hex}",
+                "custom_id": request["custom_id"],
+                "response": result,
+                "error": error
+            }) + "\n")
@@ -0,0 +1,136 @@
+import re
+import sqlite3
+import unicodedata
+from pathlib import Path
+
+"""
+Module for the local dictionary of chemical names, looked up before any network call
+"""
+
+DASHES = "-‐‑‒–—―−﹘﹣－"
+_FOLD_DASHES = str.maketrans({dash: None for dash in DASHES})
+FORMULA_PATTERN = re.compile(r"^(?:[A-Z][a-z]?\d*)+$")
+_MIXED_CASE = re.compile(r"[a-z]\d*[A-Z]")
+_AMBIGUOUS = object()
+
+_default_dictionary = None
+
+
+def normalize_name(name:str):
+    """
+    Normalizes a chemical name for lookups: Unicode compatibility forms are folded (e.g. full-width
+    characters), all dashes and whitespace are removed, and case is folded for ordinary names, so that
+    "n-Bu4NBF4", "nBu4NBF4" and "n‐Bu4NBF4" share the same key, as do "Toluene" and "toluene". Names that
+    look like formulas or element symbols ("CO", "Co", "HF", "nBu4NBF4") keep their case, since it
+    distinguishes different chemicals.
+
+    :param name: Chemical name
+    :type name: str
+
+    :return: Returns the normalized key
+    :rtype: str
+    """
+    name = "".join(unicodedata.normalize("NFKC", name).translate(_FOLD_DASHES).split())
+    if FORMULA_PATTERN.match(name) or _MIXED_CASE.search(name):
+        return name
+    return name.casefold()
+
+
+class ChemicalDictionary(dict):
+    """
+    Dictionary of chemical names that falls back to a normalized-key index (see normalize_name) when a
+    name has no exact entry, so spelling variants need no entries of their own. Both lookups are O(1).
+    When different values share a normalized key only exact lookups resolve them.
+
+    :param entries: Initial entries, defaults to None
+    :type entries: dict, optional
+    """
+
+    def __init__(self, entries:dict=None):
+        """Constructor method
+        """
+        super().__init__()
+        self._normalized = {}
+        self.update(entries or {})
+
+    def __setitem__(self, name:str, value:str):
+        super().__setitem__(name, value)
+        key = normalize_name(name)
+        if self._normalized.get(key, value) != value:
+            value = _AMBIGUOUS
+        self._normalized[key] = value
+
+    def __missing__(self, name:str):
+        value = self._normalized.get(normalize_name(name), _AMBIGUOUS)
+        if value is _AMBIGUOUS:
+            raise KeyError(name)
+        return value
+
+    def update(self, entries=(), **kwargs):
+        for name, value in dict(entries, **kwargs).items():
+            self[name] = value
+
+    def get(self, name:str, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def __contains__(self, name):
+        return self.get(name) is not None
+
+    @classmethod
+    def load(cls, path:str):
+        """
+        Loads a synonym table. Tab-separated files hold one "synonym<TAB>value" pair per line (lines starting
+        with # are skipped). SQLite databases (.db, .sqlite) hold a table synonyms with columns synonym and value.
+
+        :param path: Path of the table
+        :type path: str
+
+        :return: Returns the dictionary
+        :rtype: ChemicalDictionary
+        """
+        path = Path(path)
+        dictionary = cls()
+        if path.suffix.lower() in (".db", ".sqlite", ".sqlite3"):
+            connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+            try:
+                for synonym, value in connection.execute("SELECT synonym, value FROM synonyms"):
+                    if synonym and value:
+                        dictionary[synonym] = value
+            finally:
+                connection.close()
+            return dictionary
+        with open(path, "r", encoding="utf-8") as file:
+            for line in file:
+                if not line.strip() or line.startswith("#"):
+                    continue
+                synonym, _, value = line.rstrip("\n").partition("\t")
+                if synonym.strip() and value.strip():
+                    dictionary[synonym.strip()] = value.strip()
+        return dictionary
+
+
+def get_chemical_dictionary():
+    """
+    Returns the process-wide local dictionary of chemical names to SMILES
+
+    :return: Returns the dictionary set with set_chemical_dictionary, or an empty dictionary if none was set
+    :rtype: ChemicalDictionary
+    """
+    global _default_dictionary
+    if _default_dictionary is None:
+        _default_dictionary = ChemicalDictionary()
+    return _default_dictionary
+
+
+def set_chemical_dictionary(dictionary:ChemicalDictionary):
+    """
+    Sets the process-wide local dictionary of chemical names to SMILES, consulted before PubChem
+
+    :param dictionary: The dictionary, or None to go back to an empty dictionary
+    :type dictionary: ChemicalDictionary
+    """
+    global _default_dictionary
+    _default_dictionary = dictionary
@@ -1,8 +1,8 @@
 import os
 import requests
 import shutil
-import base64
 from .processor_info import DataRaiderInfo
+from .image_encoding import image_content
 from pathlib import Path
 import json
 
@@ -10,12 +10,78 @@ import json
 Filter images using OpenAI model
 """
 
+def sort_filtered_image(file:Path, 
+                        image_directory:Path, 
+                        response_data:str):
+    """
+    Moves an image into the relevant or irrelevant folder according to the filter response.
+
+    :param file: Path to the filtered image.
+    :type file: Path
+    :param image_directory: Path to the directory containing images to be filtered.
+    :type image_directory: Path
+    :param response_data: Content of the VLM response.
+    :type response_data: str
+
+    :return: None
+    :rtype: None
+    """
+    try: 
+        destination = "relevant_images" if "true" in response_data.lower() else "irrelevant_images"
+        destination_path = image_directory / destination / file.name
+        if not destination_path.exists():
+            shutil.move(str(file), str(destination_path))
+            print(f"Moved {file} to {destination} folder")
+    except Exception as e:
+        return
+
+
+def sort_segmented_image(file:Path, 
+                         improperly_segmented_folder:Path, 
+                         response_data:str):
+    """
+    Moves an improperly segmented image aside together with a log of the VLM justification.
+
+    :param file: Path to the checked image.
+    :type file: Path
+    :param improperly_segmented_folder: Path to the folder collecting improperly segmented images.
+    :type improperly_segmented_folder: Path
+    :param response_data: Content of the VLM response.
+    :type response_data: str
+
+    :return: None
+    :rtype: None
+    """
+    try: 
+        is_proper = "true" in response_data.lower()
+        if not is_proper:
+            destination_path = improperly_segmented_folder / file.name
+            if not destination_path.exists():
+                shutil.move(str(file), str(destination_path))
+            # print(f"Moved {file} to {destination} folder")
+        
+            try: 
+                response_json = json.loads(response_data)
+            except json.JSONDecodeError:
+                response_json = {"raw_response": response_data}
+            log_file_path = improperly_segmented_folder / f"{file.stem}_segmentation_error_log.json"
+            with open(log_file_path, "w") as log_file:
+                json.dump(response_json, log_file, indent=2)
+                # print(f"Log saved for {file.name} at {log_file_path}\n")
+    except Exception as e:
+        return
+
+
 def filter_images(info:DataRaiderInfo, 
                  prompt_directory:str, 
                  filter_prompt:str, 
-                 image_directory:str): 
+                 image_directory:str,
+                 detail:str="low",
+                 max_image_side:int=512,
+                 skip_images:set=None): 
     """
     Determines if an image and its caption is relevant to the specified task.
+    Images are downscaled before upload since a relevance decision needs little detail.
     
     :param info: Global information required for processing containing API credentials and model details (must have `api_key` and `vlm_model` attributes).
     :type info: DataRaiderInfo
@@ -25,12 +91,19 @@ def filter_images(info:DataRaiderInfo,
     :type filter_prompt: str
     :param image_directory: Path to the directory containing images to be filtered.
     :type image_directory: str
+    :param detail: Detail level requested from the VLM, defaults to "low"
+    :type detail: str, optional
+    :param max_image_side: Maximum length in pixels of the longest image side, defaults to 512
+    :type max_image_side: int, optional
+    :param skip_images: Names of images left unfiltered, e.g. near-duplicates set aside by deduplicate_images, defaults to None
+    :type skip_images: set[str], optional
 
     :return: None
     :rtype: None    
     """
     prompt_directory = Path(prompt_directory)
     image_directory = Path(image_directory)
+    skip_images = skip_images or set()
 
     #create folders to separate relevant and irrelevant folders 
     relevant_folder = image_directory / "relevant_images"
@@ -41,11 +114,10 @@ def filter_images(info:DataRaiderInfo,
     image_extensions = {".png", ".jpg", ".jpeg", ".webp"}
 
     for file in image_directory.iterdir():
-        if file.is_file() and file.suffix.lower() in image_extensions:
+        if file.is_file() and file.suffix.lower() in image_extensions and file.name not in skip_images:
             print(f"Processing {file}")
             try: 
-                with open(file, "rb") as image_file:
-                    image_data = base64.b64encode(image_file.read()).decode('utf-8')
+                image_entry = image_content(file, detail, max_image_side)
             except Exception as e:
                 print(f"Error reading image {file}:{e}")
                 continue
@@ -63,22 +135,12 @@ def filter_images(info:DataRaiderInfo,
                             "type": "text",
                             "text": user_message
                         },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{image_data}"
-                            }
-                        }
+                        image_entry
                     ]
                 }
             ]
 
-            # API request headers and payload
-            headers = {
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {info.api_key}"
-            }
-
+            # API request payload
             payload = {
                 "model": info.vlm_model,
                 "messages": messages,
@@ -86,28 +148,24 @@ def filter_images(info:DataRaiderInfo,
             }
             # Send API request
             try:
-                response = requests.post("https://api.openai.com/v1/chat/completions", headers=headers, json=payload)
-                response.raise_for_status()  # Raise error if the request failed
-                response_data = response.json()['choices'][0]['message']['content']
-
-                try: 
-                    destination = "relevant_images" if "true" in response_data.lower() else "irrelevant_images"
-                    destination_path = image_directory / destination / file.name
-                    if not destination_path.exists():
-                        shutil.move(str(file), str(destination_path))
-                        print(f"Moved {file} to {destination} folder")
-                except Exception as e:
+                response = info.client.chat_completion(payload, stage="filter", subject=file.name)
+                if response is None: # Request deferred to a batch file
                     continue
+                response_data = response['choices'][0]['message']['content']
+                sort_filtered_image(file, image_directory, response_data)
             except requests.exceptions.RequestException as e:
                 print(f"Error during API request: {e}")
 
 def check_segmentation(info:DataRaiderInfo, 
                  prompt_directory:str, 
                  image_directory:str,
-                 check_prompt:str="check_image_prompt"
+                 check_prompt:str="check_image_prompt",
+                 detail:str="low",
+                 max_image_side:int=512
                  ): 
     """
     Determines if the image segmentation is done properly.
+    Images are downscaled before upload since the check only needs the overall layout.
     
     :param info: Global information required for processing containing API credentials and model details (must have `api_key` and `vlm_model` attributes).
     :type info: DataRaiderInfo
@@ -117,6 +175,10 @@ def check_segmentation(info:DataRaiderInfo,
     :type check_prompt: str
     :param image_directory: Path to the directory containing images to be filtered.
     :type image_directory: str
+    :param detail: Detail level requested from the VLM, defaults to "low"
+    :type detail: str, optional
+    :param max_image_side: Maximum length in pixels of the longest image side, defaults to 512
+    :type max_image_side: int, optional
 
     :return: None
     :rtype: None    
@@ -143,8 +205,7 @@ def check_segmentation(info:DataRaiderInfo,
         if file.is_file() and file.suffix.lower() in image_extensions:
             # print(f"\nProcessing {file}")
             try: 
-                with open(file, "rb") as image_file:
-                    image_data = base64.b64encode(image_file.read()).decode('utf-8')
+                image_entry = image_content(file, detail, max_image_side)
             except Exception as e:
                 print(f"Error reading image {file}:{e}")
                 continue
@@ -162,22 +223,12 @@ def check_segmentation(info:DataRaiderInfo,
                             "type": "text",
                             "text": user_message
                         },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{image_data}"
-                            }
-                        }
+                        image_entry
                     ]
                 }
             ]
 
-            # API request headers and payload
-            headers = {
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {info.api_key}"
-            }
-
+            # API request payload
             payload = {
                 "model": info.vlm_model,
                 "messages": messages,
@@ -185,27 +236,10 @@ def check_segmentation(info:DataRaiderInfo,
             }
             # Send API request
             try:
-                response = requests.post("https://api.openai.com/v1/chat/completions", headers=headers, json=payload)
-                response.raise_for_status()  # Raise error if the request failed
-                response_data = response.json()['choices'][0]['message']['content']
-
-                try: 
-                    is_proper = "true" in response_data.lower()
-                    if not is_proper:
-                        destination_path = improperly_segmented_folder / file.name
-                        if not destination_path.exists():
-                            shutil.move(str(file), str(destination_path))
-                        # print(f"Moved {file} to {destination} folder")
-                    
-                        try: 
-                            response_json = json.loads(response_data)
-                        except json.JSONDecodeError:
-                            response_json = {"raw_response": response_data}
-                        log_file_path = improperly_segmented_folder / f"{file.stem}_segmentation_error_log.json"
-                        with open(log_file_path, "w") as log_file:
-                            json.dump(response_json, log_file, indent=2)
-                            # print(f"Log saved for {file.name} at {log_file_path}\n")
-                except Exception as e:
+                response = info.client.chat_completion(payload, stage="check_segmentation", subject=file.name)
+                if response is None: # Request deferred to a batch file
                     continue
+                response_data = response['choices'][0]['message']['content']
+                sort_segmented_image(file, improperly_segmented_folder, response_data)
             except requests.exceptions.RequestException as e:
                 print(f"Error during API request: {e}")
\ No newline at end of file
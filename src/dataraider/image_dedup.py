@@ -0,0 +1,334 @@
+import json
+import cv2
+import numpy as np
+from pathlib import Path
+from itertools import combinations
+from concurrent.futures import ThreadPoolExecutor
+
+"""
+Module for the perceptual-hash de-duplication of figures before filtering.
+Near-duplicate images (the same figure re-rendered at another DPI, or the same table in the
+preprint and the published version) are clustered and only one representative per cluster is
+sent to the VLM. The other members are recorded as set aside, skipped by filtering, and linked
+to the representative's results.
+"""
+
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".webp"}
+LOSSLESS_EXTENSIONS = {".png"}
+DUPLICATE_FOLDER = "duplicate_images"
+CLUSTERS_FILE = "duplicate_clusters.json"
+LINKS_FILE = "links.json"
+
+
+def hamming_distance(hash_a:int, hash_b:int):
+    """
+    Counts the differing bits of two hashes
+
+    :param hash_a: First hash
+    :type hash_a: int
+    :param hash_b: Second hash
+    :type hash_b: int
+
+    :return: Returns the Hamming distance
+    :rtype: int
+    """
+    return bin(hash_a ^ hash_b).count("1")
+
+
+def _bits_to_int(bits:np.ndarray):
+    """
+    Helper function to pack a boolean array into an integer hash
+    """
+    value = 0
+    for bit in bits.flatten():
+        value = (value << 1) | int(bit)
+    return value
+
+
+def dhash(image:np.ndarray, hash_size:int=8):
+    """
+    Computes the difference hash of a grayscale image: the sign of the horizontal gradient
+    on a (hash_size + 1) x hash_size thumbnail
+
+    :param image: Grayscale image
+    :type image: numpy.ndarray
+    :param hash_size: Side of the hash grid, defaults to 8 (64-bit hash)
+    :type hash_size: int
+
+    :return: Returns the hash
+    :rtype: int
+    """
+    thumbnail = cv2.resize(image, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    return _bits_to_int(thumbnail[:, 1:] > thumbnail[:, :-1])
+
+
+def phash(image:np.ndarray, hash_size:int=8, highfreq_factor:int=4):
+    """
+    Computes the perceptual hash of a grayscale image: the low-frequency DCT coefficients
+    of a thumbnail compared to their median
+
+    :param image: Grayscale image
+    :type image: numpy.ndarray
+    :param hash_size: Side of the hash grid, defaults to 8 (64-bit hash)
+    :type hash_size: int
+    :param highfreq_factor: Ratio between the thumbnail side and hash_size, defaults to 4
+    :type highfreq_factor: int
+
+    :return: Returns the hash
+    :rtype: int
+    """
+    side = hash_size * highfreq_factor
+    thumbnail = cv2.resize(image, (side, side), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low_frequencies = cv2.dct(thumbnail)[:hash_size, :hash_size]
+    median = np.median(low_frequencies.flatten()[1:]) # The DC term only encodes brightness
+    return _bits_to_int(low_frequencies > median)
+
+
+HASH_FUNCTIONS = {"phash": phash, "dhash": dhash}
+
+
+def image_hash(image_path:str, method:str="phash"):
+    """
+    Reads an image and computes its perceptual hash
+
+    :param image_path: Path to the image
+    :type image_path: str
+    :param method: Hash function, "phash" or "dhash", defaults to "phash"
+    :type method: str
+
+    :return: Returns the hash and the pixel area of the image, or None if the image cannot be read
+    :rtype: tuple[int, int]
+    """
+    image = cv2.imread(str(image_path), cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        return None
+    return HASH_FUNCTIONS[method](image), image.shape[0] * image.shape[1]
+
+
+class MultiIndexHash():
+    """
+    Multi-index hashing over integer hashes with the Hamming distance.
+    Each hash is split into m disjoint chunks of chunk_bits bits, each indexed in its own table.
+    Two hashes within max_distance of each other differ in at most max_distance // m bits in at
+    least one chunk (pigeonhole principle), so a range query only looks up the chunk values within
+    that small radius and compares against the few hashes stored under them, instead of the whole
+    collection. This keeps clustering fast for 100k images.
+
+    :param max_distance: Maximum Hamming distance of a range query
+    :type max_distance: int
+    :param bits: Number of bits of the hashes, defaults to 64
+    :type bits: int
+    :param chunk_bits: Number of bits of each chunk, defaults to 16
+    :type chunk_bits: int
+    """
+
+    def __init__(self, max_distance:int, bits:int=64, chunk_bits:int=16):
+        """Constructor method
+        """
+        self.max_distance = max_distance
+        chunks = max(1, bits // chunk_bits)
+        bounds = [round(i * bits / chunks) for i in range(chunks + 1)]
+        self._chunks = [(low, (1 << (high - low)) - 1) for low, high in zip(bounds, bounds[1:])]
+        # Bit flips turning a chunk value into every value within the chunk search radius
+        radius = max_distance // chunks
+        self._flips = []
+        for low, high in zip(bounds, bounds[1:]):
+            flips = [0]
+            for flipped_bits in range(1, radius + 1):
+                flips.extend(sum(1 << bit for bit in combination)
+                             for combination in combinations(range(high - low), flipped_bits))
+            self._flips.append(flips)
+        self._tables = [{} for _ in self._chunks]
+        self._entries = []
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, hash_value:int, item):
+        """
+        Inserts a hash
+
+        :param hash_value: Hash to insert
+        :type hash_value: int
+        :param item: Value returned by queries matching the hash
+        :type item: Any
+        """
+        index = len(self._entries)
+        self._entries.append((hash_value, item))
+        for table, (shift, mask) in zip(self._tables, self._chunks):
+            table.setdefault((hash_value >> shift) & mask, []).append(index)
+
+    def query(self, hash_value:int):
+        """
+        Finds all hashes within max_distance of a hash
+
+        :param hash_value: Hash to look up
+        :type hash_value: int
+
+        :return: Returns the items and distances of all matches
+        :rtype: list[tuple[Any, int]]
+        """
+        candidates = set()
+        for table, (shift, mask), flips in zip(self._tables, self._chunks, self._flips):
+            chunk = (hash_value >> shift) & mask
+            for flip in flips:
+                candidates.update(table.get(chunk ^ flip, ()))
+        matches = []
+        for index in candidates:
+            candidate_hash, item = self._entries[index]
+            distance = hamming_distance(hash_value, candidate_hash)
+            if distance <= self.max_distance:
+                matches.append((item, distance))
+        return matches
+
+
+def cluster_duplicates(hashes:dict, max_distance:int=6, quality:dict=None, representatives:set=None):
+    """
+    Groups hashes into clusters of near-duplicates around representatives. Images are visited from
+    the best to the worst quality; each joins the cluster of the closest representative within
+    max_distance, or else becomes the representative of a new cluster. Every member is thus within
+    max_distance of its representative, and chains of small differences do not merge distinct images.
+    Fixed representatives are visited first and never join another cluster.
+
+    :param hashes: Hash of every image name
+    :type hashes: dict[str, int]
+    :param max_distance: Maximum Hamming distance between near-duplicates, defaults to 6 (of 64 bits)
+    :type max_distance: int
+    :param quality: Sort key of every image name, higher is better, defaults to None (image names)
+    :type quality: dict, optional
+    :param representatives: Image names that stay representatives, e.g. those of earlier runs, defaults to None
+    :type representatives: set[str], optional
+
+    :return: Returns the members of every cluster, a sorted list of image names keyed by representative
+    :rtype: dict[str, list[str]]
+    """
+    representatives = representatives or set()
+    order = sorted(hashes, key=lambda name: (name in representatives, quality[name] if quality else (), name), reverse=True)
+    index = MultiIndexHash(max_distance)
+    clusters = {}
+    for name in order:
+        matches = index.query(hashes[name]) if name not in representatives else None
+        if matches:
+            representative, _ = min(matches, key=lambda match: (match[1], match[0]))
+            clusters[representative].append(name)
+        else:
+            index.add(hashes[name], name)
+            clusters[name] = [name]
+    return {representative: sorted(members) for representative, members in clusters.items()}
+
+
+def duplicate_images(image_directory:str):
+    """
+    Lists the images set aside as near-duplicates by deduplicate_images
+
+    :param image_directory: Directory containing the images extracted by VisualHeist
+    :type image_directory: str
+
+    :return: Returns the names of all cluster members other than the representatives
+    :rtype: set[str]
+    """
+    clusters_path = Path(image_directory) / CLUSTERS_FILE
+    if not clusters_path.exists():
+        return set()
+    with open(clusters_path, "r") as f:
+        clusters = json.load(f)
+    return {member for representative, members in clusters.items() for member in members if member != representative}
+
+
+def deduplicate_images(image_directory:str,
+                       max_distance:int=6,
+                       method:str="phash",
+                       workers:int=8):
+    """
+    Clusters near-duplicate images and records all but one representative per cluster as set aside
+    in image_directory/duplicate_clusters.json, merged with those of earlier runs. Images are left in
+    place; filter_images skips the set-aside ones (see duplicate_images), so only representatives are
+    filtered and processed. The representative is the member with the largest pixel area, preferring
+    lossless formats. Images set aside in earlier runs are not clustered again, and representatives of
+    earlier runs stay representatives, so their results are kept and new duplicates join their clusters.
+
+    :param image_directory: Directory containing the images extracted by VisualHeist
+    :type image_directory: str
+    :param max_distance: Maximum Hamming distance between near-duplicates, defaults to 6 (of 64 bits)
+    :type max_distance: int
+    :param method: Hash function, "phash" or "dhash", defaults to "phash"
+    :type method: str
+    :param workers: Number of threads computing hashes, defaults to 8
+    :type workers: int
+
+    :return: Returns the members of every cluster with more than one image, keyed by representative
+    :rtype: dict[str, list[str]]
+    """
+    image_directory = Path(image_directory)
+    set_aside = duplicate_images(image_directory)
+    files = sorted(file for file in image_directory.iterdir()
+                   if file.is_file() and file.suffix.lower() in IMAGE_EXTENSIONS and file.name not in set_aside)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(lambda file: image_hash(file, method), files))
+
+    hashes = {}
+    quality = {}
+    for file, result in zip(files, results):
+        if result is None:
+            print(f"Error reading image {file}, not deduplicated")
+            continue
+        hashes[file.name], area = result
+        quality[file.name] = (area, file.suffix.lower() in LOSSLESS_EXTENSIONS, file.stat().st_size)
+
+    clusters_path = image_directory / CLUSTERS_FILE
+    clusters = {}
+    if clusters_path.exists():
+        with open(clusters_path, "r") as f:
+            clusters = json.load(f)
+    new_duplicates = 0
+    for representative, members in cluster_duplicates(hashes, max_distance, quality, set(clusters)).items():
+        if len(members) < 2:
+            continue
+        new_duplicates += len(members) - 1
+        clusters[representative] = sorted(set(clusters.get(representative, []) + members))
+
+    with open(clusters_path, "w") as f:
+        json.dump(clusters, f, indent=4)
+    print(f"{len(hashes)} images hashed, {new_duplicates} near-duplicates set aside (listed in {clusters_path})")
+    return clusters
+
+
+def link_duplicate_results(image_directory:str,
+                           json_directory:str):
+    """
+    Links every set-aside duplicate to the reaction data of its cluster representative.
+    Writes image_directory/duplicate_images/links.json mapping each duplicate image to its representative
+    and the path of the representative's reaction dictionary (None if the representative yielded no data,
+    e.g. because it was filtered out as irrelevant). The mapping is kept out of json_directory so that
+    KGWizard does not read it as a reaction.
+
+    :param image_directory: Directory containing the images extracted by VisualHeist
+    :type image_directory: str
+    :param json_directory: Output directory of the reaction dictionaries
+    :type json_directory: str
+
+    :return: Returns the mapping written, keyed by duplicate image name
+    :rtype: dict[str, dict]
+    """
+    image_directory = Path(image_directory)
+    clusters_path = image_directory / CLUSTERS_FILE
+    json_directory = Path(json_directory)
+    if not clusters_path.exists():
+        return {}
+    with open(clusters_path, "r") as f:
+        clusters = json.load(f)
+
+    links = {}
+    for representative, members in clusters.items():
+        reaction_path = json_directory / f"{Path(representative).stem}.json"
+        for member in members:
+            if member == representative:
+                continue
+            links[Path(member).stem] = {
+                "representative": Path(representative).stem,
+                "reaction_data": str(reaction_path) if reaction_path.exists() else None
+            }
+    (image_directory / DUPLICATE_FOLDER).mkdir(parents=True, exist_ok=True)
+    with open(image_directory / DUPLICATE_FOLDER / LINKS_FILE, "w") as f:
+        json.dump(links, f, indent=4)
+    return links
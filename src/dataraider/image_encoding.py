@@ -0,0 +1,180 @@
+import base64
+import cv2
+import numpy as np
+from pathlib import Path
+
+"""
+Module for encoding images into data URLs for VLM requests
+"""
+
+MIME_TYPES = {".png": "image/png",
+              ".jpg": "image/jpeg",
+              ".jpeg": "image/jpeg",
+              ".webp": "image/webp"}
+
+COMPACT_FORMATS = ("png", "webp", "jpeg")
+
+
+def _candidate_encodings(formats:tuple, quality:int):
+    """
+    Helper function to list the encodings tried by compact_encode_image
+
+    :return: Returns the extension, MIME type, OpenCV parameters and losslessness of each candidate
+    :rtype: list[tuple[str, str, list, bool]]
+    """
+    candidates = []
+    for image_format in formats:
+        if image_format == "png":
+            candidates.append((".png", "image/png", [cv2.IMWRITE_PNG_COMPRESSION, 6], True))
+        elif image_format == "webp":
+            candidates.append((".webp", "image/webp", [cv2.IMWRITE_WEBP_QUALITY, 101], True)) # Quality above 100 is lossless
+            candidates.append((".webp", "image/webp", [cv2.IMWRITE_WEBP_QUALITY, quality], False))
+        elif image_format in ("jpeg", "jpg"):
+            candidates.append((".jpg", "image/jpeg", [cv2.IMWRITE_JPEG_QUALITY, quality], False))
+        else:
+            print(f"Unknown image format {image_format}, skipped")
+    return candidates
+
+
+def _decode_opaque(content:bytes):
+    """
+    Helper function to decode an image as 8-bit BGR, compositing any transparency onto white
+
+    :return: Returns the image, or None if it cannot be decoded
+    :rtype: numpy.ndarray
+    """
+    buffer = np.frombuffer(content, np.uint8)
+    image = cv2.imdecode(buffer, cv2.IMREAD_UNCHANGED)
+    if image is not None and image.ndim == 3 and image.shape[2] == 3 and image.dtype == np.uint8:
+        return image
+    if image is None or image.ndim != 3 or image.shape[2] != 4:
+        return cv2.imdecode(buffer, cv2.IMREAD_COLOR) # Grayscale or 16-bit images without transparency
+    scale = float(np.iinfo(image.dtype).max) if image.dtype.kind in "ui" else 1.0
+    alpha = image[:, :, 3:].astype(np.float32) / scale
+    color = image[:, :, :3].astype(np.float32) / scale
+    return np.round((color * alpha + (1 - alpha)) * 255).astype(np.uint8)
+
+
+def is_monochrome(image:np.ndarray,
+                  tolerance:int=8):
+    """
+    Checks whether a color image only holds shades of gray, as most scanned or rendered tables do
+
+    :param image: BGR image
+    :type image: numpy.ndarray
+    :param tolerance: Maximum difference between the channels of a pixel, defaults to 8
+    :type tolerance: int, optional
+
+    :return: Returns True if every pixel has (nearly) equal channels
+    :rtype: bool
+    """
+    if image.ndim == 2:
+        return True
+    channels = image[:, :, :3].astype(np.int16)
+    spread = channels.max(axis=2) - channels.min(axis=2)
+    return int(spread.max()) <= tolerance
+
+
+def compact_encode_image(image_path:str,
+                         formats:tuple=COMPACT_FORMATS,
+                         quality:int=90,
+                         min_psnr:float=40.0,
+                         grayscale:bool=True):
+    """
+    Base64-encodes an image in the smallest acceptable representation. Transparent images are
+    composited onto white and monochrome images are converted to grayscale, then the image is
+    re-encoded in every candidate format and the smallest result is kept: lossless encodings are
+    always acceptable, lossy ones (WebP and JPEG at the given quality) only if their PSNR against the
+    image is at least min_psnr, so that small table text stays legible. The original file is kept if
+    no candidate is smaller.
+
+    :param image_path: Path to the image
+    :type image_path: str
+    :param formats: Formats to try among "png", "webp" and "jpeg", defaults to ("png", "webp", "jpeg")
+    :type formats: tuple[str], optional
+    :param quality: Quality of the lossy encodings, from 0 to 100, defaults to 90
+    :type quality: int, optional
+    :param min_psnr: Minimum peak signal-to-noise ratio in dB of an acceptable lossy encoding, defaults to 40
+    :type min_psnr: float, optional
+    :param grayscale: Whether to convert monochrome images to grayscale, defaults to True
+    :type grayscale: bool, optional
+
+    :return: Returns the base64-encoded image, its MIME type, and the sizes in bytes of the original file and of the encoding
+    :rtype: tuple[str, str, int, int]
+    """
+    image_path = Path(image_path)
+    with open(image_path, "rb") as image_file:
+        original = image_file.read()
+    best, best_mime = original, MIME_TYPES.get(image_path.suffix.lower(), "image/png")
+
+    image = _decode_opaque(original)
+    if image is not None:
+        if grayscale and is_monochrome(image):
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        for extension, mime_type, params, lossless in _candidate_encodings(formats, quality):
+            success, buffer = cv2.imencode(extension, image, params)
+            if not success or buffer.size >= len(best):
+                continue
+            if not lossless:
+                decoded = cv2.imdecode(buffer, cv2.IMREAD_UNCHANGED)
+                if decoded is None or decoded.shape != image.shape or cv2.PSNR(image, decoded) < min_psnr:
+                    continue
+            best, best_mime = buffer.tobytes(), mime_type
+
+    return base64.b64encode(best).decode('utf-8'), best_mime, len(original), len(best)
+
+
+def encode_image(image_path:str,
+                 max_image_side:int=None):
+    """
+    Base64-encodes an image, downscaling it first if its longest side exceeds max_image_side
+
+    :param image_path: Path to the image
+    :type image_path: str
+    :param max_image_side: Maximum length in pixels of the longest side, defaults to None (no downscaling)
+    :type max_image_side: int, optional
+
+    :return: Returns the base64-encoded image and its MIME type
+    :rtype: tuple[str, str]
+    """
+    image_path = Path(image_path)
+    if max_image_side:
+        image = cv2.imread(str(image_path), cv2.IMREAD_UNCHANGED)
+        if image is not None and max(image.shape[:2]) > max_image_side:
+            height, width = image.shape[:2]
+            scale = max_image_side / max(height, width)
+            new_size = (max(1, round(width * scale)), max(1, round(height * scale)))
+            image = cv2.resize(image, new_size, interpolation=cv2.INTER_AREA)
+            success, buffer = cv2.imencode(".png", image)
+            if success:
+                return base64.b64encode(buffer.tobytes()).decode('utf-8'), "image/png"
+
+    with open(image_path, "rb") as image_file:
+        image_data = base64.b64encode(image_file.read()).decode('utf-8')
+    return image_data, MIME_TYPES.get(image_path.suffix.lower(), "image/png")
+
+
+def image_content(image_path:str,
+                  detail:str="auto",
+                  max_image_side:int=None):
+    """
+    Builds an image_url message content entry for a chat completion request
+
+    :param image_path: Path to the image
+    :type image_path: str
+    :param detail: Detail level requested from the VLM ("low", "high" or "auto"), defaults to "auto"
+    :type detail: str, optional
+    :param max_image_side: Maximum length in pixels of the longest side, defaults to None (no downscaling)
+    :type max_image_side: int, optional
+
+    :return: Returns the message content entry
+    :rtype: dict
+    """
+    image_data, mime_type = encode_image(image_path, max_image_side)
+    return {
+        "type": "image_url",
+        "image_url": {
+            "url": f"data:{mime_type};base64,{image_data}",
+            "detail": detail
+        }
+    }
@@ -0,0 +1,159 @@
+import time
+import queue
+import threading
+
+"""
+Module for the staged pipeline engine: each stage has its own pool of worker threads and
+bounded queues between stages, so that slow stages apply backpressure to faster ones
+"""
+
+_DONE = object()
+
+
+class Stage():
+    """
+    Step of a StagedPipeline
+
+    :param name: Name of the stage, used in the utilisation report
+    :type name: str
+    :param function: Function applied to every item, its return value is ignored and exceptions fail the item
+    :type function: Callable[[Any], None]
+    :param workers: Number of worker threads of the stage, defaults to 1
+    :type workers: int
+    """
+
+    def __init__(self, name:str, function, workers:int=1):
+        """Constructor method
+        """
+        self.name = name
+        self.function = function
+        self.workers = max(1, workers)
+        self.processed = 0
+        self.failed = 0
+        self.busy = 0.0
+        self.waiting = 0.0
+        self.blocked = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, busy:float, waiting:float, blocked:float, failed:bool):
+        """
+        Records the processing of an item by a worker of the stage
+        """
+        with self._lock:
+            self.processed += 1
+            self.failed += failed
+            self.busy += busy
+            self.waiting += waiting
+            self.blocked += blocked
+
+
+class StagedPipeline():
+    """
+    Runs items through a sequence of stages. Each stage takes items from a bounded queue and hands them to
+    the next stage's queue, so an item can be in one stage while the next item is in an earlier one, and a
+    stage whose queue is full holds back the stages feeding it. Items failing a stage skip the remaining stages.
+
+    :param stages: Stages in processing order
+    :type stages: list[Stage]
+    :param queue_size: Capacity of the queue in front of every stage, defaults to 4
+    :type queue_size: int
+    """
+
+    def __init__(self, stages:list, queue_size:int=4):
+        """Constructor method
+        """
+        self.stages = stages
+        self.queue_size = queue_size
+        self.errors = {}
+        self.elapsed = 0.0
+        self._errors_lock = threading.Lock()
+
+    def _work(self, index:int, queues:list, remaining:list, remaining_lock:threading.Lock):
+        """
+        Helper function run by every worker thread of stage index
+        """
+        stage = self.stages[index]
+        inbox = queues[index]
+        outbox = queues[index + 1] if index + 1 < len(self.stages) else None
+        try:
+            while True:
+                item, enqueued = inbox.get()
+                if item is _DONE:
+                    break
+                start = time.perf_counter()
+                failed = False
+                try:
+                    stage.function(item)
+                except BaseException as e: # Also fails the item on e.g. SystemExit, so that the worker keeps draining its queue
+                    failed = True
+                    with self._errors_lock:
+                        self.errors[item] = f"{stage.name}: {type(e).__name__}: {e}"
+                done = time.perf_counter()
+                if outbox is not None and not failed:
+                    outbox.put((item, time.perf_counter()))
+                stage.record(done - start, start - enqueued, time.perf_counter() - done, failed)
+        finally: # The next stage must always learn that this worker is done, or run would never return
+            with remaining_lock:
+                remaining[index] -= 1
+                last = remaining[index] == 0
+            if last and outbox is not None:
+                for _ in range(self.stages[index + 1].workers):
+                    outbox.put((_DONE, None))
+
+    def run(self, items:list):
+        """
+        Runs all items through the pipeline and waits for them to leave the last stage
+
+        :param items: Items to process, e.g. image names
+        :type items: list
+
+        :return: Returns the items that went through every stage, in input order
+        :rtype: list
+        """
+        start = time.perf_counter()
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        remaining = [stage.workers for stage in self.stages]
+        remaining_lock = threading.Lock()
+        threads = [threading.Thread(target=self._work, args=(index, queues, remaining, remaining_lock), daemon=True)
+                   for index, stage in enumerate(self.stages) for _ in range(stage.workers)]
+        for thread in threads:
+            thread.start()
+        for item in items:
+            queues[0].put((item, time.perf_counter()))
+        for _ in range(self.stages[0].workers):
+            queues[0].put((_DONE, None))
+        for thread in threads:
+            thread.join()
+        self.elapsed = time.perf_counter() - start
+        return [item for item in items if item not in self.errors]
+
+    def utilisation(self):
+        """
+        Reports the use of every stage over the last run
+
+        :return: Returns per stage the number of items processed and failed, its workers, the fraction of worker
+            time spent processing (busy), the mean processing time, the mean time items waited in its queue
+            and the mean time its workers were blocked by a full downstream queue
+        :rtype: dict[str, dict]
+        """
+        report = {}
+        for stage in self.stages:
+            processed = max(stage.processed, 1)
+            report[stage.name] = {"processed": stage.processed,
+                                  "failed": stage.failed,
+                                  "workers": stage.workers,
+                                  "busy": stage.busy / (stage.workers * self.elapsed) if self.elapsed else 0.0,
+                                  "mean_seconds": stage.busy / processed,
+                                  "mean_wait_seconds": stage.waiting / processed,
+                                  "mean_blocked_seconds": stage.blocked / processed}
+        return report
+
+    def print_utilisation(self):
+        """
+        Prints the utilisation of every stage over the last run
+        """
+        print(f"Pipeline stage utilisation ({self.elapsed:.1f}s):")
+        print(f"  {'stage':<12}{'items':>7}{'failed':>8}{'workers':>9}{'busy':>8}{'mean':>9}{'wait':>9}{'blocked':>9}")
+        for name, stats in self.utilisation().items():
+            print(f"  {name:<12}{stats['processed']:>7}{stats['failed']:>8}{stats['workers']:>9}{stats['busy']:>8.0%}"
+                  f"{stats['mean_seconds']:>8.2f}s{stats['mean_wait_seconds']:>8.2f}s{stats['mean_blocked_seconds']:>8.2f}s")
@@ -2,13 +2,22 @@ import pubchempy as pcp
 import re
 import json 
 import os
+import copy
+import asyncio
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from .reaction_record import write_json_atomic
+from .pubchem_cache import PubChemCache, get_pubchem_cache
+from .chemical_dictionary import ChemicalDictionary, get_chemical_dictionary
+from .alias_store import get_alias_store
+from .pubchem_client import PUBCHEM_REQUESTS_PER_SECOND, get_pubchem_client, pubchem_throttle as _pubchem_throttle
 
 """
 File containing post processing functions
 """
 
-COMMON_NAMES = {"nBu4NBF4": "Tetrabutylammonium tetrafluoroborate", 
+# Matched ignoring case, whitespace and dashes, e.g. "n-Bu4NBF4" also matches "nBu4NBF4" 
+COMMON_NAMES = ChemicalDictionary({"nBu4NBF4": "Tetrabutylammonium tetrafluoroborate", 
                 "n-Bu4NBF4": "Tetrabutylammonium tetrafluoroborate",
                 "Bu4NBF4": "Tetrabutylammonium tetrafluoroborate",
                 "nBu4NCl": "Tetrabutylammonium chloride", 
@@ -30,10 +39,88 @@ COMMON_NAMES = {"nBu4NBF4": "Tetrabutylammonium tetrafluoroborate",
                 "nBu4NBr": "Tetrabutylammonium bromide", 
                 "Bu4NBr": "Tetrabutylammonium bromide", 
                 "IPA": "2-Propanol",
-                "DCM": "Dichloromethane"} 
+                "DCM": "Dichloromethane"})
 
 KEYS =  ['Catalyst', 'Ligand', 'Solvents', 'Chemicals', 'Additives', 'Electrolytes']
 
+
+_CHEMICAL_TOKEN = re.compile(r"[^,()\[\]]+|.", re.DOTALL)
+_FLAT_CHEMICAL = re.compile(r"\s*([^,()\[\]\s][^,()\[\]]*?)\s*(?:(\([^()\[\]]+\)|\[[^()\[\]]+\])\s*)?")
+_MIXTURE_DELIMITER = re.compile(r"[:/–]")
+_BRACKET_PAIRS = {"(": ")", "[": "]"}
+_STRIP_BRACKETS = str.maketrans("", "", "()[]")
+
+
+def tokenize_chemicals(value:str):
+    """
+    Splits a string of chemicals and their quantities, e.g. "Pd(OAc)2 (5 mol%), DMF/H2O [2:1]", into 
+    (name, quantity) pairs in a single pass over a compiled tokenizer. Components are separated by commas 
+    outside brackets, and the quantity of a component is its trailing bracket group, which may itself 
+    contain brackets (e.g. "LiClO4 (0.1 M (in MeCN))"). Brackets inside a name (e.g. "Pd(OAc)2") are kept.
+
+    :param value: A string containing chemicals and their quantities.
+    :type value: str
+    
+    :return: A list of tuples where each tuple contains the chemical name and its quantity (None if there is none).
+    :rtype: list[tuple[str, str]]
+    """
+    match = _FLAT_CHEMICAL.fullmatch(value)
+    if match: # Most values are a single name with an optional quantity and no nested brackets
+        name, group = match.groups()
+        return [(name, group.translate(_STRIP_BRACKETS) if group else None)]
+    result = []
+    start = position = 0
+    depth = 0
+    group_start = group_end = None
+    for token in _CHEMICAL_TOKEN.findall(value):
+        if token in "([":
+            if depth == 0:
+                group_start, group_end = position, None
+            depth += 1
+        elif token in ")]":
+            depth -= 1
+            if depth == 0 and group_start is not None and _BRACKET_PAIRS[value[group_start]] == token:
+                group_end = position + 1
+        elif token == ",":
+            if depth == 0:
+                _append_chemical(result, value, start, position, group_start, group_end)
+                start = position + 1
+                group_start = group_end = None
+        elif depth == 0 and group_end is not None and not token.isspace():
+            group_start = group_end = None
+        position += len(token)
+    _append_chemical(result, value, start, len(value), group_start, group_end)
+    return result
+
+
+def _append_chemical(result:list, value:str, start:int, end:int, group_start:int, group_end:int):
+    """
+    Helper function of tokenize_chemicals to append the (name, quantity) pair of value[start:end]
+    """
+    if group_end is not None:
+        name = value[start:group_start].strip()
+        quantity = value[group_start:group_end].translate(_STRIP_BRACKETS)
+        if name and quantity:
+            result.append((name, quantity))
+            return
+    name = value[start:end].strip()
+    if name:
+        result.append((name, None))
+
+
+def split_mixture(chemicals:str):
+    """
+    Splits a mixture of chemicals, e.g. "CH3CN:H2O" or "DMF/H2O", on the ":", "/" and "–" delimiters.
+
+    :param chemicals: The string containing a chemical or a mixture of chemicals.
+    :type chemicals: str
+    
+    :return: The chemicals of the mixture.
+    :rtype: list[str]
+    """
+    return _MIXTURE_DELIMITER.split(chemicals)
+
+
 def split_chemicals(value:str):
     """
     Splits a string containing chemical information into components and their associated quantities.
@@ -44,17 +131,7 @@ def split_chemicals(value:str):
     :return: A list of tuples where each tuple contains the chemical name and its quantity.
     :rtype: list[tuple[str, str]]
     """
-    components = [comp.strip() for comp in value.split(',')]
-    result = []
-
-    for component in components:
-        print(component)
-        match = re.match(r'(.+?)(\s*(\([^\)]+\)|\[[^\]]+\]))?\s*$', component)
-        if match:
-            chemical_name = match.group(1).strip()
-            quantity = match.group(2).strip().replace('(', '').replace(')', '').replace('[', '').replace(']', '') if match.group(2) else None
-            result.append((chemical_name, quantity))
-    return result
+    return tokenize_chemicals(value)
 
 
 def load_json(file_path:str): 
@@ -72,46 +149,77 @@ def load_json(file_path:str):
         return json.load(file)
 
 
+def _pubchem_lookup(chemical: str, 
+                    namespace: str):
+    """
+    Helper function to make a single PubChem lookup by name or formula.
+
+    :param chemical: The common name or chemical formula to search for.
+    :type chemical: str
+    :param namespace: PubChem namespace of the query, "name" or "formula".
+    :type namespace: str
+
+    :return: The SMILES found (None if not found) and whether the answer is definitive, 
+        i.e. not caused by a network or server error.
+    :rtype: tuple[str, bool]
+    """
+    try: 
+        _pubchem_throttle.acquire()
+        if namespace == 'name':
+            c = pcp.get_cids(chemical, 'name')
+            if len(c) != 0: 
+                _pubchem_throttle.acquire()
+                return pcp.Compound.from_cid(c[0]).isomeric_smiles, True
+        else:
+            c = pcp.get_compounds(chemical, 'formula')
+            if len(c) != 0:
+                return c[0].isomeric_smiles, True
+        return None, True
+    except (pcp.NotFoundError, pcp.BadRequestError):
+        return None, True
+    except:
+        return None, False
+
+
 def pubchem_to_smiles(chemical: str, 
-                      max_retries:int=1): 
+                      max_retries:int=1,
+                      cache:PubChemCache=None): 
     """
     Retrieves the SMILES representation of a given chemical name or formula from PubChem.
+    Names in the local chemical dictionary (see set_chemical_dictionary) are resolved without any lookup, 
+    and lookups are served from the PubChem cache when possible, including names known to have no match.
+    Names found are added to the alias store (see set_alias_store).
     Implements a retry mechanism in case of random errors during the PUG REST call.
 
     :param chemical: The common name or chemical formula to search for.
     :type chemical: str
-    :param max_retries: Number of retries if the first attempt fails, defaults to 1.
+    :param max_retries: Number of retries if an attempt fails with an error, defaults to 1.
     :type max_retries: int
+    :param cache: Cache of PubChem lookups, defaults to the process-wide cache (see set_pubchem_cache).
+    :type cache: PubChemCache
     
     :return: SMILES representation of the chemical, or the original chemical name if not found.
     :rtype: str
     """
-    def get_smiles(chemical):
-        try: 
-            c = pcp.get_cids(chemical, 'name')
-            if len(c) != 0: 
-                compound = pcp.Compound.from_cid(c[0])
-                c_smiles = compound.isomeric_smiles
-                return c_smiles
-        except:
-            pass
-        try: 
-            c = pcp.get_compounds(chemical, 'formula')
-            if len(c) != 0:
-                c_smiles = c[0].isomeric_smiles
-                return c_smiles
-        except:
-            pass
-        return None
-    
-    for _ in range(max_retries + 1):  
-        smiles = get_smiles(chemical) 
+    smiles = get_chemical_dictionary().get(chemical)
+    if smiles:
+        return smiles
+    cache = cache or get_pubchem_cache()
+    for namespace in ('name', 'formula'):
+        cached, smiles = cache.get(namespace, chemical)
+        if not cached:
+            for _ in range(max_retries + 1):
+                smiles, definitive = _pubchem_lookup(chemical, namespace)
+                if definitive:
+                    cache.put(namespace, chemical, smiles)
+                    break
         if smiles:
+            get_alias_store().add(chemical, smiles, "pubchem")
             return smiles
     return chemical
 
 
-def _split_chemical(value: str, common_names: dict):
+def _split_chemical(value: str, common_names: dict, resolve=pubchem_to_smiles, count_hits: bool=True):
     """
     Helper function to split chemical (quantity) pairs and resolve all chemical entities.
 
@@ -119,40 +227,19 @@ def _split_chemical(value: str, common_names: dict):
     :type value: str
     :param common_names: A dictionary of common names for chemicals to resolve ambiguous entries.
     :type common_names: dict
+    :param resolve: Function mapping a chemical name to its SMILES, defaults to pubchem_to_smiles.
+    :type resolve: Callable[[str], str]
+    :param count_hits: Whether to count the alias store hits, defaults to True.
+    :type count_hits: bool
 
     :return: A list of tuples where each tuple contains the resolved chemical name and its quantity.
     :rtype: list[tuple[str, str]]
     """
-    components = [] 
-    current_component = []
-    bracket_level = 0
-    result = []
-    for char in value:
-        if char in "([":
-            bracket_level += 1
-        elif char in ")]":
-            bracket_level -= 1
-
-        if char == ',' and bracket_level == 0:
-            components.append(''.join(current_component).strip())
-            current_component = []
-        else:
-            current_component.append(char)
-    if current_component:
-        components.append(''.join(current_component).strip())
-
-    for component in components:
-        match = re.match(r'(.+?)(\s*(\([^\)]+\)|\[[^\]]+\]))?\s*$', component)
-        if match:
-            chemical_name = match.group(1).strip()
-            chemical_name = _process_mixed_chemicals(common_names, chemical_name)
-            quantity = match.group(2).strip().replace('(', '').replace(')', '').replace('[', '').replace(']', '') if match.group(2) else None
-
-            result.append((chemical_name, quantity))
-    return result
+    return [(_process_mixed_chemicals(common_names, chemical_name, resolve, count_hits), quantity) 
+            for chemical_name, quantity in tokenize_chemicals(value)]
          
 
-def _process_mixed_chemicals(common_names:dict, chemicals:str):
+def _process_mixed_chemicals(common_names:dict, chemicals:str, resolve=pubchem_to_smiles, count_hits:bool=True):
     """
     Resolves mixed chemical systems by replacing them with their SMILES representations or common names.
     NOTE: cannot tackle delimiter - because it will mess up names like n-Bu4NBr or 1,2-DCE
@@ -160,42 +247,53 @@ def _process_mixed_chemicals(common_names:dict, chemicals:str):
     :type common_names: dict
     :param chemicals: The string containing mixed chemical systems to resolve.
     :type chemicals: str
+    :param resolve: Function mapping a chemical name to its SMILES, defaults to pubchem_to_smiles.
+    :type resolve: Callable[[str], str]
+    :param count_hits: Whether to count the alias store hits, defaults to True.
+    :type count_hits: bool
     
     :return: The resolved string of chemicals with SMILES or common names.
     :rtype: str
     """
-    if ":" in chemicals or "/" in chemicals or "–" in chemicals:
-        chemicals = re.sub(r"[:/–]", ":", chemicals)
-        delimiter = ":"
-        components = chemicals.split(delimiter)
-        resolved_components = [_replace_chemical(common_names, comp) for comp in components]
-        resolved_components = [pubchem_to_smiles(comp) for comp in resolved_components]
-        return delimiter.join(resolved_components)
-    else:
-        chemicals = _replace_chemical(common_names, chemicals)
-        return pubchem_to_smiles(chemicals)
+    resolved_components = []
+    for comp in split_mixture(chemicals):
+        chemical, is_smiles = _replace_chemical(common_names, comp, count_hits)
+        resolved_components.append(chemical if is_smiles else resolve(chemical))
+    return ":".join(resolved_components)
 
 
-def _replace_chemical(common_names:dict, chemical:str):
+def _replace_chemical(common_names:dict, chemical:str, count_hits:bool=True):
     """
-    Replaces a chemical with its resolved name from a dictionary of common names.
+    Replaces a chemical with its SMILES or resolved name from the curated sources first: a manual correction 
+    in the alias store (see set_alias_store), then the dictionary of common names and the local chemical 
+    dictionary (see set_chemical_dictionary). Aliases learned from earlier lookups only apply to names the 
+    curated sources do not cover.
 
     :param common_names: A dictionary of common names for chemicals.
     :type common_names: dict
     :param chemical: The chemical name to resolve.
     :type chemical: str
+    :param count_hits: Whether to count the alias store hits, defaults to True.
+    :type count_hits: bool
     
-    :return: The resolved chemical name.
-    :rtype: str
+    :return: The SMILES or resolved chemical name, and whether it is a SMILES.
+    :rtype: tuple[str, bool]
     """
+    aliases = get_alias_store()
+    smiles = aliases.get(chemical, count_hits, manual_only=True)
+    if smiles:
+        return smiles, True
     try:
-        value = common_names[chemical]
-        return value
+        chemical = common_names[chemical]
     except:
-        return chemical
+        pass
+    smiles = get_chemical_dictionary().get(chemical) or aliases.get(chemical, count_hits)
+    if smiles:
+        return smiles, True
+    return chemical, False
 
 
-def _entity_resolution_entry(entry: dict, keys: list, common_names: dict):
+def _entity_resolution_entry(entry: dict, keys: list, common_names: dict, resolve=pubchem_to_smiles, count_hits: bool=True):
     """
     Resolves and updates chemical entities for a given entry.
 
@@ -205,6 +303,10 @@ def _entity_resolution_entry(entry: dict, keys: list, common_names: dict):
     :type keys: list[str]
     :param common_names: A dictionary of common names for chemicals.
     :type common_names: dict
+    :param resolve: Function mapping a chemical name to its SMILES, defaults to pubchem_to_smiles.
+    :type resolve: Callable[[str], str]
+    :param count_hits: Whether to count the alias store hits, defaults to True.
+    :type count_hits: bool
     
     :return: The updated entry with resolved chemical entities.
     :rtype: dict
@@ -213,7 +315,7 @@ def _entity_resolution_entry(entry: dict, keys: list, common_names: dict):
         try: 
             value = entry.get(key, None)
             if value: 
-                split_value = _split_chemical(value, common_names)
+                split_value = _split_chemical(value, common_names, resolve, count_hits)
                 entry[key] = split_value
         except:
             pass
@@ -248,7 +350,7 @@ def _entity_resolution_rxn_dict_old(rxn_dict: dict, keys: list, common_names: di
         rxn_dict["Optimization Runs"][entry_id] = rxn_entry
     return rxn_dict
 
-def _entity_resolution_rxn_dict(rxn_dict: dict, keys: list, common_names: dict):
+def _entity_resolution_rxn_dict(rxn_dict: dict, keys: list, common_names: dict, resolve=pubchem_to_smiles, count_hits: bool=True):
     """
     Resolves and updates chemical entities for a reaction dictionary, including consolidating mixed solvent systems.
 
@@ -258,6 +360,10 @@ def _entity_resolution_rxn_dict(rxn_dict: dict, keys: list, common_names: dict):
     :type keys: list[str]
     :param common_names: A dictionary of common names for chemicals.
     :type common_names: dict
+    :param resolve: Function mapping a chemical name to its SMILES, defaults to pubchem_to_smiles.
+    :type resolve: Callable[[str], str]
+    :param count_hits: Whether to count the alias store hits, defaults to True.
+    :type count_hits: bool
     
     :return: The updated reaction dictionary with resolved chemical entities.
     :rtype: dict
@@ -268,7 +374,7 @@ def _entity_resolution_rxn_dict(rxn_dict: dict, keys: list, common_names: dict):
         return rxn_dict
     opt_runs = rxn_dict.get(opt_key, {})
     for entry_id, rxn_entry in opt_runs.items():
-        rxn_entry = _entity_resolution_entry(rxn_entry, keys, common_names)
+        rxn_entry = _entity_resolution_entry(rxn_entry, keys, common_names, resolve, count_hits)
 
         solvents = rxn_entry.get("Solvents", None)
         if solvents and len(solvents) > 1:
@@ -293,9 +399,7 @@ def _save_json(file_path:str, data:dict):
     :return: Nothing, all information saved to the JSON at file_path
     :rtype: None
     """    
-    file_path = Path(file_path)
-    with open(file_path, "w") as file:
-        json.dump(data, file, indent=4)
+    write_json_atomic(file_path, data)
 
 
 def _process_raw_dict(image_name:str, 
@@ -324,3 +428,112 @@ def _process_raw_dict(image_name:str,
     _save_json(file_path, resolved_dict)
 
 
+def collect_chemicals(rxn_dicts: list, 
+                      keys=KEYS, 
+                      common_names=COMMON_NAMES):
+    """
+    Collects the chemical names that entity resolution would look up in a set of reaction dictionaries, 
+    without looking any of them up or counting alias store hits.
+
+    :param rxn_dicts: Reaction dictionaries, left unchanged.
+    :type rxn_dicts: list[dict]
+    :param keys: List of keys representing the chemical entities to resolve, defaults to KEYS.
+    :type keys: list[str]
+    :param common_names: Dictionary of common names to replace ambiguous chemicals, defaults to COMMON_NAMES.
+    :type common_names: dict
+
+    :return: The unique chemical names and the total number of mentions.
+    :rtype: tuple[set[str], int]
+    """
+    chemicals = set()
+    mentions = 0
+
+    def collect(chemical):
+        nonlocal mentions
+        chemicals.add(chemical)
+        mentions += 1
+        return chemical
+
+    for rxn_dict in rxn_dicts:
+        _entity_resolution_rxn_dict(copy.deepcopy(rxn_dict), keys, common_names, collect, count_hits=False)
+    return chemicals, mentions
+
+
+def resolve_chemicals(chemicals: list, 
+                      workers:int=PUBCHEM_REQUESTS_PER_SECOND):
+    """
+    Looks up a set of chemical names concurrently. Requests to PubChem are throttled to 
+    PUBCHEM_REQUESTS_PER_SECOND across all threads and served from the PubChem cache when possible.
+    If an asynchronous PubChem client is set (see set_pubchem_client) the lookups go through it.
+
+    :param chemicals: The chemical names to look up.
+    :type chemicals: list[str]
+    :param workers: Number of concurrent lookups, defaults to PUBCHEM_REQUESTS_PER_SECOND.
+    :type workers: int
+
+    :return: The SMILES of every chemical name, or the name itself if not found.
+    :rtype: dict[str, str]
+    """
+    chemicals = sorted(chemicals)
+    client = get_pubchem_client()
+    if client is not None:
+        resolved = asyncio.run(client.lookup_many(chemicals))
+        client.print_summary()
+        aliases = get_alias_store()
+        for chemical, smiles in resolved.items():
+            aliases.add(chemical, smiles, "pubchem")
+        return {chemical: smiles or chemical for chemical, smiles in resolved.items()}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return dict(zip(chemicals, executor.map(pubchem_to_smiles, chemicals)))
+
+
+def batch_process_raw_dicts(json_directory:str, 
+                            image_names:list=None, 
+                            keys=KEYS, 
+                            common_names=COMMON_NAMES, 
+                            workers:int=PUBCHEM_REQUESTS_PER_SECOND):
+    """ 
+    Resolves the chemical entities of many reaction dictionaries at once. The unique chemical names of 
+    all files are collected first and looked up once each, concurrently, then every file is rewritten 
+    from the resolved names. Gives the same result as _process_raw_dict on each file.
+
+    :param json_directory: The directory where the JSON files are located.
+    :type json_directory: str
+    :param image_names: Names of the images whose JSON files are processed, defaults to None (all JSON files).
+    :type image_names: list[str]
+    :param keys: List of keys representing the chemical entities to resolve, defaults to KEYS.
+    :type keys: list[str]
+    :param common_names: Dictionary of common names to replace ambiguous chemicals, defaults to COMMON_NAMES.
+    :type common_names: dict
+    :param workers: Number of concurrent lookups, defaults to PUBCHEM_REQUESTS_PER_SECOND.
+    :type workers: int
+    
+    :return: Nothing, all files saved to the JSONs in json_directory
+    :rtype: None
+    """
+    json_directory = Path(json_directory)
+    if image_names is None:
+        file_paths = sorted(json_directory.glob("*.json"))
+    else:
+        file_paths = [json_directory / f"{image_name}.json" for image_name in image_names]
+
+    rxn_dicts = {}
+    for file_path in file_paths:
+        if not file_path.exists():
+            continue
+        try:
+            rxn_dict = load_json(file_path)
+        except json.JSONDecodeError as e:
+            print(f"Error reading {file_path}: {e}")
+            continue
+        if not isinstance(rxn_dict, dict) or not any("optimization" in k.lower() for k in rxn_dict):
+            print(f"WARNING: Could not find optimization runs in {file_path}. Dictionary will not be cleaned.\n")
+            continue
+        rxn_dicts[file_path] = rxn_dict
+
+    chemicals, mentions = collect_chemicals(rxn_dicts.values(), keys, common_names)
+    print(f"Resolving {len(chemicals)} unique chemicals ({mentions} mentions) in {len(rxn_dicts)} reaction dictionaries")
+    resolved = resolve_chemicals(chemicals, workers)
+    for file_path, rxn_dict in rxn_dicts.items():
+        resolved_dict = _entity_resolution_rxn_dict(rxn_dict, keys, common_names, lambda chemical: resolved.get(chemical, chemical))
+        _save_json(file_path, resolved_dict)
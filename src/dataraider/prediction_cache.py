@@ -0,0 +1,213 @@
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import numpy as np
+from pathlib import Path
+
+"""
+Module for the on-disk cache of RxnScribe predictions
+"""
+
+
+def image_hash(image_file:str):
+    """
+    Computes the content hash of an image file
+
+    :param image_file: Path to the image
+    :type image_file: str
+
+    :return: Returns the SHA-256 hex digest of the file content
+    :rtype: str
+    """
+    digest = hashlib.sha256()
+    with open(image_file, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _to_json(value):
+    """
+    Helper function serializing the numpy values of a prediction (e.g. bounding boxes)
+
+    :raises TypeError: If the value is not a numpy array or scalar
+    """
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class PredictionCache():
+    """
+    SQLite cache of RxnScribe predictions, keyed by the content hash of the image, the checkpoint
+    and the molscribe/ocr options, so that unchanged reaction schemes are not run through the model
+    again on reruns. Predictions never expire: they only change with the image or the checkpoint.
+
+    :param cache_path: Path to the SQLite database file
+    :type cache_path: str
+    """
+
+    def __init__(self, cache_path:str):
+        """Constructor method
+        """
+        self.cache_path = Path(cache_path)
+        self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(str(self.cache_path), timeout=30, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS predictions ("
+                "key TEXT PRIMARY KEY, predictions TEXT NOT NULL, created REAL NOT NULL)")
+
+    @staticmethod
+    def prediction_key(image_file:str, checkpoint:str, molscribe:bool=False, ocr:bool=False):
+        """
+        Computes the cache key of a prediction
+
+        :param image_file: Path to the image
+        :type image_file: str
+        :param checkpoint: Identifier of the RxnScribe checkpoint
+        :type checkpoint: str
+        :param molscribe: Whether MolScribe is used to predict SMILES, defaults to False
+        :type molscribe: bool
+        :param ocr: Whether OCR is used to read text, defaults to False
+        :type ocr: bool
+
+        :return: Returns the SHA-256 hex digest of the image hash, checkpoint and options
+        :rtype: str
+        """
+        key = f"{image_hash(image_file)}:{checkpoint}:molscribe={bool(molscribe)}:ocr={bool(ocr)}"
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def get(self, key:str):
+        """
+        Looks up cached predictions
+
+        :param key: Cache key of the prediction
+        :type key: str
+
+        :return: Returns the cached predictions, or None on a miss
+        :rtype: list[dict]
+        """
+        with self._lock:
+            row = self._connection.execute("SELECT predictions FROM predictions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key:str, predictions:list):
+        """
+        Stores predictions
+
+        :param key: Cache key of the prediction
+        :type key: str
+        :param predictions: Predictions of RxnScribe for the image
+        :type predictions: list[dict]
+
+        :raises TypeError: If the predictions hold values that cannot be stored as JSON
+        """
+        content = json.dumps(predictions, default=_to_json)
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO predictions (key, predictions, created) VALUES (?, ?, ?)",
+                (key, content, time.time()))
+
+    def stats(self):
+        """
+        Reports cache usage
+
+        :return: Returns the number of hits, misses and cached predictions
+        :rtype: dict
+        """
+        with self._lock:
+            entries = self._connection.execute("SELECT COUNT(*) FROM predictions").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "entries": entries}
+
+    def close(self):
+        """
+        Closes the database connection
+        """
+        with self._lock:
+            self._connection.close()
+
+
+class CachedRxnScribe():
+    """
+    RxnScribe (in this process or in a worker) with its predictions served from a PredictionCache when
+    possible. Only images without cached predictions reach the model, so a fully cached run never loads it.
+
+    :param model: The model, e.g. LazyRxnScribe or RxnScribeWorker
+    :type model: LazyRxnScribe
+    :param cache: Cache of predictions
+    :type cache: PredictionCache
+    :param checkpoint: Identifier of the RxnScribe checkpoint of the model
+    :type checkpoint: str
+    """
+
+    def __init__(self, model, cache:PredictionCache, checkpoint:str):
+        """Constructor method
+        """
+        self.model = model
+        self.cache = cache
+        self.checkpoint = checkpoint
+
+    def _put(self, key:str, image_file:str, predictions:list):
+        """
+        Helper function to cache predictions, skipping those that cannot be stored
+        """
+        try:
+            self.cache.put(key, predictions)
+        except TypeError as e:
+            print(f"Predictions of {image_file} not cached: {e}")
+
+    def _key(self, image_file:str, kwargs:dict):
+        """
+        Helper function computing the cache key of an image, None if the image cannot be read
+        """
+        try:
+            return self.cache.prediction_key(image_file, self.checkpoint, kwargs.get("molscribe", False), kwargs.get("ocr", False))
+        except OSError:
+            return None
+
+    def predict_image_file(self, image_file:str, **kwargs):
+        """
+        Predicts the reactions of an image file, see RxnScribe.predict_image_file
+        """
+        key = self._key(image_file, kwargs)
+        predictions = self.cache.get(key) if key else None
+        if predictions is None:
+            predictions = self.model.predict_image_file(image_file, **kwargs)
+            if key:
+                self._put(key, image_file, predictions)
+        return predictions
+
+    def predict_image_files(self, image_files:list, **kwargs):
+        """
+        Predicts the reactions of several image files, see RxnScribe.predict_image_files.
+        Only the images without cached predictions are sent to the model, in one call.
+        """
+        keys = [self._key(image_file, kwargs) for image_file in image_files]
+        predictions = [self.cache.get(key) if key else None for key in keys]
+        missing = [index for index, prediction in enumerate(predictions) if prediction is None]
+        if missing:
+            predicted = self.model.predict_image_files([image_files[index] for index in missing], **kwargs)
+            for index, prediction in zip(missing, predicted):
+                predictions[index] = prediction
+                if keys[index]:
+                    self._put(keys[index], image_files[index], prediction)
+        return predictions
+
+    def close(self):
+        """
+        Releases the model and closes the cache
+        """
+        self.model.close()
+        self.cache.close()
@@ -1,14 +1,62 @@
 import os
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from mermaidapi import AIMDController
 from .processor_info import DataRaiderInfo
 from .image_cropping import crop_image
-from .api_access import adaptive_get_data, update_dict_with_footnotes
-from .reaction_dictionary_formating import update_dict_with_smiles, postprocess_dict
+from .api_access import adaptive_get_data, update_dict_with_footnotes, structured_get_data
+from .reaction_dictionary_formating import update_dict_with_smiles, postprocess_dict, batch_postprocess_dicts, batch_update_dicts_with_smiles
+from .reaction_record import ReactionRecord
+from .pipeline import Stage, StagedPipeline
 import shutil
 from pathlib import Path
 
 """
 Contains high level functions that process images
 """
+
+def extract_reaction_data(
+                        info: DataRaiderInfo,
+                        image_name:str,
+                        image_directory:str,
+                        prompt_directory:str,
+                        get_data_prompt:str,
+                        update_dict_prompt:str,
+                        json_directory:str,
+                        response_schema:dict=None,
+                        record:ReactionRecord=None):
+    """Extracts the reaction dictionary of an image with footnote information applied.
+    With a response schema, a single structured request is made and the two-step flow 
+    (adaptive_get_data then update_dict_with_footnotes) is only used if its response fails validation.
+
+    :param image_name: Name of image
+    :type image_name: str
+    :param image_directory: Root directory where the original images are stored
+    :type image_directory: str
+    :param prompt_directory: Directory path to user message prompt
+    :type prompt_directory: str
+    :param get_data_prompt: File name of user message prompt to get reaction conditions
+    :type get_data_prompt: str
+    :param update_dict_prompt: Directory path to update message prompt
+    :type update_dict_prompt: str
+    :param json_directory: Path to directory of reaction dictionary
+    :type json_directory: str
+    :param response_schema: JSON schema for single-call structured extraction, defaults to None (two-step flow)
+    :type response_schema: dict, optional
+    :param record: In-memory reaction record to fill, defaults to None (each step saves the JSON)
+    :type record: ReactionRecord, optional
+    
+    :return: Returns nothing, the record is filled (or the JSON saved)
+    :rtype: None
+    """
+    if response_schema is not None:
+        if structured_get_data(info, prompt_directory, get_data_prompt, image_name, image_directory, json_directory, response_schema, record=record) is not False:
+            return
+        print('Falling back to two-step extraction...')
+    adaptive_get_data(info, prompt_directory, get_data_prompt, image_name, image_directory, json_directory, record=record)
+    print('Updating with footnote information...')
+    update_dict_with_footnotes(info, prompt_directory, update_dict_prompt, image_name, json_directory, record=record)
+
     
 def process_indiv_images(
                         info: DataRaiderInfo,
@@ -18,8 +66,13 @@ def process_indiv_images(
                         get_data_prompt:str,
                         update_dict_prompt:str,
                         json_directory:str, 
-                        min_segment_height:int=120):
-    """Process individual images to extract reaction information
+                        min_segment_height:int=120,
+                        response_schema:dict=None,
+                        snapshot_directory:str=None,
+                        resolve_entities:bool=True,
+                        extract_smiles:bool=True):
+    """Process individual images to extract reaction information.
+    The reaction dictionary is kept in memory across all steps and written to its JSON once at the end.
 
     :param image_name: Name of image
     :type image_name: str
@@ -35,22 +88,36 @@ def process_indiv_images(
     :type json_directory: str
     :param min_segment_height: Minimum height of each segmented subfigure, defaults to 120, defaults to 120
     :type min_segment_height: int
+    :param response_schema: JSON schema for single-call structured extraction, defaults to None (two-step flow)
+    :type response_schema: dict, optional
+    :param snapshot_directory: Directory to save the reaction dictionary after every step for debugging, defaults to None
+    :type snapshot_directory: str, optional
+    :param resolve_entities: Whether to resolve chemical names (postprocessing), defaults to True. 
+        Set to False when all images are postprocessed together afterwards.
+    :type resolve_entities: bool
+    :param extract_smiles: Whether to extract the reaction SMILES with RxnScribe, defaults to True.
+        Set to False when the SMILES of all images are extracted in batches afterwards.
+    :type extract_smiles: bool
     
     :return: Returns nothing, all data saved in JSON
     :rtype: None
     """
     
     print(f'Extracting reaction information from {image_name}.')
-    print('Cropping image...')
-    crop_image(image_name, image_directory, min_segment_height)
-    print('Images cropped. Passing subimages through DataRaider...')          
-    adaptive_get_data(info, prompt_directory, get_data_prompt, image_name, image_directory, json_directory)
-    print('Updating with footnote information...')
-    update_dict_with_footnotes(info, prompt_directory, update_dict_prompt, image_name, json_directory)
-    print('Postprocessing reaction dictionary...')
-    postprocess_dict(image_name, json_directory)
-    print('Extracting reaction SMILES...')
-    update_dict_with_smiles(info, image_name, image_directory, json_directory)
+    record = ReactionRecord(image_name, json_directory, snapshot_directory)
+    try:
+        print('Cropping image...')
+        crop_image(image_name, image_directory, min_segment_height)
+        print('Images cropped. Passing subimages through DataRaider...')          
+        extract_reaction_data(info, image_name, image_directory, prompt_directory, get_data_prompt, update_dict_prompt, json_directory, response_schema, record)
+        if resolve_entities:
+            print('Postprocessing reaction dictionary...')
+            postprocess_dict(image_name, json_directory, record)
+        if extract_smiles:
+            print('Extracting reaction SMILES...')
+            update_dict_with_smiles(info, image_name, image_directory, json_directory, record)
+    finally: # Keep the stages completed before a failure
+        record.save()
     print(f'{image_name} cleaned and saved.')
     print('-----------------------------------')
 
@@ -61,10 +128,15 @@ def batch_process_images(
                         prompt_directory: str, 
                         get_data_prompt:str, 
                         update_dict_prompt:str,
-                        json_directory:str
+                        json_directory:str,
+                        response_schema:dict=None,
+                        snapshot_directory:str=None,
+                        corpus_resolution:bool=False,
+                        smiles_batch_size:int=None
                         ): 
     """
-    Batch process images to extract reaction information
+    Batch process images to extract reaction information, one image and one VLM request at a time.
+    For concurrent requests, including adaptive concurrency, see batch_process_images_async.
     
     :param image_directory: Root directory where the original images are stored
     :type image_directory: str
@@ -76,6 +148,16 @@ def batch_process_images(
     :type update_dict_prompt: str
     :param json_directory: Path to directory of reaction dictionary
     :type json_directory: str
+    :param response_schema: JSON schema for single-call structured extraction, defaults to None (two-step flow)
+    :type response_schema: dict, optional
+    :param snapshot_directory: Directory to save each reaction dictionary after every step for debugging, defaults to None
+    :type snapshot_directory: str, optional
+    :param corpus_resolution: Whether to postprocess all reaction dictionaries together at the end, looking up each
+        unique chemical name once, instead of image by image, defaults to False
+    :type corpus_resolution: bool
+    :param smiles_batch_size: Number of images per RxnScribe batch when extracting the reaction SMILES of all images 
+        together at the end, defaults to None (SMILES extracted image by image)
+    :type smiles_batch_size: int, optional
     
     :return: Returns nothing, all data saved in JSON
     :rtype: None
@@ -83,15 +165,316 @@ def batch_process_images(
     image_directory = Path(image_directory)
     image_directory = image_directory / "relevant_images/"
     image_extensions = {".png", ".jpg", ".jpeg", ".webp"}
+    processed = []
     for file in image_directory.iterdir():
         if file.is_file() and file.suffix.lower() in image_extensions:
             image_name = file.stem
             try: 
-                process_indiv_images(info, image_name, image_directory, prompt_directory, get_data_prompt, update_dict_prompt, json_directory)
+                process_indiv_images(info, image_name, image_directory, prompt_directory, get_data_prompt, update_dict_prompt, json_directory, response_schema=response_schema, snapshot_directory=snapshot_directory,
+                                     resolve_entities=not corpus_resolution, extract_smiles=not smiles_batch_size)
+                processed.append(image_name)
             except: 
                 continue
+    if corpus_resolution:
+        print('Postprocessing all reaction dictionaries...')
+        batch_postprocess_dicts(processed, json_directory)
+    if smiles_batch_size:
+        print('Extracting reaction SMILES of all images...')
+        batch_update_dicts_with_smiles(info, processed, image_directory, json_directory, smiles_batch_size)
+    print()
+    print("DataRaider -- Mission Accomplished. All images processed!")
+
+
+async def _process_indiv_images_async(
+                        info: DataRaiderInfo,
+                        image_name:str,
+                        image_directory:str,
+                        prompt_directory:str,
+                        get_data_prompt:str,
+                        update_dict_prompt:str,
+                        json_directory:str,
+                        executors:dict,
+                        min_segment_height:int=120,
+                        response_schema:dict=None,
+                        snapshot_directory:str=None,
+                        resolve_entities:bool=True,
+                        extract_smiles:bool=True):
+    """Asynchronous counterpart of process_indiv_images. Each step runs in the executor matching its cost profile
+    so that the VLM calls of many images can be in flight at the same time.
+
+    :param image_name: Name of image
+    :type image_name: str
+    :param image_directory: Root directory where the original images are stored
+    :type image_directory: str
+    :param prompt_directory: Directory path to user message prompt
+    :type prompt_directory: str
+    :param get_data_prompt: File name of user message prompt to get reaction conditions
+    :type get_data_prompt: str
+    :param update_dict_prompt: Directory path to update message prompt
+    :type update_dict_prompt: str
+    :param json_directory: Path to directory of reaction dictionary
+    :type json_directory: str
+    :param executors: Executors for the "cpu", "vlm", "io" and "model" steps
+    :type executors: dict[str, concurrent.futures.Executor]
+    :param min_segment_height: Minimum height of each segmented subfigure, defaults to 120
+    :type min_segment_height: int
+    :param response_schema: JSON schema for single-call structured extraction, defaults to None (two-step flow)
+    :type response_schema: dict, optional
+    :param snapshot_directory: Directory to save the reaction dictionary after every step for debugging, defaults to None
+    :type snapshot_directory: str, optional
+    :param resolve_entities: Whether to resolve chemical names (postprocessing), defaults to True
+    :type resolve_entities: bool
+    :param extract_smiles: Whether to extract the reaction SMILES with RxnScribe, defaults to True
+    :type extract_smiles: bool
+    
+    :return: Returns nothing, all data saved in JSON
+    :rtype: None
+    """
+    loop = asyncio.get_running_loop()
+    print(f'Extracting reaction information from {image_name}.')
+    record = ReactionRecord(image_name, json_directory, snapshot_directory)
+    try:
+        await loop.run_in_executor(executors["cpu"], crop_image, image_name, image_directory, min_segment_height)
+        await loop.run_in_executor(executors["vlm"], extract_reaction_data, info, image_name, image_directory, prompt_directory, get_data_prompt, update_dict_prompt, json_directory, response_schema, record)
+        if resolve_entities:
+            await loop.run_in_executor(executors["io"], postprocess_dict, image_name, json_directory, record)
+        if extract_smiles:
+            await loop.run_in_executor(executors["model"], update_dict_with_smiles, info, image_name, image_directory, json_directory, record)
+    finally: # Keep the stages completed before a failure
+        await loop.run_in_executor(executors["io"], record.save)
+    print(f'{image_name} cleaned and saved.')
+
+
+async def _batch_process_images_async(
+                        info: DataRaiderInfo,
+                        image_names:list,
+                        image_directory:str,
+                        prompt_directory: str, 
+                        get_data_prompt:str, 
+                        update_dict_prompt:str,
+                        json_directory:str,
+                        executors:dict,
+                        response_schema:dict=None,
+                        snapshot_directory:str=None,
+                        corpus_resolution:bool=False,
+                        smiles_batch_size:int=None):
+    """Helper coroutine that processes all images concurrently and reports failed images.
+    With corpus_resolution, the reaction dictionaries of all images are postprocessed together at the end,
+    and with smiles_batch_size their reaction SMILES are extracted in batches at the end.
+
+    :param image_names: Names of the images to process
+    :type image_names: list[str]
+    :param executors: Executors for the "cpu", "vlm", "io" and "model" steps
+    :type executors: dict[str, concurrent.futures.Executor]
+    :param response_schema: JSON schema for single-call structured extraction, defaults to None (two-step flow)
+    :type response_schema: dict, optional
+    :param snapshot_directory: Directory to save each reaction dictionary after every step for debugging, defaults to None
+    :type snapshot_directory: str, optional
+    :param corpus_resolution: Whether to postprocess all reaction dictionaries together at the end, defaults to False
+    :type corpus_resolution: bool
+    :param smiles_batch_size: Number of images per RxnScribe batch, defaults to None (SMILES extracted image by image)
+    :type smiles_batch_size: int, optional
+    """
+    results = await asyncio.gather(*(
+        _process_indiv_images_async(info, image_name, image_directory, prompt_directory, get_data_prompt, update_dict_prompt, json_directory, executors, response_schema=response_schema, snapshot_directory=snapshot_directory,
+                                    resolve_entities=not corpus_resolution, extract_smiles=not smiles_batch_size)
+        for image_name in image_names), return_exceptions=True)
+    processed = []
+    for image_name, result in zip(image_names, results):
+        if isinstance(result, Exception):
+            print(f"Error processing {image_name}: {result}")
+        else:
+            processed.append(image_name)
+    if corpus_resolution:
+        print('Postprocessing all reaction dictionaries...')
+        await asyncio.get_running_loop().run_in_executor(executors["io"], batch_postprocess_dicts, processed, json_directory)
+    if smiles_batch_size:
+        print('Extracting reaction SMILES of all images...')
+        await asyncio.get_running_loop().run_in_executor(executors["model"], batch_update_dicts_with_smiles, info, processed, image_directory, json_directory, smiles_batch_size)
+
+
+def batch_process_images_async(
+                        info: DataRaiderInfo,
+                        image_directory:str,
+                        prompt_directory: str, 
+                        get_data_prompt:str, 
+                        update_dict_prompt:str,
+                        json_directory:str,
+                        max_concurrent_requests:int=8,
+                        cpu_workers:int=None,
+                        io_workers:int=4,
+                        response_schema:dict=None,
+                        adaptive_concurrency:bool=False,
+                        concurrency_metrics_path:str=None,
+                        snapshot_directory:str=None,
+                        corpus_resolution:bool=False,
+                        smiles_batch_size:int=None
+                        ): 
+    """
+    Batch process images to extract reaction information, keeping up to max_concurrent_requests 
+    VLM requests in flight across images. Cropping runs in a CPU thread pool and RxnScribe in a 
+    dedicated single worker. Produces the same per-image outputs as batch_process_images.
+    
+    :param image_directory: Root directory where the original images are stored
+    :type image_directory: str
+    :param prompt_directory: Directory path to user message prompt
+    :type prompt_directory: str
+    :param get_data_prompt: File name of user message prompt to get reaction conditions
+    :type get_data_prompt: str
+    :param update_dict_prompt: Directory path to update message prompt
+    :type update_dict_prompt: str
+    :param json_directory: Path to directory of reaction dictionary
+    :type json_directory: str
+    :param max_concurrent_requests: Maximum number of VLM requests in flight, defaults to 8
+    :type max_concurrent_requests: int
+    :param cpu_workers: Number of threads used for cropping, defaults to the number of CPUs
+    :type cpu_workers: int, optional
+    :param io_workers: Number of threads used for postprocessing (PubChem lookups), defaults to 4
+    :type io_workers: int
+    :param response_schema: JSON schema for single-call structured extraction, defaults to None (two-step flow)
+    :type response_schema: dict, optional
+    :param adaptive_concurrency: Whether to adapt the number of requests in flight with AIMD instead of
+        keeping it fixed, max_concurrent_requests is then the upper bound, defaults to False
+    :type adaptive_concurrency: bool
+    :param concurrency_metrics_path: JSONL file to append every change of the adaptive limit to, defaults to None
+    :type concurrency_metrics_path: str, optional
+    :param snapshot_directory: Directory to save each reaction dictionary after every step for debugging, defaults to None
+    :type snapshot_directory: str, optional
+    :param corpus_resolution: Whether to postprocess all reaction dictionaries together at the end, looking up each
+        unique chemical name once, instead of image by image, defaults to False
+    :type corpus_resolution: bool
+    :param smiles_batch_size: Number of images per RxnScribe batch when extracting the reaction SMILES of all images 
+        together at the end, defaults to None (SMILES extracted image by image)
+    :type smiles_batch_size: int, optional
+    
+    :return: Returns nothing, all data saved in JSON
+    :rtype: None
+    """
+    image_directory = Path(image_directory)
+    image_directory = image_directory / "relevant_images/"
+    image_extensions = {".png", ".jpg", ".jpeg", ".webp"}
+    image_names = [file.stem for file in image_directory.iterdir() 
+                   if file.is_file() and file.suffix.lower() in image_extensions]
+
+    executors = {
+        "cpu": ThreadPoolExecutor(max_workers=cpu_workers or os.cpu_count()),
+        "vlm": ThreadPoolExecutor(max_workers=max_concurrent_requests),
+        "io": ThreadPoolExecutor(max_workers=io_workers),
+        "model": ThreadPoolExecutor(max_workers=1)
+    }
+    if adaptive_concurrency:
+        info.client.concurrency = AIMDController(initial=min(4, max_concurrent_requests),
+                                                 max_limit=max_concurrent_requests,
+                                                 metrics_path=concurrency_metrics_path)
+    try:
+        asyncio.run(_batch_process_images_async(info, image_names, image_directory, prompt_directory, get_data_prompt, update_dict_prompt, json_directory, executors, response_schema, snapshot_directory, corpus_resolution, smiles_batch_size))
+    finally:
+        for executor in executors.values():
+            executor.shutdown()
+    print()
+    print("DataRaider -- Mission Accomplished. All images processed!")
+
+
+def batch_process_images_pipeline(
+                        info: DataRaiderInfo,
+                        image_directory:str,
+                        prompt_directory: str, 
+                        get_data_prompt:str, 
+                        update_dict_prompt:str,
+                        json_directory:str,
+                        stage_workers:dict=None,
+                        queue_size:int=4,
+                        min_segment_height:int=120,
+                        response_schema:dict=None,
+                        adaptive_concurrency:bool=False,
+                        concurrency_metrics_path:str=None,
+                        snapshot_directory:str=None,
+                        corpus_resolution:bool=False,
+                        smiles_batch_size:int=None
+                        ): 
+    """
+    Batch process images to extract reaction information with a staged pipeline: cropping, extraction (VLM), 
+    postprocessing (PubChem), SMILES extraction (RxnScribe) and saving each run in their own pool of worker 
+    threads, with a bounded queue in front of every stage. An image is cropped while the previous ones wait 
+    on the VLM, and a stage that falls behind holds back the stages feeding it instead of letting work pile up. 
+    Produces the same per-image outputs as batch_process_images and prints the utilisation of every stage.
+    
+    :param image_directory: Root directory where the original images are stored
+    :type image_directory: str
+    :param prompt_directory: Directory path to user message prompt
+    :type prompt_directory: str
+    :param get_data_prompt: File name of user message prompt to get reaction conditions
+    :type get_data_prompt: str
+    :param update_dict_prompt: Directory path to update message prompt
+    :type update_dict_prompt: str
+    :param json_directory: Path to directory of reaction dictionary
+    :type json_directory: str
+    :param stage_workers: Number of worker threads of the "crop", "extract", "postprocess", "smiles" and "save" stages,
+        defaults to None (the number of CPUs for cropping, 8 for extraction, 4 for postprocessing and 1 for the others)
+    :type stage_workers: dict[str, int], optional
+    :param queue_size: Capacity of the queue in front of every stage, defaults to 4
+    :type queue_size: int
+    :param min_segment_height: Minimum height of each segmented subfigure, defaults to 120
+    :type min_segment_height: int
+    :param response_schema: JSON schema for single-call structured extraction, defaults to None (two-step flow)
+    :type response_schema: dict, optional
+    :param adaptive_concurrency: Whether to adapt the number of requests in flight with AIMD instead of
+        keeping it fixed, the number of extraction workers is then the upper bound, defaults to False
+    :type adaptive_concurrency: bool
+    :param concurrency_metrics_path: JSONL file to append every change of the adaptive limit to, defaults to None
+    :type concurrency_metrics_path: str, optional
+    :param snapshot_directory: Directory to save each reaction dictionary after every step for debugging, defaults to None
+    :type snapshot_directory: str, optional
+    :param corpus_resolution: Whether to postprocess all reaction dictionaries together at the end, looking up each
+        unique chemical name once, instead of in the pipeline, defaults to False
+    :type corpus_resolution: bool
+    :param smiles_batch_size: Number of images per RxnScribe batch when extracting the reaction SMILES of all images 
+        together at the end, defaults to None (SMILES extracted in the pipeline)
+    :type smiles_batch_size: int, optional
+    
+    :return: Returns the utilisation of every stage (see StagedPipeline.utilisation)
+    :rtype: dict[str, dict]
+    """
+    image_directory = Path(image_directory)
+    image_directory = image_directory / "relevant_images/"
+    image_extensions = {".png", ".jpg", ".jpeg", ".webp"}
+    image_names = [file.stem for file in image_directory.iterdir() 
+                   if file.is_file() and file.suffix.lower() in image_extensions]
+    workers = {"crop": os.cpu_count(), "extract": 8, "postprocess": 4, "smiles": 1, "save": 1}
+    workers.update(stage_workers or {})
+    records = {image_name: ReactionRecord(image_name, json_directory, snapshot_directory) for image_name in image_names}
+    if adaptive_concurrency:
+        info.client.concurrency = AIMDController(initial=min(4, workers["extract"]),
+                                                 max_limit=workers["extract"],
+                                                 metrics_path=concurrency_metrics_path)
+
+    stages = [
+        Stage("crop", lambda image_name: crop_image(image_name, image_directory, min_segment_height), workers["crop"]),
+        Stage("extract", lambda image_name: extract_reaction_data(info, image_name, image_directory, prompt_directory, get_data_prompt, update_dict_prompt, json_directory, response_schema, records[image_name]),
+              workers["extract"])
+    ]
+    if not corpus_resolution:
+        stages.append(Stage("postprocess", lambda image_name: postprocess_dict(image_name, json_directory, records[image_name]), workers["postprocess"]))
+    if not smiles_batch_size:
+        stages.append(Stage("smiles", lambda image_name: update_dict_with_smiles(info, image_name, image_directory, json_directory, records[image_name]), workers["smiles"]))
+    stages.append(Stage("save", lambda image_name: records.pop(image_name).save(), workers["save"]))
+
+    pipeline = StagedPipeline(stages, queue_size)
+    processed = pipeline.run(image_names)
+    for image_name, error in pipeline.errors.items():
+        print(f"Error processing {image_name}: {error}")
+    for record in records.values(): # Keep the stages completed by failed images
+        record.save()
+    if corpus_resolution:
+        print('Postprocessing all reaction dictionaries...')
+        batch_postprocess_dicts(processed, json_directory)
+    if smiles_batch_size:
+        print('Extracting reaction SMILES of all images...')
+        batch_update_dicts_with_smiles(info, processed, image_directory, json_directory, smiles_batch_size)
+    pipeline.print_utilisation()
     print()
     print("DataRaider -- Mission Accomplished. All images processed!")
+    return pipeline.utilisation()
 
 
 def clear_temp_files(
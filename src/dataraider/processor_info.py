@@ -1,5 +1,6 @@
-from rxnscribe import RxnScribe
-import torch
+from .api_client import APIClient
+from .rxnscribe_model import LazyRxnScribe, RxnScribeWorker, checkpoint_id
+from .prediction_cache import CachedRxnScribe
 
 """
 Contains DataRaiderInfo class, global information shared throughout different files of dataraider module
@@ -10,12 +11,16 @@ class DataRaiderInfo():
     """
     Stores global information required for DataRaider processing
     
-    :param api_key: OpenAI API key
+    :param api_key: API key of the provider
     :type api_key: str
-    :param model: RxnScribe instance, used to extract reaction information
-    :type model: RxnScribe
+    :param model: RxnScribe, used to extract reaction information, loaded on first use
+    :type model: LazyRxnScribe, RxnScribeWorker or CachedRxnScribe
     :param vlm_model: Model id of OpenAI model to use, defaults to "gpt-4o-2024-08-06"
     :type vlm_model: str
+    :param client: Pooled HTTP client shared by all API calls
+    :type client: APIClient
+    :param extraction_encoding: Keyword arguments of compact_encode_image for extraction requests, None to send subfigures as stored
+    :type extraction_encoding: dict
     
     """
     
@@ -23,18 +28,64 @@ class DataRaiderInfo():
                  api_key:str,
                  vlm_model = "gpt-4o-2024-08-06",
                  device='cpu', 
-                 ckpt_path:str=None):
+                 ckpt_path:str=None,
+                 request_timeout:float=300,
+                 max_retries:int=5,
+                 max_connections:int=16,
+                 response_cache=None,
+                 provider=None,
+                 hedge_quantile:float=None,
+                 max_hedge_rate:float=0.05,
+                 extraction_encoding:dict=None,
+                 rxnscribe_worker:str=None,
+                 rxnscribe_threads:int=None,
+                 prediction_cache=None):
         """Constructor method
 
-        :param api_key: OpenAI API key
+        :param api_key: API key of the provider
         :type api_key: str
         :param vlm_model: Model id of OpenAI model to use, defaults to "gpt-4o-2024-08-06"
         :type vlm_model: str, optional
         :param device: Specifies whether to use CPU or GPU, defaults to 'cpu'
         :type device: str, optional
-        :param ckpt_path: Specifies ckpt path, defaults to None
+        :param ckpt_path: Specifies ckpt path, defaults to None (downloaded from the Hugging Face Hub on first use)
         :type ckpt_path: str, optional
+        :param request_timeout: Read timeout of API requests in seconds, defaults to 300
+        :type request_timeout: float, optional
+        :param max_retries: Maximum number of retries per API request, defaults to 5
+        :type max_retries: int, optional
+        :param max_connections: Number of pooled keep-alive connections to the API, defaults to 16
+        :type max_connections: int, optional
+        :param response_cache: Cache of VLM responses shared by all API calls, defaults to None
+        :type response_cache: ResponseCache, optional
+        :param provider: OpenAI-compatible endpoint and per-stage models, defaults to the one configured from the environment
+        :type provider: mermaidapi.Provider, optional
+        :param hedge_quantile: Latency quantile of a stage after which a slow request is sent a second time, defaults to None (no hedging)
+        :type hedge_quantile: float, optional
+        :param max_hedge_rate: Maximum fraction of requests that are hedged, defaults to 0.05
+        :type max_hedge_rate: float, optional
+        :param extraction_encoding: Keyword arguments of compact_encode_image used for the subfigures of extraction requests, defaults to None (subfigures sent as stored)
+        :type extraction_encoding: dict, optional
+        :param rxnscribe_worker: Host RxnScribe in a separate worker process: "local" to start one, or the "host:port" of a running worker, defaults to None (loaded in this process)
+        :type rxnscribe_worker: str, optional
+        :param rxnscribe_threads: Number of threads of RxnScribe CPU inference, defaults to None (torch default)
+        :type rxnscribe_threads: int, optional
+        :param prediction_cache: Cache of RxnScribe predictions, defaults to None
+        :type prediction_cache: PredictionCache, optional
         """
         self.api_key = api_key
         self.vlm_model = vlm_model
-        self.model = RxnScribe(ckpt_path, device=torch.device(device)) # initialize RxnScribe to get SMILES 
+        self.extraction_encoding = extraction_encoding
+        self.client = APIClient(api_key, timeout=(10, request_timeout), max_retries=max_retries, pool_size=max_connections, cache=response_cache, provider=provider,
+                                hedge_quantile=hedge_quantile, max_hedge_rate=max_hedge_rate)
+        # RxnScribe to get SMILES, only loaded when the first prediction is made
+        if rxnscribe_worker:
+            self.model = RxnScribeWorker(None if rxnscribe_worker == "local" else rxnscribe_worker, ckpt_path, device, rxnscribe_threads)
+        else:
+            self.model = LazyRxnScribe(ckpt_path, device, rxnscribe_threads)
+        if prediction_cache is not None:
+            checkpoint = checkpoint_id(ckpt_path)
+            if checkpoint is None:
+                print("WARNING: Could not determine the revision of the RxnScribe checkpoint. Predictions will not be cached.\n")
+            else:
+                self.model = CachedRxnScribe(self.model, prediction_cache, checkpoint)
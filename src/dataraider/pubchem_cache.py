@@ -0,0 +1,174 @@
+import time
+import sqlite3
+import threading
+from pathlib import Path
+from collections import OrderedDict
+
+"""
+Module for the persistent cache of PubChem name and formula lookups
+"""
+
+_default_cache = None
+
+
+class PubChemCache():
+    """
+    SQLite cache of PubChem lookups, keyed by namespace ("name" or "formula") and query, with a warm
+    in-memory LRU on top. Misses are cached too (negative caching) so that names PubChem does not know
+    are not looked up again on every run. Found SMILES expire after ttl_days and misses after the
+    shorter negative_ttl_days, so that newly added PubChem records are eventually picked up.
+    Without a cache_path only the in-memory LRU is used.
+
+    :param cache_path: Path to the SQLite database file, defaults to None (in-memory only)
+    :type cache_path: str, optional
+    :param ttl_days: Lifetime of a found SMILES in days, defaults to 180
+    :type ttl_days: float
+    :param negative_ttl_days: Lifetime of a miss in days, defaults to 14
+    :type negative_ttl_days: float
+    :param memory_size: Number of lookups kept in the in-memory LRU, defaults to 4096
+    :type memory_size: int
+    """
+
+    def __init__(self,
+                 cache_path:str=None,
+                 ttl_days:float=180,
+                 negative_ttl_days:float=14,
+                 memory_size:int=4096):
+        """Constructor method
+        """
+        self.cache_path = Path(cache_path) if cache_path else None
+        self.ttl = ttl_days * 86400
+        self.negative_ttl = negative_ttl_days * 86400
+        self.memory_size = memory_size
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._connection = None
+        if self.cache_path is not None:
+            self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+            self._connection = sqlite3.connect(str(self.cache_path), timeout=30, check_same_thread=False)
+            with self._connection:
+                self._connection.execute(
+                    "CREATE TABLE IF NOT EXISTS lookups ("
+                    "namespace TEXT NOT NULL, query TEXT NOT NULL, smiles TEXT, fetched REAL NOT NULL, "
+                    "PRIMARY KEY (namespace, query))")
+
+    def _expiry(self, smiles:str, fetched:float):
+        """
+        Helper function to compute when a lookup expires
+        """
+        return fetched + (self.ttl if smiles else self.negative_ttl)
+
+    def _remember(self, key:tuple, smiles:str, expires:float):
+        """
+        Helper function to insert a lookup into the in-memory LRU. Must be called with the lock held.
+        """
+        self._memory[key] = (smiles, expires)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def get(self, namespace:str, query:str):
+        """
+        Looks up a cached PubChem result
+
+        :param namespace: PubChem namespace of the query, "name" or "formula"
+        :type namespace: str
+        :param query: Chemical name or formula
+        :type query: str
+
+        :return: Returns whether the lookup is cached and the cached SMILES (None for a cached miss)
+        :rtype: tuple[bool, str]
+        """
+        key = (namespace, query)
+        now = time.time()
+        with self._lock:
+            cached = self._memory.get(key)
+            if cached is not None and cached[1] > now:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                self.negative_hits += cached[0] is None
+                return True, cached[0]
+            if self._connection is not None:
+                row = self._connection.execute(
+                    "SELECT smiles, fetched FROM lookups WHERE namespace = ? AND query = ?", key).fetchone()
+                if row is not None and self._expiry(*row) > now:
+                    self._remember(key, row[0], self._expiry(*row))
+                    self.disk_hits += 1
+                    self.negative_hits += row[0] is None
+                    return True, row[0]
+            self.misses += 1
+        return False, None
+
+    def put(self, namespace:str, query:str, smiles:str):
+        """
+        Stores a PubChem result
+
+        :param namespace: PubChem namespace of the query, "name" or "formula"
+        :type namespace: str
+        :param query: Chemical name or formula
+        :type query: str
+        :param smiles: SMILES found, or None if PubChem has no match
+        :type smiles: str
+        """
+        now = time.time()
+        with self._lock:
+            self._remember((namespace, query), smiles, self._expiry(smiles, now))
+            if self._connection is not None:
+                with self._connection:
+                    self._connection.execute(
+                        "INSERT OR REPLACE INTO lookups (namespace, query, smiles, fetched) VALUES (?, ?, ?, ?)",
+                        (namespace, query, smiles, now))
+
+    def stats(self):
+        """
+        Reports cache usage
+
+        :return: Returns the number of in-memory hits, on-disk hits, hits on cached misses, misses and stored lookups
+        :rtype: dict
+        """
+        with self._lock:
+            entries = len(self._memory)
+            if self._connection is not None:
+                entries = self._connection.execute("SELECT COUNT(*) FROM lookups").fetchone()[0]
+        return {"memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "negative_hits": self.negative_hits,
+                "misses": self.misses,
+                "entries": entries}
+
+    def close(self):
+        """
+        Closes the database connection
+        """
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+def get_pubchem_cache():
+    """
+    Returns the process-wide PubChem cache shared by all lookups
+
+    :return: Returns the cache set with set_pubchem_cache, or an in-memory cache if none was set
+    :rtype: PubChemCache
+    """
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = PubChemCache()
+    return _default_cache
+
+
+def set_pubchem_cache(cache:PubChemCache):
+    """
+    Sets the process-wide PubChem cache shared by all lookups
+
+    :param cache: The cache, or None to go back to an in-memory cache
+    :type cache: PubChemCache
+    """
+    global _default_cache
+    _default_cache = cache
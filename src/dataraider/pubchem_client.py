@@ -0,0 +1,273 @@
+import time
+import random
+import asyncio
+import threading
+import requests
+from urllib.parse import quote
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+from mermaidapi.ledger import percentile
+from .pubchem_cache import PubChemCache, get_pubchem_cache
+from .chemical_dictionary import get_chemical_dictionary
+
+"""
+Module for the asynchronous PubChem client used to resolve many chemical names at once
+"""
+
+PUG_REST_URL = "https://pubchem.ncbi.nlm.nih.gov/rest/pug"
+PUBCHEM_REQUESTS_PER_SECOND = 5 # PubChem PUG REST usage policy
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+_default_client = None
+
+
+class _Throttle():
+    """
+    Spaces calls at least 1 / rate seconds apart across all threads
+    """
+
+    def __init__(self, rate:float):
+        self.interval = 1 / rate
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+
+# Shared by every PubChem request of the process, synchronous or not
+pubchem_throttle = _Throttle(PUBCHEM_REQUESTS_PER_SECOND)
+
+
+def _retry_after(response):
+    """
+    Helper function to read the server-requested wait time from a response
+
+    :return: Returns the number of seconds to wait, or None if the server did not specify one
+    :rtype: float
+    """
+    try:
+        return max(0.0, float(response.headers.get("Retry-After")))
+    except (TypeError, ValueError):
+        return None
+
+
+class AsyncPubChemClient():
+    """
+    Asynchronous PubChem client resolving chemical names to SMILES, many lookups at a time.
+    Each lookup tries the name and then the formula strategy, each in a single PUG REST request, as in
+    pubchem_to_smiles. The formula request is only sent when the name is not found, so that no request
+    under the shared rate limit is spent on an answer that would be discarded.
+    Names in the local chemical dictionary and cached lookups are answered without any request. Requests are
+    throttled to PubChem's rate limit across the whole process and retried with exponential backoff on
+    rate limits (PubChem answers 503 when busy), server errors and dropped connections. The latency,
+    source and request count of every lookup are kept in metrics.
+
+    :param workers: Maximum number of requests in flight, defaults to PUBCHEM_REQUESTS_PER_SECOND
+    :type workers: int
+    :param timeout: Connect and read timeouts of a request in seconds, defaults to (5, 30)
+    :type timeout: tuple
+    :param max_retries: Maximum number of retries per request, defaults to 4
+    :type max_retries: int
+    :param backoff_base: Base delay of the exponential backoff in seconds, defaults to 1.0
+    :type backoff_base: float
+    :param backoff_max: Maximum delay of the exponential backoff in seconds, defaults to 30.0
+    :type backoff_max: float
+    :param cache: Cache of PubChem lookups, defaults to the process-wide cache (see set_pubchem_cache)
+    :type cache: PubChemCache, optional
+    """
+
+    def __init__(self,
+                 workers:int=PUBCHEM_REQUESTS_PER_SECOND,
+                 timeout:tuple=(5, 30),
+                 max_retries:int=4,
+                 backoff_base:float=1.0,
+                 backoff_max:float=30.0,
+                 cache:PubChemCache=None):
+        """Constructor method
+        """
+        self.workers = workers
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.cache = cache or get_pubchem_cache()
+        self.metrics = []
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+        self.session.mount("https://", adapter)
+
+    def _send(self, url:str):
+        """
+        Helper function to send a single throttled request, run in the executor
+        """
+        pubchem_throttle.acquire()
+        return self.session.get(url, timeout=self.timeout)
+
+    async def _get(self, url:str):
+        """
+        Helper coroutine to send a request with retries
+
+        :raises requests.exceptions.RequestException: If the request still fails after all retries
+
+        :return: Returns the response and the number of attempts made
+        :rtype: tuple[requests.Response, int]
+        """
+        loop = asyncio.get_running_loop()
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                response = await loop.run_in_executor(self._executor, self._send, url)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if attempt > self.max_retries:
+                    raise
+                await asyncio.sleep(random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt)))
+                continue
+            if response.status_code in RETRY_STATUS_CODES and attempt <= self.max_retries:
+                delay = _retry_after(response)
+                if delay is None:
+                    delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+                await asyncio.sleep(delay)
+                continue
+            return response, attempt
+
+    async def _strategy(self, chemical:str, namespace:str):
+        """
+        Helper coroutine to look up a chemical in one namespace ("name" or "formula"), through the cache
+
+        :return: Returns the SMILES found (None if not found) and the number of requests made
+        :rtype: tuple[str, int]
+        """
+        cached, smiles = self.cache.get(namespace, chemical)
+        if cached:
+            return smiles, 0
+        endpoint = "name" if namespace == "name" else "fastformula"
+        url = f"{PUG_REST_URL}/compound/{endpoint}/{quote(chemical, safe='')}/property/IsomericSMILES/JSON"
+        try:
+            response, requests_made = await self._get(url)
+        except requests.exceptions.RequestException as e:
+            print(f"PubChem lookup of {chemical} by {namespace} failed: {e}")
+            return None, self.max_retries + 1
+        if response.status_code in (400, 404): # Not a known name or not a formula
+            self.cache.put(namespace, chemical, None)
+            return None, requests_made
+        if not response.ok:
+            print(f"PubChem lookup of {chemical} by {namespace} failed (HTTP {response.status_code})")
+            return None, requests_made
+        try:
+            properties = response.json()["PropertyTable"]["Properties"][0]
+            smiles = properties.get("IsomericSMILES") or properties.get("SMILES")
+        except (ValueError, KeyError, IndexError):
+            return None, requests_made
+        self.cache.put(namespace, chemical, smiles)
+        return smiles, requests_made
+
+    async def lookup(self, chemical:str):
+        """
+        Resolves a chemical name or formula to its SMILES
+
+        :param chemical: The common name or chemical formula to search for
+        :type chemical: str
+
+        :return: Returns the SMILES, or None if not found
+        :rtype: str
+        """
+        start = time.perf_counter()
+        source, smiles, requests_made = None, get_chemical_dictionary().get(chemical), 0
+        if smiles:
+            source = "dictionary"
+        else:
+            for namespace in ("name", "formula"):
+                smiles, made = await self._strategy(chemical, namespace)
+                requests_made += made
+                if smiles:
+                    source = namespace
+                    break
+            if source is not None and requests_made == 0:
+                source = "cache"
+        self.metrics.append({"chemical": chemical,
+                             "latency": time.perf_counter() - start,
+                             "source": source,
+                             "requests": requests_made})
+        return smiles
+
+    async def lookup_many(self, chemicals:list):
+        """
+        Resolves many chemical names concurrently
+
+        :param chemicals: The chemical names to look up
+        :type chemicals: list[str]
+
+        :return: Returns the SMILES of every chemical name, None if not found
+        :rtype: dict[str, str]
+        """
+        semaphore = asyncio.Semaphore(self.workers)
+
+        async def bounded_lookup(chemical):
+            async with semaphore:
+                return await self.lookup(chemical)
+
+        chemicals = list(chemicals)
+        results = await asyncio.gather(*(bounded_lookup(chemical) for chemical in chemicals))
+        return dict(zip(chemicals, results))
+
+    def summary(self):
+        """
+        Summarizes the lookups made
+
+        :return: Returns the number of lookups, lookups found per source, requests made and latency percentiles
+        :rtype: dict
+        """
+        latencies = [metric["latency"] for metric in self.metrics]
+        sources = {}
+        for metric in self.metrics:
+            sources[metric["source"] or "not_found"] = sources.get(metric["source"] or "not_found", 0) + 1
+        return {"lookups": len(self.metrics),
+                "sources": sources,
+                "requests": sum(metric["requests"] for metric in self.metrics),
+                "p50_latency": percentile(latencies, 50),
+                "p90_latency": percentile(latencies, 90),
+                "max_latency": max(latencies, default=0.0)}
+
+    def print_summary(self):
+        """
+        Prints the lookup statistics
+        """
+        summary = self.summary()
+        print(f"PubChem lookups: {summary['lookups']} names, {summary['requests']} requests, sources {summary['sources']}, "
+              f"latency p50 {summary['p50_latency']:.2f}s, p90 {summary['p90_latency']:.2f}s, max {summary['max_latency']:.2f}s")
+
+    def close(self):
+        """
+        Releases the worker threads and connections
+        """
+        self._executor.shutdown()
+        self.session.close()
+
+
+def get_pubchem_client():
+    """
+    Returns the process-wide asynchronous PubChem client used for corpus-wide lookups
+
+    :return: Returns the client set with set_pubchem_client, or None if none was set
+    :rtype: AsyncPubChemClient
+    """
+    return _default_client
+
+
+def set_pubchem_client(client:AsyncPubChemClient):
+    """
+    Sets the process-wide asynchronous PubChem client used for corpus-wide lookups (see resolve_chemicals)
+
+    :param client: The client, or None to go back to threaded pubchempy lookups
+    :type client: AsyncPubChemClient
+    """
+    global _default_client
+    _default_client = client
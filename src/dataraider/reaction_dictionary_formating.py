@@ -3,6 +3,7 @@ import os
 import regex as re
 from .processor_info import DataRaiderInfo
 from . import postprocess as pp
+from .reaction_record import ReactionRecord, clean_json_content
 from pathlib import Path
 
 """
@@ -21,10 +22,7 @@ def reformat_json(input_file:str):
     :rtype: None
     """
     with open(input_file, 'r') as file:
-        json_content = file.read()
-        json_content = json_content.replace("\"```json\\n", '').replace('```"', '').strip()       
-        json_content = json_content.replace('\\n', '').replace('\\"', '"')
-        data = json.loads(json_content)
+        data = clean_json_content(file.read())
         formatted_json = json.dumps(data, indent=4)
 
     # Write the formatted JSON to the output file
@@ -98,11 +96,74 @@ def update_dict_with_smiles_old(
     print(f'{image_name} reaction dictionary updated with reaction SMILES')
     
 
+def _scheme_image_file(
+                    image_name:str, 
+                    image_directory:str):
+    """
+    Helper function returning the segment of an image passed to RxnScribe (the first cropped segment, 
+    or the original image if it was not segmented)
+    """
+    image_file = Path(image_directory) / "cropped_images" / f"{image_name}_1.png"
+    if not image_file.exists():
+        image_file = Path(image_directory) / "cropped_images" / f"{image_name}_original.png"
+    return image_file
+
+
+def _reaction_smiles(predictions:list):
+    """
+    Helper function extracting the reactant and product SMILES of the first reaction predicted by RxnScribe
+
+    :return: Returns the reactant and product SMILES, 'N.R' for both if no complete reaction was predicted
+    :rtype: tuple[list[str], list[str]]
+    """
+    reactions = []
+    for prediction in predictions: 
+        reactant_smiles = [reactant.get('smiles') for reactant in prediction.get('reactants', []) if 'smiles' in reactant]
+        product_smiles = [product.get('smiles') for product in prediction.get('products', []) if 'smiles' in product]
+        reactions.append({'reactants': reactant_smiles, 'products': product_smiles})
+    if not reactions or not reactions[0]['reactants'] or not reactions[0]['products']:
+        return 'N.R', 'N.R'
+    return reactions[0]['reactants'], reactions[0]['products']
+
+
+def _apply_reaction_smiles(
+                    image_name:str, 
+                    json_directory:str,
+                    record:ReactionRecord,
+                    reactants,
+                    products):
+    """
+    Helper function combining the reaction dictionary with the reaction SMILES
+    """
+    standalone = record is None
+    if standalone:
+        record = ReactionRecord.load(image_name, json_directory)
+    opt_dict = record.data or {}
+    opt_key = next((k for k in opt_dict if "optimization" in k.lower()), None)
+    if opt_key is None:
+        print(f"WARNING. No optimization key found in the dictionary. Reactant and product SMILES not added")
+        return
+    opt_data = opt_dict[opt_key]
+
+    updated_dict = {
+        "SMILES": {
+            "reactants": reactants, 
+            "products": products
+        }, 
+        "Optimization Runs": opt_data
+    }
+    record.update(updated_dict, "smiles")
+    if standalone:
+        record.save()
+    print(f'{image_name} reaction dictionary updated with reaction SMILES')
+
+
 def update_dict_with_smiles(
                     info:DataRaiderInfo,
                     image_name:str, 
                     image_directory:str, 
-                    json_directory:str):
+                    json_directory:str,
+                    record:ReactionRecord=None):
     """
     Use RxnScribe to get reactants and product SMILES and combine reaction dictionary with reaction SMILES
     
@@ -114,64 +175,76 @@ def update_dict_with_smiles(
     :type image_directory: str
     :param json_directory: Path to directory of reaction dictionary
     :type json_directory: str
+    :param record: In-memory reaction record to update, defaults to None (read from and saved to the JSON file)
+    :type record: ReactionRecord, optional
     
-    :return: Returns nothing, all data saved in JSON
+    :return: Returns nothing, the record is updated (or the JSON saved)
     :rtype: None
     """
-    image_directory = Path(image_directory)
-    json_directory = Path(json_directory)
-
-    image_file = image_directory / "cropped_images" / f"{image_name}_1.png"
-    if not image_file.exists():
-        image_file = image_directory / "cropped_images" / f"{image_name}_original.png"    
-    reactions = []
+    image_file = _scheme_image_file(image_name, image_directory)
 
     # Extract reactant and product SMILES
     try: 
         predictions = info.model.predict_image_file(image_file, molscribe=True, ocr=False)
-        for prediction in predictions: 
-            reactant_smiles = [reactant.get('smiles') for reactant in prediction.get('reactants', []) if 'smiles' in reactant]
-            product_smiles = [product.get('smiles') for product in prediction.get('products', []) if 'smiles' in product]
-            reactions.append({'reactants': reactant_smiles, 'products': product_smiles})
-        
-        if not reactions or not reactions[0]['reactants'] or not reactions[0]['products']:
-            reactants, products = 'N.R', 'N.R'
-        else: 
-            reactants = reactions[0]['reactants']
-            products = reactions[0]['products']
-    
+        reactants, products = _reaction_smiles(predictions)
     except Exception as e: 
         print("No reaction SMILES extracted. Returning 'NR' for reactants and products.")
         reactants, products = 'N.R', 'N.R'
 
     # Update reaction dictionary with reaction SMILES 
-    json_path = json_directory / f"{image_name}.json"
-    # json_path = json_directory / f"{image_name}_updated.json" #retrieve updated if saved as new file
-    with open(json_path, 'r') as file: 
-        opt_dict = json.load(file)
-    opt_key = next((k for k in opt_dict if "optimization" in k.lower()), None)
-    if opt_key is None:
-        print(f"WARNING. No optimization key found in the dictionary. Reactant and product SMILES not added")
-        return
-    opt_data = opt_dict[opt_key]
+    _apply_reaction_smiles(image_name, json_directory, record, reactants, products)
 
-    updated_dict = {
-        "SMILES": {
-            "reactants": reactants, 
-            "products": products
-        }, 
-        "Optimization Runs": opt_data
-    }
-    output_path = json_path # update the original json file
-    # output_path = json_directory / f"{image_name}_updated_smiles.json" #save as new file
-    with open(output_path, 'w') as output_file: 
-        json.dump(updated_dict, output_file, indent = 4)
-    print(f'{image_name} reaction dictionary updated with reaction SMILES')
+
+def batch_update_dicts_with_smiles(
+                    info:DataRaiderInfo,
+                    image_names:list, 
+                    image_directory:str, 
+                    json_directory:str,
+                    batch_size:int=8):
+    """
+    Use RxnScribe to get the reactant and product SMILES of many images, running the model on batches of
+    reaction scheme segments (see update_dict_with_smiles), and combine each reaction dictionary with its
+    reaction SMILES. If a batch fails, its images are predicted one by one.
+    
+    :param info: Global information required for processing
+    :type info: DataRaiderInfo
+    :param image_names: Names of the images
+    :type image_names: list[str]
+    :param image_directory: Root directory where the original images are stored
+    :type image_directory: str
+    :param json_directory: Path to directory of reaction dictionary
+    :type json_directory: str
+    :param batch_size: Number of images per RxnScribe batch, defaults to 8
+    :type batch_size: int
+    
+    :return: Returns nothing, all data saved in JSON
+    :rtype: None
+    """
+    image_names = [image_name for image_name in image_names 
+                   if (Path(json_directory) / f"{image_name}.json").exists()]
+    for start in range(0, len(image_names), batch_size):
+        batch = image_names[start:start + batch_size]
+        image_files = [str(_scheme_image_file(image_name, image_directory)) for image_name in batch]
+        try:
+            predictions = info.model.predict_image_files(image_files, molscribe=True, ocr=False, batch_size=batch_size)
+        except Exception as e:
+            print(f"Batched SMILES extraction failed ({e}). Extracting image by image.")
+            for image_name in batch:
+                update_dict_with_smiles(info, image_name, image_directory, json_directory)
+            continue
+        for image_name, image_predictions in zip(batch, predictions):
+            try:
+                reactants, products = _reaction_smiles(image_predictions)
+            except Exception as e:
+                print("No reaction SMILES extracted. Returning 'NR' for reactants and products.")
+                reactants, products = 'N.R', 'N.R'
+            _apply_reaction_smiles(image_name, json_directory, None, reactants, products)
 
 
 def postprocess_dict(
                      image_name:str,
-                     json_directory:str):
+                     json_directory:str,
+                     record:ReactionRecord=None):
     """ 
     Converts common chemical names to smiles using pubchem and user-defined dictionary
     Unifies format for mixed solvent systems
@@ -180,18 +253,39 @@ def postprocess_dict(
     :type image_name: str
     :param json_directory: Path to directory of reaction dictionary
     :type json_directory: str
+    :param record: In-memory reaction record to update, defaults to None (read from and saved to the JSON file)
+    :type record: ReactionRecord, optional
     """
-    pp._process_raw_dict(image_name, json_directory, keys=pp.KEYS, common_names=pp.COMMON_NAMES)
+    if record is None:
+        pp._process_raw_dict(image_name, json_directory, keys=pp.KEYS, common_names=pp.COMMON_NAMES)
+    elif record.data is None:
+        print("WARNING: Could not find optimization runs. Dictionary will not be cleaned.\n")
+    else:
+        record.update(pp._entity_resolution_rxn_dict(record.data, pp.KEYS, pp.COMMON_NAMES), "postprocess")
     print("Postprocessing complete")
 
 
-def construct_initial_prompt(
-                            prompt_directory: str, 
-                            opt_run_keys: list, 
-                            new_run_keys: dict):
-    """Creates a get_data_prompt with opt_run_keys key-value pairs embedded into it
-    Uses <INSERT_HERE> as the location tag for inserting keys.
-    Saves the new prompt to a file named get_data_prompt.txt inside the Prompts directory
+def batch_postprocess_dicts(
+                     image_names:list,
+                     json_directory:str):
+    """ 
+    Postprocesses many reaction dictionaries at once, looking up each unique chemical name 
+    of all of them only once (see postprocess_dict)
+    
+    :param image_names: Names of the images
+    :type image_names: list[str]
+    :param json_directory: Path to directory of reaction dictionary
+    :type json_directory: str
+    """
+    pp.batch_process_raw_dicts(json_directory, image_names, keys=pp.KEYS, common_names=pp.COMMON_NAMES)
+    print("Postprocessing complete")
+
+
+def _select_key_lines(
+                    prompt_directory: str, 
+                    opt_run_keys: list, 
+                    new_run_keys: dict):
+    """Helper function to select the key-value pair descriptions embedded into the get_data_prompt
 
     :param prompt_directory: Path to the prompt directory
     :type prompt_directory: str
@@ -200,19 +294,18 @@ def construct_initial_prompt(
     :param new_run_keys: New optimization keys that are user defined
     :type new_run_keys: dict
     
-    :return: Returns nothing, all data saved in txt file
-    :rtype: None
+    :return: Returns the selected keys and their description lines
+    :rtype: list[tuple[str, str]]
     """
     prompt_directory = Path(prompt_directory)
-    marker = "<INSERT_HERE>"
+    new_run_keys = new_run_keys or {}
 
     # Retrieve all inbuilt keys
     inbuilt_key_pair_file_path = prompt_directory /"inbuilt_keyvaluepairs.txt"
     with open(inbuilt_key_pair_file_path, "r") as inbuilt_file:
         inbuilt_key_pair_file_contents = inbuilt_file.readlines()
-    
-    # Get the list of optimization run dictionary key value pairs
-    opt_run_list = [f'"{key}": "{new_run_keys[key]}"\n' for key in new_run_keys]
+
+    key_lines = [(key, f'"{key}": "{new_run_keys[key]}"\n') for key in new_run_keys]
     for line in inbuilt_key_pair_file_contents:
         if not line.strip():
             continue
@@ -222,7 +315,106 @@ def construct_initial_prompt(
             continue
         if all(key not in opt_run_keys for key in possible_keys):
             continue
-        opt_run_list.append(line)
+        key_lines.append((possible_keys[0], line))
+    return key_lines
+
+
+def build_response_schema(
+                        prompt_directory: str, 
+                        opt_run_keys: list, 
+                        new_run_keys: dict):
+    """Builds the JSON schema of the reaction dictionary for structured output requests.
+    Uses the same keys that construct_initial_prompt embeds into the get_data_prompt.
+    Runs are requested as a list so that the schema can be enforced strictly.
+
+    :param prompt_directory: Path to the prompt directory
+    :type prompt_directory: str
+    :param opt_run_keys: Optimization keys that are pre defined
+    :type opt_run_keys: list
+    :param new_run_keys: New optimization keys that are user defined
+    :type new_run_keys: dict
+    
+    :return: Returns the JSON schema
+    :rtype: dict
+    """
+    keys = list(dict.fromkeys(key for key, _ in _select_key_lines(prompt_directory, opt_run_keys, new_run_keys)))
+    run_schema = {
+        "type": "object",
+        "properties": {key: {"type": "string"} for key in keys},
+        "required": keys,
+        "additionalProperties": False
+    }
+    return {
+        "type": "object",
+        "properties": {"Optimization Runs": {"type": "array", "items": run_schema}},
+        "required": ["Optimization Runs"],
+        "additionalProperties": False
+    }
+
+
+def schema_errors(instance, schema: dict, path: str = "$"):
+    """Validates an instance against the subset of JSON schema used by build_response_schema
+    (object, array and string types with properties, required, additionalProperties and items)
+
+    :param instance: Decoded JSON value to validate
+    :type instance: Any
+    :param schema: JSON schema
+    :type schema: dict
+    :param path: Location of the instance, used in error messages
+    :type path: str
+    
+    :return: Returns the list of validation errors, empty if the instance is valid
+    :rtype: list[str]
+    """
+    expected_type = schema.get("type")
+    if expected_type == "object":
+        if not isinstance(instance, dict):
+            return [f"{path} is not an object"]
+        errors = [f"{path} is missing {key}" for key in schema.get("required", []) if key not in instance]
+        properties = schema.get("properties", {})
+        for key, value in instance.items():
+            if key in properties:
+                errors += schema_errors(value, properties[key], f"{path}.{key}")
+            elif schema.get("additionalProperties") is False:
+                errors.append(f"{path} has unexpected key {key}")
+            elif isinstance(schema.get("additionalProperties"), dict):
+                errors += schema_errors(value, schema["additionalProperties"], f"{path}.{key}")
+        return errors
+    if expected_type == "array":
+        if not isinstance(instance, list):
+            return [f"{path} is not an array"]
+        errors = []
+        for idx, item in enumerate(instance):
+            errors += schema_errors(item, schema.get("items", {}), f"{path}[{idx}]")
+        return errors
+    if expected_type == "string" and not isinstance(instance, str):
+        return [f"{path} is not a string"]
+    return []
+
+
+def construct_initial_prompt(
+                            prompt_directory: str, 
+                            opt_run_keys: list, 
+                            new_run_keys: dict):
+    """Creates a get_data_prompt with opt_run_keys key-value pairs embedded into it
+    Uses <INSERT_HERE> as the location tag for inserting keys.
+    Saves the new prompt to a file named get_data_prompt.txt inside the Prompts directory
+
+    :param prompt_directory: Path to the prompt directory
+    :type prompt_directory: str
+    :param opt_run_keys: Optimization keys that are pre defined
+    :type opt_run_keys: list
+    :param new_run_keys: New optimization keys that are user defined
+    :type new_run_keys: dict
+    
+    :return: Returns nothing, all data saved in txt file
+    :rtype: None
+    """
+    prompt_directory = Path(prompt_directory)
+    marker = "<INSERT_HERE>"
+
+    # Get the list of optimization run dictionary key value pairs
+    opt_run_list = [line for _, line in _select_key_lines(prompt_directory, opt_run_keys, new_run_keys)]
     
     base_prompt_file_path = prompt_directory / "base_prompt.txt"
     with open(base_prompt_file_path, "r") as base_prompt_file:
@@ -0,0 +1,162 @@
+import os
+import json
+from pathlib import Path
+
+"""
+Module for the in-memory reaction record of an image, passed through the DataRaider stages
+and written to its JSON file once at the end
+"""
+
+SNAPSHOT_FOLDER = "snapshots"
+
+
+def clean_json_content(json_content:str):
+    """
+    Clean a saved VLM response by removing the Markdown fence and escape characters and parse it
+
+    :param json_content: Response as saved to a JSON file, i.e. as a JSON-encoded string
+    :type json_content: str
+
+    :raises json.JSONDecodeError: If the cleaned content is not valid JSON
+
+    :return: Returns the decoded reaction dictionary
+    :rtype: dict
+    """
+    json_content = json_content.replace("\"```json\\n", '').replace('```"', '').strip()
+    json_content = json_content.replace('\\n', '').replace('\\"', '"')
+    return json.loads(json_content)
+
+
+def write_json_atomic(file_path:str, data):
+    """
+    Writes JSON to a temporary file and moves it over file_path, so that readers never see a partial file
+
+    :param file_path: Path of the JSON file to write
+    :type file_path: str
+    :param data: JSON-serializable data
+    :type data: Any
+    """
+    file_path = Path(file_path)
+    tmp_path = file_path.with_name(file_path.name + f".{os.getpid()}.tmp")
+    with open(tmp_path, "w") as file:
+        json.dump(data, file, indent=4)
+    os.replace(tmp_path, file_path)
+
+
+class ReactionRecord():
+    """
+    Reaction dictionary of one image, updated in memory by each DataRaider stage.
+    Holds either the decoded dictionary (data) or, if the last VLM response could not be cleaned,
+    that raw response (raw), which is what the JSON file would have held.
+
+    :param image_name: Name of image
+    :type image_name: str
+    :param json_directory: Output directory of the reaction dictionaries
+    :type json_directory: str
+    :param snapshot_directory: Directory to write the record to after every stage for debugging, defaults to None (no snapshots)
+    :type snapshot_directory: str, optional
+    """
+
+    def __init__(self,
+                 image_name:str,
+                 json_directory:str,
+                 snapshot_directory:str=None):
+        """Constructor method
+        """
+        self.image_name = image_name
+        self.json_path = Path(json_directory) / f"{image_name}.json"
+        self.snapshot_directory = Path(snapshot_directory) if snapshot_directory else None
+        self.data = None
+        self.raw = None
+        self.stages = []
+
+    @classmethod
+    def load(cls,
+             image_name:str,
+             json_directory:str,
+             snapshot_directory:str=None):
+        """
+        Reads the record of an image from its JSON file
+
+        :return: Returns the record, empty if the file does not exist
+        :rtype: ReactionRecord
+        """
+        record = cls(image_name, json_directory, snapshot_directory)
+        if record.json_path.exists():
+            with open(record.json_path, "r") as file:
+                content = json.load(file)
+            if isinstance(content, dict):
+                record.data = content
+            else:
+                record.raw = content
+        return record
+
+    @property
+    def empty(self):
+        """Whether no stage has produced content yet"""
+        return self.data is None and self.raw is None
+
+    def text(self):
+        """
+        Serializes the record as its JSON file content, e.g. to send it back to the VLM
+
+        :return: Returns the JSON text
+        :rtype: str
+        """
+        if self.data is not None:
+            return json.dumps(self.data, indent=4)
+        return json.dumps(self.raw)
+
+    def update(self, data:dict, stage:str):
+        """
+        Replaces the reaction dictionary with the output of a stage
+
+        :param data: Reaction dictionary
+        :type data: dict
+        :param stage: Name of the stage
+        :type stage: str
+        """
+        self.data, self.raw = data, None
+        self._snapshot(stage)
+
+    def update_from_response(self, reaction_data:str, stage:str):
+        """
+        Replaces the reaction dictionary with a VLM response, cleaned into a dictionary if possible
+
+        :param reaction_data: Content of the VLM response
+        :type reaction_data: str
+        :param stage: Name of the stage
+        :type stage: str
+
+        :return: Returns True if the response was cleaned, False if it was kept raw
+        :rtype: bool
+        """
+        try:
+            data = clean_json_content(json.dumps(reaction_data))
+        except Exception as e:
+            print(f"Reaction data not cleaned. Error: {e}")
+            self.data, self.raw = None, reaction_data
+            self._snapshot(stage)
+            return False
+        self.update(data, stage)
+        return True
+
+    def _snapshot(self, stage:str):
+        """
+        Helper function to write the record after a stage if snapshots are enabled
+        """
+        self.stages.append(stage)
+        if self.snapshot_directory is None:
+            return
+        self.snapshot_directory.mkdir(parents=True, exist_ok=True)
+        snapshot_path = self.snapshot_directory / f"{self.image_name}.{len(self.stages):02d}_{stage}.json"
+        write_json_atomic(snapshot_path, self.data if self.data is not None else self.raw)
+
+    def save(self):
+        """
+        Writes the record to its JSON file in one atomic step. Does nothing if the record is empty.
+        """
+        if self.empty:
+            return
+        self.json_path.parent.mkdir(parents=True, exist_ok=True)
+        write_json_atomic(self.json_path, self.data if self.data is not None else self.raw)
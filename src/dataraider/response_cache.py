@@ -0,0 +1,158 @@
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import requests
+from pathlib import Path
+
+"""
+Module for the on-disk cache of VLM chat completion responses
+"""
+
+
+class CacheMissError(requests.exceptions.RequestException):
+    """
+    Raised in replay mode when a request has no cached response
+    """
+
+
+class ResponseCache():
+    """
+    Content-addressed SQLite cache of chat completion responses.
+    Responses are keyed by a hash of the request payload (model, messages, max_tokens and any
+    other request option), so identical requests are only paid for once. The cache is capped
+    in size and evicts the least recently used responses first. In replay mode the cache is
+    read-only and a missing response raises CacheMissError instead of calling the API.
+
+    :param cache_path: Path to the SQLite database file
+    :type cache_path: str
+    :param max_size_mb: Maximum total size of cached responses in megabytes, defaults to 1024
+    :type max_size_mb: float
+    :param replay: Whether to only serve cached responses, defaults to False
+    :type replay: bool
+    """
+
+    def __init__(self,
+                 cache_path:str,
+                 max_size_mb:float=1024,
+                 replay:bool=False):
+        """Constructor method
+        """
+        self.cache_path = Path(cache_path)
+        self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        self.replay = replay
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(str(self.cache_path), timeout=30, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, response TEXT NOT NULL, "
+                "size INTEGER NOT NULL, last_access REAL NOT NULL)")
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+            # Running total of the response sizes, so that puts do not sum the whole table
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            self._connection.execute(
+                "INSERT OR IGNORE INTO metadata (name, value) "
+                "SELECT 'total_size', COALESCE(SUM(size), 0) FROM responses")
+
+    @staticmethod
+    def request_key(payload:dict):
+        """
+        Computes the cache key of a request
+
+        :param payload: JSON payload of the request
+        :type payload: dict
+
+        :return: Returns the SHA-256 hex digest of the canonical JSON payload
+        :rtype: str
+        """
+        canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def get(self, key:str):
+        """
+        Looks up a cached response
+
+        :param key: Cache key of the request
+        :type key: str
+
+        :return: Returns the cached response, or None on a miss
+        :rtype: dict
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            if not self.replay:
+                with self._connection:
+                    self._connection.execute(
+                        "UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+        return json.loads(row[0])
+
+    def put(self, key:str, response:dict):
+        """
+        Stores a response and evicts the least recently used responses if the cache is over its size cap.
+        Does nothing in replay mode.
+
+        :param key: Cache key of the request
+        :type key: str
+        :param response: Decoded JSON response
+        :type response: dict
+        """
+        if self.replay:
+            return
+        data = json.dumps(response)
+        with self._lock, self._connection:
+            self._connection.execute("BEGIN IMMEDIATE") # Other processes sharing the cache must not change the total in between
+            replaced = self._connection.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses (key, response, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, data, len(data), time.time()))
+            self._connection.execute("UPDATE metadata SET value = value + ? WHERE name = 'total_size'",
+                                     (len(data) - (replaced[0] if replaced else 0),))
+            total_size = self._connection.execute("SELECT value FROM metadata WHERE name = 'total_size'").fetchone()[0]
+            evicted = 0
+            while total_size > self.max_size:
+                oldest = self._connection.execute(
+                    "SELECT key, size FROM responses ORDER BY last_access LIMIT 1").fetchone()
+                if oldest is None or oldest[0] == key:
+                    break
+                self._connection.execute("DELETE FROM responses WHERE key = ?", (oldest[0],))
+                total_size -= oldest[1]
+                evicted += oldest[1]
+                self.evictions += 1
+            if evicted:
+                self._connection.execute("UPDATE metadata SET value = value - ? WHERE name = 'total_size'", (evicted,))
+
+    def stats(self):
+        """
+        Reports cache usage
+
+        :return: Returns the number of hits, misses, evictions, stored entries and stored bytes
+        :rtype: dict
+        """
+        with self._lock:
+            entries = self._connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            size = self._connection.execute("SELECT value FROM metadata WHERE name = 'total_size'").fetchone()[0]
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": entries,
+                "size_bytes": size}
+
+    def close(self):
+        """
+        Closes the database connection
+        """
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,346 @@
+import os
+import time
+import argparse
+import tempfile
+import threading
+import multiprocessing
+from multiprocessing.connection import Client, Listener
+
+"""
+Module for loading RxnScribe on first use, in this process or in a separate worker process
+"""
+
+RXNSCRIBE_REPO = "yujieq/RxnScribe"
+RXNSCRIBE_CHECKPOINT = "pix2seq_reaction_full.ckpt"
+WORKER_AUTHKEY_ENV = "RXNSCRIBE_WORKER_KEY"
+
+
+def load_rxnscribe(ckpt_path:str=None, device:str="cpu", num_threads:int=None):
+    """
+    Loads RxnScribe, downloading its checkpoint from the Hugging Face Hub if no path is given
+
+    :param ckpt_path: Path to the RxnScribe checkpoint, defaults to None (downloaded)
+    :type ckpt_path: str, optional
+    :param device: Specifies whether to use CPU or GPU, defaults to "cpu"
+    :type device: str
+    :param num_threads: Number of threads of CPU inference, defaults to None (torch default)
+    :type num_threads: int, optional
+
+    :return: Returns the model
+    :rtype: RxnScribe
+    """
+    import torch
+    from rxnscribe import RxnScribe
+    start = time.perf_counter()
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    if ckpt_path is None:
+        from huggingface_hub import hf_hub_download
+        ckpt_path = hf_hub_download(RXNSCRIBE_REPO, RXNSCRIBE_CHECKPOINT)
+    model = RxnScribe(ckpt_path, device=torch.device(device))
+    print(f"RxnScribe loaded in {time.perf_counter() - start:.1f}s")
+    return model
+
+
+def _hub_checkpoint_etag():
+    """
+    Helper function to read the etag (content hash) of the current RxnScribe checkpoint on the Hugging Face Hub,
+    or of the copy in the local Hub cache when offline. Returns None if neither is available.
+    """
+    try:
+        from huggingface_hub import get_hf_file_metadata, hf_hub_url, try_to_load_from_cache
+    except ImportError:
+        return None
+    try:
+        return get_hf_file_metadata(hf_hub_url(RXNSCRIBE_REPO, RXNSCRIBE_CHECKPOINT)).etag
+    except Exception:
+        cached = try_to_load_from_cache(RXNSCRIBE_REPO, RXNSCRIBE_CHECKPOINT)
+        # Cached files link to a blob named after their etag
+        return os.path.basename(os.path.realpath(cached)) if isinstance(cached, str) else None
+
+
+def checkpoint_id(ckpt_path:str=None):
+    """
+    Identifies a RxnScribe checkpoint, e.g. to key cached predictions, without reading the whole file
+
+    :param ckpt_path: Path to the RxnScribe checkpoint, defaults to None (the one downloaded from the Hugging Face Hub)
+    :type ckpt_path: str, optional
+
+    :return: Returns the identifier: the Hub file pinned to its etag, or the file name and size of a local
+        checkpoint. None if the revision of the Hub checkpoint cannot be determined.
+    :rtype: str
+    """
+    if ckpt_path is None:
+        etag = _hub_checkpoint_etag()
+        return f"{RXNSCRIBE_REPO}/{RXNSCRIBE_CHECKPOINT}@{etag}" if etag else None
+    try:
+        return f"{os.path.basename(ckpt_path)}:{os.path.getsize(ckpt_path)}"
+    except OSError:
+        return os.path.basename(ckpt_path)
+
+
+class LazyRxnScribe():
+    """
+    RxnScribe loaded in this process on the first prediction, so that runs that never extract reaction
+    SMILES (e.g. filtering only, or reruns served from caches) do not pay for loading the model
+
+    :param ckpt_path: Path to the RxnScribe checkpoint, defaults to None (downloaded on first use)
+    :type ckpt_path: str, optional
+    :param device: Specifies whether to use CPU or GPU, defaults to "cpu"
+    :type device: str
+    :param num_threads: Number of threads of CPU inference, defaults to None (torch default)
+    :type num_threads: int, optional
+    """
+
+    def __init__(self, ckpt_path:str=None, device:str="cpu", num_threads:int=None):
+        """Constructor method
+        """
+        self.ckpt_path = ckpt_path
+        self.device = device
+        self.num_threads = num_threads
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        """Whether the model has been loaded"""
+        return self._model is not None
+
+    @property
+    def model(self):
+        """The RxnScribe instance, loaded on first access"""
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    self._model = load_rxnscribe(self.ckpt_path, self.device, self.num_threads)
+        return self._model
+
+    def predict_image_file(self, image_file:str, **kwargs):
+        """
+        Predicts the reactions of an image file, see RxnScribe.predict_image_file
+        """
+        return self.model.predict_image_file(image_file, **kwargs)
+
+    def predict_image_files(self, image_files:list, **kwargs):
+        """
+        Predicts the reactions of several image files, see RxnScribe.predict_image_files
+        """
+        return self.model.predict_image_files(image_files, **kwargs)
+
+    def close(self):
+        """
+        Releases the model
+        """
+        self._model = None
+
+
+def worker_authkey():
+    """
+    Reads the key shared by a RxnScribe worker and its clients from the RXNSCRIBE_WORKER_KEY environment variable
+
+    :raises RuntimeError: If the environment variable is not set
+
+    :return: Returns the key
+    :rtype: bytes
+    """
+    authkey = os.environ.get(WORKER_AUTHKEY_ENV)
+    if not authkey:
+        raise RuntimeError(f"Set {WORKER_AUTHKEY_ENV} to the same secret for the RxnScribe worker and its clients")
+    return authkey.encode()
+
+
+def _read_image(image_file:str):
+    """
+    Helper function reading an image to send it to a worker, which may not share the filesystem
+    """
+    with open(image_file, "rb") as file:
+        return os.path.basename(str(image_file)), file.read()
+
+
+def _write_image(directory:str, index:int, image:tuple):
+    """
+    Helper function writing an image received by a worker to a temporary file
+    """
+    name, content = image
+    image_file = os.path.join(directory, f"{index}_{os.path.basename(name)}")
+    with open(image_file, "wb") as file:
+        file.write(content)
+    return image_file
+
+
+def _serve_connection(connection, model:LazyRxnScribe, lock:threading.Lock):
+    """
+    Helper function answering the predictions requested on a connection until it is closed. Requests
+    carry the content of the images, which is written to temporary files for the model.
+    """
+    try:
+        while True:
+            try:
+                method, images, kwargs = connection.recv()
+            except EOFError:
+                return
+            if method not in ("predict_image_file", "predict_image_files"):
+                connection.send(("error", f"Unknown method {method}"))
+                continue
+            try:
+                with tempfile.TemporaryDirectory(prefix="rxnscribe_") as directory:
+                    if method == "predict_image_file":
+                        images = _write_image(directory, 0, images)
+                    else:
+                        images = [_write_image(directory, index, image) for index, image in enumerate(images)]
+                    with lock:
+                        result = getattr(model, method)(images, **kwargs)
+                connection.send(("ok", result))
+            except Exception as e:
+                connection.send(("error", f"{type(e).__name__}: {e}"))
+    finally:
+        connection.close()
+
+
+def serve(address:tuple=None, connection=None, ckpt_path:str=None, device:str="cpu", num_threads:int=None, authkey:bytes=None):
+    """
+    Hosts RxnScribe and answers predictions, either on a single connection (a child process of
+    RxnScribeWorker) or for any number of clients on address until interrupted. The model is loaded
+    on the first prediction and kept for the lifetime of the worker. Listening on an address requires
+    a key, and clients that do not present it are refused.
+
+    :param address: (host, port) to listen on, defaults to None
+    :type address: tuple, optional
+    :param connection: Connection to serve instead of listening, defaults to None
+    :type connection: multiprocessing.connection.Connection, optional
+    :param ckpt_path: Path to the RxnScribe checkpoint, defaults to None (downloaded on first use)
+    :type ckpt_path: str, optional
+    :param device: Specifies whether to use CPU or GPU, defaults to "cpu"
+    :type device: str
+    :param num_threads: Number of threads of CPU inference, defaults to None (torch default)
+    :type num_threads: int, optional
+    :param authkey: Key clients must present, defaults to the RXNSCRIBE_WORKER_KEY environment variable
+    :type authkey: bytes, optional
+    """
+    model = LazyRxnScribe(ckpt_path, device, num_threads)
+    lock = threading.Lock()
+    if connection is not None:
+        _serve_connection(connection, model, lock)
+        return
+    if not authkey:
+        try:
+            authkey = worker_authkey()
+        except RuntimeError as e:
+            print(f"Not starting the RxnScribe worker: {e}")
+            return
+    with Listener(address, authkey=authkey) as listener:
+        print(f"RxnScribe worker listening on {address[0]}:{address[1]}")
+        while True:
+            connection = listener.accept()
+            threading.Thread(target=_serve_connection, args=(connection, model, lock), daemon=True).start()
+
+
+class RxnScribeWorker():
+    """
+    RxnScribe hosted in a separate long-lived process, with the same prediction methods as the model.
+    Without an address a worker process is started on the first prediction and stopped by close; with an
+    address the predictions are sent to a worker started separately (rxnscribe-worker),
+    which keeps the model loaded across runs. The model's memory and its CPU threads stay out of the
+    DataRaider process either way. Connecting to a worker requires the RXNSCRIBE_WORKER_KEY environment
+    variable to hold the key the worker was started with. The content of the images is sent with every
+    request, so the worker does not need access to the files.
+
+    :param address: "host:port" of a running worker, defaults to None (start a worker process)
+    :type address: str, optional
+    :param ckpt_path: Path to the RxnScribe checkpoint for a started worker, defaults to None (downloaded on first use)
+    :type ckpt_path: str, optional
+    :param device: Specifies whether a started worker uses CPU or GPU, defaults to "cpu"
+    :type device: str
+    :param num_threads: Number of threads of CPU inference of a started worker, defaults to None (torch default)
+    :type num_threads: int, optional
+    """
+
+    def __init__(self, address:str=None, ckpt_path:str=None, device:str="cpu", num_threads:int=None):
+        """Constructor method
+        """
+        self.address = address
+        self.ckpt_path = ckpt_path
+        self.device = device
+        self.num_threads = num_threads
+        self._process = None
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        """
+        Helper function to connect to the worker, starting it if needed. Must be called with the lock held.
+        """
+        if self._connection is not None:
+            return
+        if self.address:
+            host, port = self.address.rsplit(":", 1)
+            self._connection = Client((host, int(port)), authkey=worker_authkey())
+            return
+        context = multiprocessing.get_context("spawn")
+        self._connection, child_connection = context.Pipe()
+        self._process = context.Process(target=serve, kwargs={"connection": child_connection, "ckpt_path": self.ckpt_path, "device": self.device,
+                                                                    "num_threads": self.num_threads},
+                                        daemon=True)
+        self._process.start()
+        child_connection.close()
+
+    def _call(self, method:str, images, **kwargs):
+        """
+        Helper function to run a prediction in the worker
+
+        :raises RuntimeError: If the prediction failed in the worker, or no key is set to connect to it
+        """
+        with self._lock:
+            self._connect()
+            self._connection.send((method, images, kwargs))
+            status, result = self._connection.recv()
+        if status != "ok":
+            raise RuntimeError(f"RxnScribe worker: {result}")
+        return result
+
+    def predict_image_file(self, image_file:str, **kwargs):
+        """
+        Predicts the reactions of an image file, see RxnScribe.predict_image_file
+        """
+        return self._call("predict_image_file", _read_image(image_file), **kwargs)
+
+    def predict_image_files(self, image_files:list, **kwargs):
+        """
+        Predicts the reactions of several image files, see RxnScribe.predict_image_files
+        """
+        return self._call("predict_image_files", [_read_image(image_file) for image_file in image_files], **kwargs)
+
+    def close(self):
+        """
+        Disconnects from the worker, stopping it if it was started by this instance
+        """
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+            if self._process is not None:
+                self._process.join(timeout=10)
+                if self._process.is_alive():
+                    self._process.terminate()
+                self._process = None
+
+
+def main(argv:list=None):
+    """
+    Command line entry point starting a long-lived RxnScribe worker
+
+    :param argv: Command line arguments, defaults to sys.argv[1:]
+    :type argv: list[str], optional
+    """
+    parser = argparse.ArgumentParser(description="Host RxnScribe in a long-lived worker process for DataRaider.")
+    parser.add_argument("--host", type=str, help="Interface to listen on", default="127.0.0.1")
+    parser.add_argument("--port", type=int, help="Port to listen on", default=6010)
+    parser.add_argument("--ckpt_path", type=str, help="Path to the RxnScribe checkpoint (downloaded if not given)", default=None)
+    parser.add_argument("--device", type=str, help="Device of the model", default="cpu")
+    parser.add_argument("--threads", type=int, help="Number of threads of CPU inference", default=None)
+    args = parser.parse_args(argv)
+    serve((args.host, args.port), ckpt_path=args.ckpt_path, device=args.device, num_threads=args.threads)
+
+
+if __name__ == "__main__":
+    main()
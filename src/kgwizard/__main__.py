@@ -13,6 +13,7 @@ import multiprocessing
 import json
 import sys
 from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
 from functools import partial
 from itertools import repeat
@@ -21,6 +22,7 @@ from types import ModuleType
 from typing import Any, NewType, Sequence,TypeVar, Union
 
 import numpy as np
+from mermaidapi import AIMDController
 from .graphdb import janus
 from gremlin_python.structure.graph import GraphTraversalSource
 from .prompt import build_prompt, build_prompt_from_react_file, get_response
@@ -207,6 +209,23 @@ def build_transform_argparser():
         dynamic increase algorithm."""
     )
 
+    parser.add_argument(
+        "-ac", "--adaptive_concurrency",
+        action="store_true",
+        help="""If active, run the conversions in threads and adapt the number
+        of requests in flight to the API's latency and rate limits (AIMD),
+        starting at --dynamic_start and capped at --dynamic_max_workers. The
+        limit is printed at the end and, if --concurrency_metrics is given,
+        every change is logged."""
+    )
+
+    parser.add_argument(
+        "-cm", "--concurrency_metrics",
+        type=Path,
+        help="""JSONL file where every change of the adaptive concurrency limit
+        is appended. Only used with --adaptive_concurrency."""
+    )
+
     parser.add_argument(
         "-s", "--substitutions",
         type=parse_pair_sep_colon,
@@ -532,6 +551,7 @@ def get_json_from_react(
     , graph_name: str
     , results_path: Path
     , substitutions: Union[dict[str, Any], None] = None
+    , controller: Union[AIMDController, None] = None
 ) -> list[dict[str, str]]:
     """
     Process a JSON file (react file) to generate the final JSON output by making
@@ -547,6 +567,9 @@ def get_json_from_react(
     :type substitutions: dict[str, Any] | None
     :param graph: The JanusGraph traversal source. Required if RAG is active.
     :type graph: GraphTraversalSource | None
+    :param controller: Adaptive limit on requests in flight shared by all
+        files. Defaults to None for no limit.
+    :type controller: AIMDController | None
     :return: A list of the messages (dict) used during the prompt building and iteration.
     :rtype: list[dict[str, str]]
     :raises ValueError: If the schema file path is invalid (schema.__file__ is None).
@@ -584,7 +607,7 @@ def get_json_from_react(
         , **rag_dict
     )]
 
-    messages.append(get_response(messages))
+    messages.append(get_response(messages, controller, json_react_path.stem))
 
     save_path = results_path / Path(str(json_react_path.stem) +  '_1' + '.json')
     save_path.parent.mkdir(parents=True, exist_ok=True)
@@ -603,7 +626,7 @@ def get_json_from_react(
 
     for n in optimization_runs[1:]:
         messages.append(build_prompt(ITERATOR_STR.format(number=n)))
-        messages.append(get_response(messages))
+        messages.append(get_response(messages, controller, json_react_path.stem))
         save_path = results_path / Path(str(json_react_path.stem) +  f'_{n}' + '.json')
         with open(save_path, 'w') as f:
             f.write(messages[-1]["content"])
@@ -696,6 +719,45 @@ def static_par_exec_transform(
     return results
 
 
+def adaptive_par_exec_transform(
+    files_set: Sequence
+    , exec_fn_args: dict[str, Any]
+    , max_workers: int=30
+    , start: int=1
+    , metrics_path: Union[Path, None] = None
+):
+    """
+    Transform a set of files in a thread pool, letting an AIMD controller
+    decide how many requests are in flight. The limit grows by about one
+    request per round trip while latency and error rate stay healthy and is
+    halved on rate limits or timeouts.
+
+    :param files_set: A sequence of file paths to process.
+    :type files_set: Sequence[Path]
+    :param max_workers: The maximum number of requests in flight. Defaults to 30.
+    :type max_workers: int
+    :param start: The starting number of requests in flight. Defaults to 1.
+    :type start: int
+    :param metrics_path: JSONL file where every change of the limit is
+        appended. Defaults to None.
+    :type metrics_path: Path | None
+    :return: A list of results from each transformation.
+    :rtype: list[Any]
+    """
+    controller = AIMDController(
+        initial=start
+        , max_limit=max_workers
+        , metrics_path=metrics_path
+    )
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        results = list(pool.map(
+            partial(get_json_from_react, controller=controller, **exec_fn_args)
+            , files_set
+        ))
+    print(f"Adaptive concurrency: {controller.metrics()}")
+    return results
+
+
 def sequential_exec_transform(
     files_set: Sequence
     , exec_fn_args: dict[str, Any]
@@ -820,6 +882,8 @@ def exec_transform(
         - output_dir: The folder where the transformed JSON files will be stored
         - no_parallel: Boolean indicating whether to run sequentially
         - workers: Fixed number of workers if given
+        - adaptive_concurrency, concurrency_metrics: AIMD-controlled threaded
+          execution and its metrics file
         - dynamic_start, dynamic_steps, dynamic_max_workers: Parameters for
           dynamic parallel execution
         - substitutions: Substitutions for RAG, if any
@@ -849,6 +913,14 @@ def exec_transform(
             files_set=rfiles
             , exec_fn_args=exec_fn_args
         )
+    elif args.adaptive_concurrency:
+        adaptive_par_exec_transform(
+            files_set=rfiles
+            , exec_fn_args=exec_fn_args
+            , max_workers=args.dynamic_max_workers
+            , start=args.dynamic_start
+            , metrics_path=args.concurrency_metrics
+        )
     elif args.workers is not None:
         static_par_exec_transform(
             files_set=rfiles
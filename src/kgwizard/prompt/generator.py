@@ -1,10 +1,13 @@
 # -*- coding: utf-8 -*-
-import os
+import random
+import time
 from pathlib import Path
 from typing import Any, Union
 
-from openai import OpenAI
+from openai import APIConnectionError, APIError, APITimeoutError, InternalServerError, OpenAI, RateLimitError
 from dotenv import load_dotenv
+from mermaidapi import AIMDController, estimate_tokens, get_ledger, get_provider, get_rate_limiter
+from mermaidapi.ledger import usage_tokens
 load_dotenv()
 
 from .builder import (
@@ -15,9 +18,40 @@ from .builder import (
     build_guidelines,
 )
 
-client = OpenAI(
-    api_key=os.environ.get("OPENAI_API_KEY"),
-)
+MODEL = "gpt-4o"
+# Completion tokens reserved in the rate limiter before the actual usage is known
+COMPLETION_TOKEN_RESERVE = 4096
+LEDGER_STAGE = "kgwizard_transform"
+# Retries of failed requests, made here rather than by the OpenAI client so
+# that every attempt is charged to the rate limiter
+MAX_RETRIES = 2
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+
+_client = None
+
+
+def get_client() -> OpenAI:
+    """
+    Return the OpenAI client of this process, created on first use from the
+    shared provider configuration (base URL and authentication header).
+    The client does not retry; get_response does.
+
+    :return: The OpenAI client.
+    :rtype: OpenAI
+    """
+    global _client
+    if _client is None:
+        provider = get_provider()
+        api_key = provider.api_key()
+        auth_headers = provider.auth_headers(api_key)
+        _client = OpenAI(
+            api_key=api_key or "unused",
+            base_url=provider.base_url,
+            default_headers=auth_headers if provider.auth_header.lower() != "authorization" else None,
+            max_retries=0,
+        )
+    return _client
 
 
 def build_prompt(
@@ -95,20 +129,110 @@ def build_prompt_from_react_file(
         )
 
 
+def _create_completion(
+    messages: list[dict[str, Any]]
+    , controller: Union[AIMDController, None] = None
+) -> Any:
+    """
+    Send a single chat completion request. If a concurrency controller is
+    given, the request holds one of its slots and reports its latency and
+    outcome to it.
+    """
+    def create():
+        return get_client().chat.completions.create(
+            messages=messages
+            , model=get_provider().model_for(LEDGER_STAGE, MODEL)
+        )
+
+    if controller is None:
+        return create()
+    with controller.slot():
+        attempt_start = time.perf_counter()
+        try:
+            chat_completion = create()
+        except (RateLimitError, APITimeoutError):
+            controller.record(time.perf_counter() - attempt_start, ok=False, throttled=True)
+            raise
+        except APIError:
+            controller.record(time.perf_counter() - attempt_start, ok=False)
+            raise
+        controller.record(time.perf_counter() - attempt_start)
+    return chat_completion
+
+
+def _retry_delay(
+    error: APIError
+    , attempt: int
+) -> float:
+    """
+    Return the wait before retrying a failed request: the wait requested by
+    the server if any, or else an exponential backoff with full jitter.
+    """
+    response = getattr(error, "response", None)
+    headers = response.headers if response is not None else {}
+    for header, scale in (("retry-after-ms", 1000), ("retry-after", 1)):
+        try:
+            return max(0.0, float(headers.get(header, ""))) / scale + random.uniform(0, BACKOFF_BASE)
+        except ValueError:
+            pass
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
 def get_response(
     messages: list[dict[str, Any]]
+    , controller: Union[AIMDController, None] = None
+    , subject: Union[str, None] = None
 ) -> dict[str, str]:
     """
     Send a list of messages to the OpenAI API and retrieve the assistant's response.
+    Every attempt first acquires the prompt tokens plus COMPLETION_TOKEN_RESERVE
+    from the rate limiter shared with all other processes calling the API,
+    and the reservation is corrected to the reported usage once the response
+    arrives. Rate-limited, timed out and failed attempts are retried up to
+    MAX_RETRIES times with backoff. If a concurrency controller is given, each
+    attempt holds one of its slots and reports its latency and outcome to it.
+    Every call is appended to the shared call ledger.
 
     :param messages: A list of message strings in conversation format.
     :type messages: list[str]
+    :param controller: Adaptive limit on requests in flight. Defaults to None
+        for no limit.
+    :type controller: AIMDController | None
+    :param subject: Name of the study the request is about, recorded in the
+        ledger. Defaults to None.
+    :type subject: str | None
     :return: A dictionary containing the role (`"assistant"`) and response content.
     :rtype: dict[str, str]
     """
-    chat_completion = client.chat.completions.create(
-        messages=messages
-        , model="gpt-4o"
+    reserved = estimate_tokens({"messages": messages, "max_tokens": COMPLETION_TOKEN_RESERVE})
+    start = time.perf_counter()
+    retries = 0
+    while True:
+        get_rate_limiter().acquire(reserved)
+        try:
+            chat_completion = _create_completion(messages, controller)
+            break
+        except APIError as e:
+            retryable = isinstance(e, (RateLimitError, APIConnectionError, InternalServerError))
+            if not retryable or retries >= MAX_RETRIES:
+                get_ledger().record(
+                    LEDGER_STAGE, subject, get_provider().model_for(LEDGER_STAGE, MODEL), time.perf_counter() - start
+                    , retries=retries
+                    , status=getattr(e, "status_code", None)
+                )
+                raise
+            delay = _retry_delay(e, retries)
+            print(f"Request failed ({type(e).__name__}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+            retries += 1
+    usage = chat_completion.usage.model_dump() if chat_completion.usage else None
+    if usage:
+        used = usage_tokens(usage)
+        get_rate_limiter().reconcile(reserved, used["prompt_tokens"] + used["completion_tokens"])
+    get_ledger().record(
+        LEDGER_STAGE, subject, chat_completion.model, time.perf_counter() - start
+        , retries=retries
+        , usage=usage
     )
     return {
         "role": "assistant"
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+"""Model API utilities shared by DataRaider and KGWizard."""
+from .concurrency import AIMDController
+from .ledger import CallLedger, get_ledger, set_ledger_path
+from .mock_server import MockServer
+from .provider import Provider, get_provider, set_provider
+from .singleflight import SingleFlight
+from .rate_limiter import (
+    RateLimiter,
+    estimate_tokens,
+    get_rate_limiter,
+    set_rate_limits
+)
+
+__all__ = [
+    "AIMDController",
+    "CallLedger",
+    "MockServer",
+    "Provider",
+    "RateLimiter",
+    "SingleFlight",
+    "estimate_tokens",
+    "get_ledger",
+    "get_provider",
+    "get_rate_limiter",
+    "set_ledger_path",
+    "set_provider",
+    "set_rate_limits"
+]
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+"""
+Command line tools of the shared model API utilities::
+
+    python -m mermaidapi ledger [path]
+    python -m mermaidapi mock-server [--port 8000] [--latency 2] ...
+"""
+import sys
+
+from . import ledger, mock_server
+
+COMMANDS = {
+    "ledger": ledger.main,
+    "mock-server": mock_server.main,
+}
+
+
+def main() -> None:
+    if len(sys.argv) < 2 or sys.argv[1] not in COMMANDS:
+        print(f"usage: python -m mermaidapi {{{','.join(COMMANDS)}}} ...")
+        sys.exit(2)
+    COMMANDS[sys.argv[1]](sys.argv[2:])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+Adaptive concurrency control for API-bound stages.
+
+`AIMDController` limits the number of requests in flight and adapts the limit
+with additive increase / multiplicative decrease: every healthy response grows
+the limit by about one request per round trip, while a rate-limit response or
+a timeout cuts it by a constant factor. This finds the largest concurrency the
+API quota sustains without a hand-tuned worker count.
+"""
+import json
+import statistics
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, Union
+
+
+class AIMDController:
+    """
+    Additive-increase / multiplicative-decrease limit on requests in flight.
+
+    :param initial: Starting limit.
+    :type initial: int
+    :param min_limit: Lowest limit the controller can cut down to.
+    :type min_limit: int
+    :param max_limit: Highest limit the controller can grow to.
+    :type max_limit: int
+    :param increase: Requests added to the limit per round trip while healthy.
+    :type increase: float
+    :param decrease_factor: Factor applied to the limit on a rate limit or timeout.
+    :type decrease_factor: float
+    :param latency_target: Latency in seconds above which a response is not
+        healthy. Defaults to twice the median of the recent latencies.
+    :type latency_target: float | None
+    :param max_error_rate: Error rate of the recent responses above which the
+        limit stops growing.
+    :type max_error_rate: float
+    :param window: Number of recent responses used for the latency median and
+        the error rate.
+    :type window: int
+    :param metrics_path: If given, every change of the limit is appended to
+        this JSONL file.
+    :type metrics_path: str | Path | None
+    """
+
+    def __init__(
+        self,
+        initial: int = 4,
+        min_limit: int = 1,
+        max_limit: int = 64,
+        increase: float = 1.0,
+        decrease_factor: float = 0.5,
+        latency_target: Union[float, None] = None,
+        max_error_rate: float = 0.1,
+        window: int = 50,
+        metrics_path: Union[str, Path, None] = None,
+    ):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.increase = increase
+        self.decrease_factor = decrease_factor
+        self.latency_target = latency_target
+        self.max_error_rate = max_error_rate
+        self.metrics_path = Path(metrics_path) if metrics_path else None
+        self.in_flight = 0
+        self.increases = 0
+        self.decreases = 0
+        self._limit = float(max(min_limit, min(initial, max_limit)))
+        self._latencies = deque(maxlen=window)
+        self._errors = deque(maxlen=window)
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    @property
+    def limit(self) -> int:
+        """Current number of requests allowed in flight."""
+        return int(self._limit)
+
+    def acquire(self) -> None:
+        """Block until a request slot is free under the current limit."""
+        with self._condition:
+            while self.in_flight >= self.limit:
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self) -> None:
+        """Free a request slot."""
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    @contextmanager
+    def slot(self) -> Iterator[None]:
+        """Hold a request slot for the duration of the context."""
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def record(
+        self,
+        latency: float,
+        ok: bool = True,
+        throttled: bool = False,
+    ) -> None:
+        """
+        Update the limit from the outcome of a request.
+
+        :param latency: Latency of the request in seconds.
+        :type latency: float
+        :param ok: Whether the request succeeded.
+        :type ok: bool
+        :param throttled: Whether the request was rate limited (429) or timed out.
+        :type throttled: bool
+        """
+        with self._condition:
+            previous = self.limit
+            now = time.monotonic()
+            median = statistics.median(self._latencies) if self._latencies else latency
+            self._errors.append(not ok or throttled)
+            if throttled:
+                # Cut at most once per round trip, a burst of 429s is one congestion event
+                if now - self._last_decrease >= median:
+                    self._limit = max(float(self.min_limit), self._limit * self.decrease_factor)
+                    self._last_decrease = now
+                    self.decreases += 1
+            elif ok:
+                target = self.latency_target or 2 * median
+                error_rate = sum(self._errors) / len(self._errors)
+                if latency <= target and error_rate <= self.max_error_rate:
+                    self._limit = min(float(self.max_limit), self._limit + self.increase / self._limit)
+                    self.increases += 1
+                self._latencies.append(latency)
+            if self.limit != previous:
+                self._export(previous)
+                self._condition.notify_all()
+
+    def _export(self, previous: int) -> None:
+        if self.metrics_path is None:
+            return
+        with open(self.metrics_path, "a") as f:
+            f.write(json.dumps({
+                "time": time.time(),
+                "limit": self.limit,
+                "previous_limit": previous,
+                "in_flight": self.in_flight,
+            }) + "\n")
+
+    def metrics(self) -> dict[str, Union[int, float]]:
+        """
+        Snapshot of the controller state.
+
+        :return: The current limit, requests in flight, number of increases and
+            decreases, and the median latency and error rate of recent requests.
+        :rtype: dict[str, int | float]
+        """
+        with self._condition:
+            return {
+                "limit": self.limit,
+                "in_flight": self.in_flight,
+                "increases": self.increases,
+                "decreases": self.decreases,
+                "median_latency": statistics.median(self._latencies) if self._latencies else 0.0,
+                "error_rate": sum(self._errors) / len(self._errors) if self._errors else 0.0,
+            }
@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+"""
+Append-only ledger of every model API call.
+
+Each DataRaider and KGWizard request appends one JSON line with its stage, the
+image or study it was about, the model, the prompt, completion and cached
+prompt tokens, the latency and the number of retries. Processes append under a
+file lock, so a single ledger can collect a whole pipeline run.
+
+The ledger is enabled by setting `MERMAID_LEDGER` to the path of the JSONL
+file. Summarize it with::
+
+    python -m mermaidapi ledger path/to/ledger.jsonl
+"""
+import argparse
+import json
+import math
+import os
+import time
+from pathlib import Path
+from typing import Any, Iterator, Union
+
+from .locking import file_lock
+
+PERCENTILES = (50, 90, 99)
+
+_default_ledger = None
+
+
+def usage_tokens(
+    usage: Union[dict[str, Any], None]
+) -> dict[str, int]:
+    """
+    Extract the token counts of a chat completion `usage` block.
+
+    :param usage: The `usage` field of a chat completion response.
+    :type usage: dict[str, Any] | None
+    :return: Prompt, completion and cached prompt tokens. All zero if the
+        response carries no usage.
+    :rtype: dict[str, int]
+    """
+    usage = usage or {}
+    details = usage.get("prompt_tokens_details") or {}
+    return {
+        "prompt_tokens": usage.get("prompt_tokens") or 0,
+        "completion_tokens": usage.get("completion_tokens") or 0,
+        "cached_tokens": details.get("cached_tokens") or 0,
+    }
+
+
+class CallLedger:
+    """
+    JSONL ledger of model API calls shared between processes.
+
+    :param path: Path of the ledger file, or None to disable the ledger.
+    :type path: str | Path | None
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path, None] = None,
+    ):
+        self.path = Path(path) if path else None
+        if self.path is not None:
+            self.lock_path = self.path.with_name(self.path.name + ".lock")
+
+    @property
+    def enabled(self) -> bool:
+        """Whether calls are recorded."""
+        return self.path is not None
+
+    def record(
+        self,
+        stage: Union[str, None],
+        subject: Union[str, None],
+        model: Union[str, None],
+        latency: float,
+        retries: Union[int, None] = 0,
+        status: Union[int, None] = 200,
+        usage: Union[dict[str, Any], None] = None,
+        cached: bool = False,
+        deduplicated: bool = False,
+        hedge: bool = False,
+        request_bytes: int = 0,
+        upload_seconds: Union[float, None] = None,
+    ) -> None:
+        """
+        Append a call to the ledger. Does nothing if the ledger is disabled.
+
+        :param stage: Pipeline stage issuing the call.
+        :type stage: str | None
+        :param subject: Image or study the call was about.
+        :type subject: str | None
+        :param model: Model the call was sent to.
+        :type model: str | None
+        :param latency: Wall-clock latency of the call in seconds, retries included.
+        :type latency: float
+        :param retries: Number of retried attempts, or None if unknown.
+        :type retries: int | None
+        :param status: HTTP status of the final attempt, or None if no response.
+        :type status: int | None
+        :param usage: The `usage` field of the response.
+        :type usage: dict[str, Any] | None
+        :param cached: Whether the response was served from the response cache.
+        :type cached: bool
+        :param deduplicated: Whether the response was shared from an identical
+            request in flight.
+        :type deduplicated: bool
+        :param hedge: Whether the call was a duplicate sent to cut tail latency.
+        :type hedge: bool
+        :param request_bytes: Size of the request body sent in bytes.
+        :type request_bytes: int
+        :param upload_seconds: Time spent sending the request body, or None if
+            unknown.
+        :type upload_seconds: float | None
+        """
+        if self.path is None:
+            return
+        entry = {
+            "time": time.time(),
+            "stage": stage,
+            "subject": subject,
+            "model": model,
+            **usage_tokens(usage),
+            "latency": latency,
+            "retries": retries,
+            "status": status,
+            "cached": cached,
+            "deduplicated": deduplicated,
+            "hedge": hedge,
+            "request_bytes": request_bytes,
+            "upload_seconds": upload_seconds,
+        }
+        with file_lock(self.lock_path):
+            with open(self.path, "a") as f:
+                f.write(json.dumps(entry) + "\n")
+
+
+def read_ledger(
+    path: Union[str, Path]
+) -> Iterator[dict[str, Any]]:
+    """
+    Read the entries of a ledger file, skipping truncated lines.
+
+    :param path: Path of the ledger file.
+    :type path: str | Path
+    :return: An iterator over the ledger entries.
+    :rtype: Iterator[dict[str, Any]]
+    """
+    with open(path, "r") as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+
+def percentile(
+    values: list[float],
+    q: float,
+) -> float:
+    """
+    Nearest-rank percentile of a list of values.
+
+    :param values: The values, in any order.
+    :type values: list[float]
+    :param q: The percentile, between 0 and 100.
+    :type q: float
+    :return: The percentile, or 0.0 for an empty list.
+    :rtype: float
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+def summarize(
+    entries: Iterator[dict[str, Any]]
+) -> dict[str, dict[str, Any]]:
+    """
+    Aggregate ledger entries per stage.
+
+    :param entries: Ledger entries, as returned by `read_ledger`.
+    :type entries: Iterator[dict[str, Any]]
+    :return: A dictionary mapping each stage to its number of calls, cache
+        hits, deduplicated calls, hedges, failures and retries, its token totals, the
+        bytes and upload time of its requests, its total latency and the latency percentiles of the calls that reached
+        the API.
+    :rtype: dict[str, dict[str, Any]]
+    """
+    summary = {}
+    latencies = {}
+    for entry in entries:
+        stage = entry.get("stage") or "unknown"
+        stats = summary.setdefault(stage, {
+            "calls": 0, "cache_hits": 0, "deduplicated": 0, "hedges": 0, "failures": 0, "retries": 0,
+            "prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0,
+            "total_latency": 0.0, "request_bytes": 0, "total_upload": 0.0,
+        })
+        stats["calls"] += 1
+        stats["hedges"] += bool(entry.get("hedge"))
+        stats["failures"] += entry.get("status") != 200
+        stats["retries"] += entry.get("retries") or 0
+        for key in ("prompt_tokens", "completion_tokens", "cached_tokens", "request_bytes"):
+            stats[key] += entry.get(key) or 0
+        stats["total_upload"] += entry.get("upload_seconds") or 0.0
+        if entry.get("cached"):
+            stats["cache_hits"] += 1
+            continue
+        if entry.get("deduplicated"):
+            stats["deduplicated"] += 1
+            continue
+        stats["total_latency"] += entry.get("latency") or 0.0
+        latencies.setdefault(stage, []).append(entry.get("latency") or 0.0)
+    for stage, stats in summary.items():
+        for q in PERCENTILES:
+            stats[f"p{q}_latency"] = percentile(latencies.get(stage, []), q)
+    return summary
+
+
+def print_summary(
+    summary: dict[str, dict[str, Any]]
+) -> None:
+    """
+    Print a per-stage summary as returned by `summarize`, followed by the totals.
+
+    :param summary: The per-stage summary.
+    :type summary: dict[str, dict[str, Any]]
+    """
+    header = ["stage", "calls", "cached", "dedup", "hedges", "failed", "retries", "prompt_tok",
+              "completion_tok", "cached_tok", "sent_mb", "upload_s", "total_s"] + [f"p{q}_s" for q in PERCENTILES]
+    rows = []
+    for stage, stats in sorted(summary.items()):
+        rows.append([
+            stage, stats["calls"], stats["cache_hits"], stats["deduplicated"], stats["hedges"], stats["failures"],
+            stats["retries"], stats["prompt_tokens"], stats["completion_tokens"],
+            stats["cached_tokens"], f"{stats['request_bytes'] / 1024 / 1024:.1f}", f"{stats['total_upload']:.1f}",
+            f"{stats['total_latency']:.1f}",
+        ] + [f"{stats[f'p{q}_latency']:.2f}" for q in PERCENTILES])
+    totals = ["total"] + [
+        sum(stats[key] for stats in summary.values())
+        for key in ("calls", "cache_hits", "deduplicated", "hedges", "failures", "retries", "prompt_tokens",
+                    "completion_tokens", "cached_tokens")
+    ] + [f"{sum(stats['request_bytes'] for stats in summary.values()) / 1024 / 1024:.1f}",
+         f"{sum(stats['total_upload'] for stats in summary.values()):.1f}",
+         f"{sum(stats['total_latency'] for stats in summary.values()):.1f}"] + [""] * len(PERCENTILES)
+    rows.append(totals)
+    widths = [max(len(str(row[i])) for row in [header] + rows) for i in range(len(header))]
+    for row in [header] + rows:
+        print("  ".join(str(cell).rjust(width) for cell, width in zip(row, widths)))
+
+
+def get_ledger() -> CallLedger:
+    """
+    Return the process-wide ledger configured from the `MERMAID_LEDGER`
+    environment variable.
+
+    :return: The shared ledger. Without a path configured it records nothing.
+    :rtype: CallLedger
+    """
+    global _default_ledger
+    if _default_ledger is None:
+        _default_ledger = CallLedger(os.environ.get("MERMAID_LEDGER") or None)
+    return _default_ledger
+
+
+def set_ledger_path(
+    path: Union[str, Path, None]
+) -> None:
+    """
+    Export the ledger path to the environment so that this process and every
+    process it starts record to the same ledger.
+
+    :param path: Path of the ledger file, or None to keep the current value.
+    :type path: str | Path | None
+    """
+    global _default_ledger
+    if path:
+        os.environ["MERMAID_LEDGER"] = str(Path(path).resolve())
+    _default_ledger = None
+
+
+def main(
+    argv: Union[list[str], None] = None
+) -> None:
+    """
+    Command line entry point printing the per-stage summary of a ledger.
+
+    :param argv: Command line arguments. Defaults to `sys.argv[1:]`.
+    :type argv: list[str] | None
+    """
+    parser = argparse.ArgumentParser(
+        prog="mermaid-ledger",
+        description="Summarize a ledger of model API calls per stage."
+    )
+    parser.add_argument(
+        "ledger",
+        type=Path,
+        nargs="?",
+        default=os.environ.get("MERMAID_LEDGER"),
+        help="Path of the ledger file. Defaults to $MERMAID_LEDGER."
+    )
+    args = parser.parse_args(argv)
+    if args.ledger is None:
+        parser.error("no ledger given and MERMAID_LEDGER is not set")
+    print_summary(summarize(read_ledger(args.ledger)))
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""Exclusive file locks shared between processes."""
+import os
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, Union
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+@contextmanager
+def file_lock(
+    lock_path: Union[str, Path]
+) -> Iterator[None]:
+    """
+    Hold an exclusive lock on a file for the duration of the context. The lock
+    is advisory and works across processes (``fcntl.flock`` on POSIX,
+    ``msvcrt.locking`` on Windows).
+
+    :param lock_path: Path of the lock file. Created if it does not exist.
+    :type lock_path: str | Path
+    """
+    lock_path = Path(lock_path)
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o666)
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        else:
+            msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+        yield
+    finally:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        else:
+            os.lseek(fd, 0, os.SEEK_SET)
+            msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+        os.close(fd)
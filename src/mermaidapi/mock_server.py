@@ -0,0 +1,346 @@
+# -*- coding: utf-8 -*-
+"""
+Local stand-in for an OpenAI-compatible chat completions API.
+
+The server answers ``POST .../chat/completions`` with canned responses after a
+configurable latency, and fails a configurable fraction of requests with
+rate limits (429 with Retry-After) or server errors (500/503). An optional
+concurrency cap answers 429 to requests beyond it, mimicking a quota. Point a
+provider at it to load-test the concurrency features without spending tokens::
+
+    python -m mermaidapi mock-server --port 8000 --latency 2 --rate_limit_rate 0.05
+
+and set ``"provider": {"base_url": "http://localhost:8000/v1", "api_key_env": ""}``.
+
+Responses are chosen in this order:
+
+1. A response recorded in a DataRaider response cache (`--replay_cache`),
+   looked up by the hash of the request payload.
+2. The first rule of the responses file (`--responses`) whose `match`
+   substring occurs in the request messages. A rule without `match` matches
+   every request.
+3. The default content (`--default_content`).
+"""
+import argparse
+import hashlib
+import json
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Union
+
+from .rate_limiter import CHARS_PER_TOKEN, estimate_tokens
+
+
+def _message_text(
+    payload: dict[str, Any]
+) -> str:
+    """Concatenate the text parts of the messages of a request."""
+    texts = []
+    for message in payload.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, str):
+            texts.append(content)
+            continue
+        for part in content or []:
+            if part.get("type") == "text":
+                texts.append(part.get("text", ""))
+    return "\n".join(texts)
+
+
+class MockServer:
+    """
+    Threaded mock chat completions server.
+
+    :param host: Interface to listen on.
+    :type host: str
+    :param port: Port to listen on. 0 picks a free port.
+    :type port: int
+    :param responses: Rules `{"match": str, "content": str}` choosing the
+        response content. The first matching rule wins.
+    :type responses: list[dict[str, str]] | None
+    :param default_content: Content returned when no rule matches.
+    :type default_content: str
+    :param replay_cache: DataRaider response cache database whose recorded
+        responses are replayed for identical requests.
+    :type replay_cache: str | Path | None
+    :param latency: Mean latency of a response in seconds.
+    :type latency: float
+    :param latency_jitter: Half-width of the uniform jitter added to the latency.
+    :type latency_jitter: float
+    :param error_rate: Fraction of requests failing with 500 or 503.
+    :type error_rate: float
+    :param rate_limit_rate: Fraction of requests failing with 429.
+    :type rate_limit_rate: float
+    :param max_concurrency: Requests in flight above which requests fail with 429.
+    :type max_concurrency: int | None
+    :param retry_after: Retry-After value sent with 429 responses, in seconds.
+    :type retry_after: float
+    :param api_key: If given, requests without this key fail with 401.
+    :type api_key: str | None
+    :param seed: Seed of the random failures and jitter.
+    :type seed: int | None
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        responses: Union[list[dict[str, str]], None] = None,
+        default_content: str = "{}",
+        replay_cache: Union[str, Path, None] = None,
+        latency: float = 0.0,
+        latency_jitter: float = 0.0,
+        error_rate: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        max_concurrency: Union[int, None] = None,
+        retry_after: float = 1.0,
+        api_key: Union[str, None] = None,
+        seed: Union[int, None] = None,
+    ):
+        self.responses = list(responses or [])
+        self.default_content = default_content
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.max_concurrency = max_concurrency
+        self.retry_after = retry_after
+        self.api_key = api_key
+        self.in_flight = 0
+        self.stats = {"requests": 0, "ok": 0, "rate_limited": 0, "errors": 0,
+                      "replayed": 0, "peak_in_flight": 0}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._replay = None
+        if replay_cache:
+            self._replay = sqlite3.connect(f"file:{replay_cache}?mode=ro", uri=True, check_same_thread=False)
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        """Base URL to configure as the provider `base_url`."""
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def _handler_class(self) -> type:
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                status, headers, response = server.handle(self.path, dict(self.headers), body)
+                data = json.dumps(response).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def _error(
+        self,
+        status: int,
+        message: str,
+        error_type: str,
+    ) -> dict[str, Any]:
+        return {"error": {"message": message, "type": error_type, "code": status}}
+
+    def _outcome(self) -> tuple[Union[int, None], float]:
+        """
+        Draw the failure status of a request (None if it succeeds) and its
+        latency. Both draws are taken under the lock, so that a seeded server
+        draws the same sequence whatever the interleaving of handler threads.
+        """
+        with self._lock:
+            if self.max_concurrency and self.in_flight > self.max_concurrency:
+                return 429, 0.0
+            draw = self._random.random()
+            status = None
+            if draw < self.rate_limit_rate:
+                status = 429
+            elif draw < self.rate_limit_rate + self.error_rate:
+                status = self._random.choice((500, 503))
+            latency = max(0.0, self.latency + self._random.uniform(-self.latency_jitter, self.latency_jitter))
+        return status, latency
+
+    def _content(
+        self,
+        payload: dict[str, Any]
+    ) -> Union[dict[str, Any], str]:
+        """Recorded response for the payload, or the content of the first matching rule."""
+        if self._replay is not None:
+            canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+            key = hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+            with self._lock:
+                row = self._replay.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                return json.loads(row[0])
+        text = _message_text(payload)
+        for rule in self.responses:
+            if rule.get("match", "") in text:
+                return rule.get("content", self.default_content)
+        return self.default_content
+
+    def handle(
+        self,
+        path: str,
+        headers: dict[str, str],
+        body: bytes,
+    ) -> tuple[int, dict[str, str], dict[str, Any]]:
+        """
+        Answer a request.
+
+        :param path: Request path.
+        :type path: str
+        :param headers: Request headers.
+        :type headers: dict[str, str]
+        :param body: Request body.
+        :type body: bytes
+        :return: The status code, extra response headers and JSON response.
+        :rtype: tuple[int, dict[str, str], dict[str, Any]]
+        """
+        if not path.rstrip("/").endswith("/chat/completions"):
+            return 404, {}, self._error(404, f"Unknown path {path}", "invalid_request_error")
+        if self.api_key:
+            sent = {k.lower(): v for k, v in headers.items()}
+            if self.api_key not in (sent.get("authorization", "").removeprefix("Bearer "), sent.get("api-key")):
+                return 401, {}, self._error(401, "Invalid API key", "invalid_request_error")
+        try:
+            payload = json.loads(body)
+        except json.JSONDecodeError:
+            return 400, {}, self._error(400, "Request body is not JSON", "invalid_request_error")
+
+        with self._lock:
+            self.stats["requests"] += 1
+            self.in_flight += 1
+            self.stats["peak_in_flight"] = max(self.stats["peak_in_flight"], self.in_flight)
+        try:
+            status, latency = self._outcome()
+            if status == 429:
+                with self._lock:
+                    self.stats["rate_limited"] += 1
+                return 429, {"Retry-After": str(self.retry_after)}, self._error(429, "Rate limit reached", "rate_limit_exceeded")
+            time.sleep(latency)
+            if status is not None:
+                with self._lock:
+                    self.stats["errors"] += 1
+                return status, {}, self._error(status, "The server had an error", "server_error")
+            content = self._content(payload)
+            with self._lock:
+                self.stats["ok"] += 1
+                self.stats["replayed"] += isinstance(content, dict)
+            if isinstance(content, dict):
+                return 200, {}, content
+            prompt_tokens = estimate_tokens({"messages": payload.get("messages", [])})
+            completion_tokens = len(content) // CHARS_PER_TOKEN
+            return 200, {}, {
+                "id": f"chatcmpl-mock-{uuid.uuid4().hex}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": payload.get("model", "mock"),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop",
+                }],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                },
+            }
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def start(self) -> str:
+        """
+        Serve in a background thread.
+
+        :return: The base URL of the server.
+        :rtype: str
+        """
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self.base_url
+
+    def serve_forever(self) -> None:
+        """Serve in the current thread until interrupted."""
+        self._server.serve_forever()
+
+    def stop(self) -> None:
+        """Stop serving and release the port."""
+        self._server.shutdown()
+        self._server.server_close()
+        if self._replay is not None:
+            self._replay.close()
+
+
+def main(
+    argv: Union[list[str], None] = None
+) -> None:
+    """
+    Command line entry point running the mock server until interrupted.
+
+    :param argv: Command line arguments. Defaults to `sys.argv[1:]`.
+    :type argv: list[str] | None
+    """
+    parser = argparse.ArgumentParser(
+        prog="python -m mermaidapi mock-server",
+        description="Serve canned chat completions with configurable latency and errors."
+    )
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Interface to listen on. Defaults to 127.0.0.1.")
+    parser.add_argument("--port", type=int, default=8000, help="Port to listen on. Defaults to 8000.")
+    parser.add_argument("--responses", type=Path,
+                        help='JSON file with a list of {"match": ..., "content": ...} rules.')
+    parser.add_argument("--default_content", type=str, default="{}",
+                        help="Content returned when no rule matches. Defaults to {}.")
+    parser.add_argument("--replay_cache", type=Path,
+                        help="DataRaider response cache whose recorded responses are replayed.")
+    parser.add_argument("--latency", type=float, default=0.0, help="Mean response latency in seconds.")
+    parser.add_argument("--latency_jitter", type=float, default=0.0,
+                        help="Half-width of the uniform latency jitter in seconds.")
+    parser.add_argument("--error_rate", type=float, default=0.0, help="Fraction of requests failing with 500/503.")
+    parser.add_argument("--rate_limit_rate", type=float, default=0.0, help="Fraction of requests failing with 429.")
+    parser.add_argument("--max_concurrency", type=int,
+                        help="Requests in flight above which requests fail with 429.")
+    parser.add_argument("--retry_after", type=float, default=1.0, help="Retry-After of 429 responses in seconds.")
+    parser.add_argument("--api_key", type=str, help="If set, reject requests without this key.")
+    parser.add_argument("--seed", type=int, help="Seed of the random failures and jitter.")
+    args = parser.parse_args(argv)
+
+    responses = None
+    if args.responses:
+        with open(args.responses, "r") as f:
+            responses = json.load(f)
+    server = MockServer(
+        host=args.host, port=args.port, responses=responses,
+        default_content=args.default_content, replay_cache=args.replay_cache,
+        latency=args.latency, latency_jitter=args.latency_jitter,
+        error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate,
+        max_concurrency=args.max_concurrency, retry_after=args.retry_after,
+        api_key=args.api_key, seed=args.seed,
+    )
+    print(f"Mock chat completions server listening on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+        print(f"Mock server stats: {server.stats}")
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""
+OpenAI-compatible endpoint configuration shared by DataRaider and KGWizard.
+
+A provider bundles the base URL of a chat completions API, the way requests
+authenticate and the model used by each pipeline stage. Any server exposing
+``POST {base_url}/chat/completions`` works: OpenAI, Azure OpenAI, self-hosted
+inference servers (vLLM, TGI, llama.cpp) or the local mock server in
+`mermaidapi.mock_server`.
+
+The provider is read from the environment so that every process of a
+pipeline run uses the same endpoint:
+
+- `MERMAID_BASE_URL`: base URL of the API. Defaults to the OpenAI API.
+- `MERMAID_API_KEY_ENV`: name of the environment variable holding the API key.
+  Defaults to `OPENAI_API_KEY`. Set it to an empty string for servers without
+  authentication.
+- `MERMAID_AUTH_HEADER`: header carrying the key. `Authorization` (the
+  default) sends ``Bearer <key>``, any other header (e.g. `api-key`) sends the
+  bare key.
+- `MERMAID_MODELS`: JSON object mapping stage names to model ids. Stages
+  without an entry use the model chosen by the caller.
+"""
+import json
+import os
+from typing import Any, Union
+
+OPENAI_BASE_URL = "https://api.openai.com/v1"
+DEFAULT_API_KEY_ENV = "OPENAI_API_KEY"
+DEFAULT_AUTH_HEADER = "Authorization"
+
+_default_provider = None
+
+
+class Provider:
+    """
+    Endpoint, authentication and per-stage models of an OpenAI-compatible API.
+
+    :param base_url: Base URL of the API, without the `/chat/completions` suffix.
+    :type base_url: str
+    :param api_key_env: Environment variable holding the API key, or an empty
+        string for servers without authentication.
+    :type api_key_env: str
+    :param auth_header: Header carrying the API key.
+    :type auth_header: str
+    :param models: Model id per stage name.
+    :type models: dict[str, str] | None
+    """
+
+    def __init__(
+        self,
+        base_url: str = OPENAI_BASE_URL,
+        api_key_env: str = DEFAULT_API_KEY_ENV,
+        auth_header: str = DEFAULT_AUTH_HEADER,
+        models: Union[dict[str, str], None] = None,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.api_key_env = api_key_env
+        self.auth_header = auth_header
+        self.models = dict(models or {})
+
+    @property
+    def chat_url(self) -> str:
+        """URL of the chat completions endpoint."""
+        return f"{self.base_url}/chat/completions"
+
+    @property
+    def requires_key(self) -> bool:
+        """Whether requests must carry an API key."""
+        return bool(self.api_key_env)
+
+    def api_key(self) -> Union[str, None]:
+        """
+        Read the API key from the configured environment variable.
+
+        :return: The API key, or None if the provider needs no key or it is unset.
+        :rtype: str | None
+        """
+        if not self.api_key_env:
+            return None
+        return os.environ.get(self.api_key_env) or None
+
+    def auth_headers(
+        self,
+        api_key: Union[str, None] = None,
+    ) -> dict[str, str]:
+        """
+        Headers authenticating a request.
+
+        :param api_key: The API key. Defaults to the one read by `api_key`.
+        :type api_key: str | None
+        :return: The authentication header, or an empty dictionary without a key.
+        :rtype: dict[str, str]
+        """
+        api_key = api_key or self.api_key()
+        if not api_key:
+            return {}
+        if self.auth_header.lower() == "authorization":
+            return {self.auth_header: f"Bearer {api_key}"}
+        return {self.auth_header: api_key}
+
+    def model_for(
+        self,
+        stage: Union[str, None],
+        default: Union[str, None] = None,
+    ) -> Union[str, None]:
+        """
+        Model used by a stage.
+
+        :param stage: Name of the pipeline stage.
+        :type stage: str | None
+        :param default: Model to use if the stage has no entry.
+        :type default: str | None
+        :return: The model id.
+        :rtype: str | None
+        """
+        return self.models.get(stage, default) if stage else default
+
+    def apply(
+        self,
+        payload: dict[str, Any],
+        stage: Union[str, None],
+    ) -> dict[str, Any]:
+        """
+        Set the model of a chat completion payload to the one of its stage.
+
+        :param payload: The chat completion request payload.
+        :type payload: dict[str, Any]
+        :param stage: Name of the pipeline stage issuing the request.
+        :type stage: str | None
+        :return: The payload, copied if its model changed.
+        :rtype: dict[str, Any]
+        """
+        model = self.model_for(stage, payload.get("model"))
+        if model == payload.get("model"):
+            return payload
+        return {**payload, "model": model}
+
+
+def get_provider() -> Provider:
+    """
+    Return the process-wide provider configured from the `MERMAID_BASE_URL`,
+    `MERMAID_API_KEY_ENV`, `MERMAID_AUTH_HEADER` and `MERMAID_MODELS`
+    environment variables.
+
+    :return: The shared provider. Without configuration it is the OpenAI API.
+    :rtype: Provider
+    """
+    global _default_provider
+    if _default_provider is None:
+        models = os.environ.get("MERMAID_MODELS")
+        _default_provider = Provider(
+            base_url=os.environ.get("MERMAID_BASE_URL") or OPENAI_BASE_URL,
+            api_key_env=os.environ.get("MERMAID_API_KEY_ENV", DEFAULT_API_KEY_ENV),
+            auth_header=os.environ.get("MERMAID_AUTH_HEADER") or DEFAULT_AUTH_HEADER,
+            models=json.loads(models) if models else None,
+        )
+    return _default_provider
+
+
+def set_provider(
+    config: Union[dict[str, Any], None]
+) -> None:
+    """
+    Export a provider configuration to the environment so that this process
+    and every process it starts use the same endpoint.
+
+    :param config: Dictionary with any of the keys `base_url`, `api_key_env`,
+        `auth_header` and `models`. Empty values keep the current setting,
+        except `api_key_env`, where an empty string disables authentication.
+    :type config: dict[str, Any] | None
+    """
+    global _default_provider
+    config = config or {}
+    if config.get("base_url"):
+        os.environ["MERMAID_BASE_URL"] = config["base_url"]
+    if config.get("api_key_env") is not None:
+        os.environ["MERMAID_API_KEY_ENV"] = config["api_key_env"]
+    if config.get("auth_header"):
+        os.environ["MERMAID_AUTH_HEADER"] = config["auth_header"]
+    if config.get("models"):
+        os.environ["MERMAID_MODELS"] = json.dumps(config["models"])
+    _default_provider = None
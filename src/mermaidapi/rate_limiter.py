@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""
+Token-bucket rate limiter shared by every process calling the model API.
+
+DataRaider and KGWizard (including all of its multiprocessing workers) acquire
+from the same pair of buckets, one for requests per minute and one for tokens
+per minute. The bucket state lives in a small JSON file guarded by a file lock,
+so independent processes on the same machine coordinate without a server.
+
+The limits are read from the environment:
+
+- `MERMAID_RPM`: requests per minute. Unset means unlimited.
+- `MERMAID_TPM`: tokens per minute. Unset means unlimited.
+- `MERMAID_RATE_LIMIT_STATE`: path of the shared state file. Defaults to a
+  file in the system temporary directory.
+"""
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Union
+
+from .locking import file_lock
+
+DEFAULT_STATE_PATH = Path(tempfile.gettempdir()) / "mermaid_rate_limit.json"
+CHARS_PER_TOKEN = 4
+LOW_DETAIL_IMAGE_TOKENS = 85
+HIGH_DETAIL_IMAGE_TOKENS = 765
+
+_default_limiter = None
+
+
+def estimate_tokens(
+    payload: dict[str, Any]
+) -> int:
+    """
+    Estimate the number of tokens a chat completion request counts against the
+    tokens-per-minute limit: about one token per four characters of text, a
+    fixed cost per image depending on its detail level, plus the requested
+    completion budget (`max_tokens`), which the API reserves up front.
+
+    :param payload: The chat completion request payload.
+    :type payload: dict[str, Any]
+    :return: The estimated number of tokens.
+    :rtype: int
+    """
+    chars = 0
+    images = 0
+    low_detail_images = 0
+    for message in payload.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, str):
+            chars += len(content)
+            continue
+        for part in content or []:
+            if part.get("type") == "text":
+                chars += len(part.get("text", ""))
+            elif part.get("type") == "image_url":
+                if part.get("image_url", {}).get("detail") == "low":
+                    low_detail_images += 1
+                else:
+                    images += 1
+    return (
+        chars // CHARS_PER_TOKEN
+        + images * HIGH_DETAIL_IMAGE_TOKENS
+        + low_detail_images * LOW_DETAIL_IMAGE_TOKENS
+        + int(payload.get("max_tokens") or payload.get("max_completion_tokens") or 0)
+    )
+
+
+class RateLimiter:
+    """
+    Cross-process token bucket for requests per minute and tokens per minute.
+
+    :param requests_per_minute: Requests allowed per minute, or None for no limit.
+    :type requests_per_minute: float | None
+    :param tokens_per_minute: Tokens allowed per minute, or None for no limit.
+    :type tokens_per_minute: float | None
+    :param state_path: Path of the shared bucket state file.
+    :type state_path: str | Path
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: Union[float, None] = None,
+        tokens_per_minute: Union[float, None] = None,
+        state_path: Union[str, Path] = DEFAULT_STATE_PATH,
+    ):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.state_path = Path(state_path)
+        self.lock_path = self.state_path.with_name(self.state_path.name + ".lock")
+
+    @property
+    def enabled(self) -> bool:
+        """Whether any limit is configured."""
+        return bool(self.requests_per_minute or self.tokens_per_minute)
+
+    def _read_state(self, now: float) -> dict[str, float]:
+        try:
+            with open(self.state_path, "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {
+                "requests": float(self.requests_per_minute or 0),
+                "tokens": float(self.tokens_per_minute or 0),
+                "updated": now,
+            }
+
+    def _write_state(self, state: dict[str, float]) -> None:
+        tmp_path = self.state_path.with_name(self.state_path.name + f".{os.getpid()}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_path)
+
+    def _try_acquire(self, tokens: int) -> float:
+        """
+        Take one request and `tokens` tokens from the buckets if both have
+        enough capacity.
+
+        :return: 0 if acquired, otherwise the seconds to wait before retrying.
+        :rtype: float
+        """
+        with file_lock(self.lock_path):
+            now = time.time()
+            state = self._read_state(now)
+            elapsed = max(0.0, now - state["updated"])
+            wait = 0.0
+            buckets = (
+                ("requests", self.requests_per_minute, 1),
+                ("tokens", self.tokens_per_minute, tokens),
+            )
+            for name, limit, cost in buckets:
+                if not limit:
+                    continue
+                # A request larger than the bucket only needs a full bucket
+                cost = min(cost, limit)
+                state[name] = min(limit, state.get(name, limit) + elapsed * limit / 60)
+                if state[name] < cost:
+                    wait = max(wait, (cost - state[name]) * 60 / limit)
+            if wait == 0.0:
+                for name, limit, cost in buckets:
+                    if limit:
+                        state[name] -= min(cost, limit)
+            state["updated"] = now
+            self._write_state(state)
+            return wait
+
+    def acquire(
+        self,
+        tokens: int = 0
+    ) -> float:
+        """
+        Block until one request and `tokens` tokens are available.
+
+        :param tokens: Estimated tokens of the request (see `estimate_tokens`).
+        :type tokens: int
+        :return: The number of seconds spent waiting.
+        :rtype: float
+        """
+        if not self.enabled:
+            return 0.0
+        start = time.perf_counter()
+        while (wait := self._try_acquire(tokens)) > 0:
+            time.sleep(wait)
+        return time.perf_counter() - start
+
+    def reconcile(
+        self,
+        reserved: int,
+        used: int
+    ) -> None:
+        """
+        Correct the tokens bucket once the actual usage of a request is known:
+        tokens reserved but not used are returned, and tokens used beyond the
+        reservation are taken, which may leave the bucket in debt.
+
+        :param reserved: Tokens acquired for the request.
+        :type reserved: int
+        :param used: Prompt and completion tokens the response reports.
+        :type used: int
+        """
+        if not self.tokens_per_minute:
+            return
+        with file_lock(self.lock_path):
+            state = self._read_state(time.time())
+            tokens = state.get("tokens", self.tokens_per_minute) + min(reserved, self.tokens_per_minute) - used
+            state["tokens"] = min(self.tokens_per_minute, tokens)
+            self._write_state(state)
+
+
+def get_rate_limiter() -> RateLimiter:
+    """
+    Return the process-wide rate limiter configured from the `MERMAID_RPM`,
+    `MERMAID_TPM` and `MERMAID_RATE_LIMIT_STATE` environment variables.
+
+    :return: The shared rate limiter. Without limits configured it never blocks.
+    :rtype: RateLimiter
+    """
+    global _default_limiter
+    if _default_limiter is None:
+        rpm = os.environ.get("MERMAID_RPM")
+        tpm = os.environ.get("MERMAID_TPM")
+        _default_limiter = RateLimiter(
+            requests_per_minute=float(rpm) if rpm else None,
+            tokens_per_minute=float(tpm) if tpm else None,
+            state_path=os.environ.get("MERMAID_RATE_LIMIT_STATE") or DEFAULT_STATE_PATH,
+        )
+    return _default_limiter
+
+
+def set_rate_limits(
+    requests_per_minute: Union[float, None] = None,
+    tokens_per_minute: Union[float, None] = None,
+) -> None:
+    """
+    Export rate limits to the environment so that this process and every
+    process it starts share them.
+
+    :param requests_per_minute: Requests allowed per minute, or None to keep the current value.
+    :type requests_per_minute: float | None
+    :param tokens_per_minute: Tokens allowed per minute, or None to keep the current value.
+    :type tokens_per_minute: float | None
+    """
+    global _default_limiter
+    if requests_per_minute:
+        os.environ["MERMAID_RPM"] = str(requests_per_minute)
+    if tokens_per_minute:
+        os.environ["MERMAID_TPM"] = str(tokens_per_minute)
+    _default_limiter = None
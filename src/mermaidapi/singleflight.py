@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""
+In-flight de-duplication of identical calls.
+
+When several threads make the same call (the same key) at the same time, only
+the first one runs it. The others wait for its result instead of repeating the
+work. Once the call finishes the key is released, so later calls run again.
+Pair it with a cache to also share results over time.
+"""
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Hashable
+
+
+class SingleFlight:
+    """
+    Thread-safe group of keyed calls where concurrent duplicates share one
+    execution.
+    """
+
+    def __init__(self):
+        self.shared = 0
+        self._calls: dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+
+    def do(
+        self,
+        key: Hashable,
+        fn: Callable[[], Any],
+    ) -> tuple[Any, bool]:
+        """
+        Run `fn` unless a call with the same key is already in flight, in which
+        case wait for that call and return its result. An exception raised by
+        the running call is raised in every waiting caller too.
+
+        :param key: Identity of the call.
+        :type key: Hashable
+        :param fn: The call to run.
+        :type fn: Callable[[], Any]
+        :return: The result and whether it was shared from another caller.
+        :rtype: tuple[Any, bool]
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+            else:
+                self.shared += 1
+        if not leader:
+            return future.result(), True
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            with self._lock:
+                del self._calls[key]
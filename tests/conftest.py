@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The packages live in src/ and are imported by their top-level names, as in scripts/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
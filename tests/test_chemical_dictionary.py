@@ -0,0 +1,33 @@
+import pytest
+
+from dataraider.chemical_dictionary import ChemicalDictionary, normalize_name
+
+
+@pytest.mark.parametrize("first, second", [("CO", "Co"),
+                                           ("NO", "No"),
+                                           ("HF", "Hf"),
+                                           ("CS2", "Cs2"),
+                                           ("CS2", "cs2")])
+def test_formula_like_names_stay_distinct(first, second):
+    assert normalize_name(first) != normalize_name(second)
+    dictionary = ChemicalDictionary({first: "first"})
+    assert dictionary.get(first) == "first"
+    assert dictionary.get(second) is None
+
+
+@pytest.mark.parametrize("first, second", [("Acetone", "acetone"),
+                                           ("Toluene", "toluene"),
+                                           ("Ethyl acetate", "ethylacetate"),
+                                           ("n-Bu4NBF4", "nBu4NBF4"),
+                                           ("n‐Bu4NBF4", "nBu4NBF4"),
+                                           ("ＴＨＦ", "THF")])
+def test_spelling_variants_collapse(first, second):
+    assert normalize_name(first) == normalize_name(second)
+    assert ChemicalDictionary({first: "value"}).get(second) == "value"
+
+
+def test_exact_entries_resolve_ambiguous_keys():
+    dictionary = ChemicalDictionary({"Acetone": "CC(C)=O", "acetone": "CC(=O)C"})
+    assert dictionary["Acetone"] == "CC(C)=O"
+    assert dictionary["acetone"] == "CC(=O)C"
+    assert dictionary.get("ACEtone") is None
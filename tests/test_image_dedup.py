@@ -0,0 +1,36 @@
+import cv2
+import numpy as np
+
+from dataraider.image_dedup import cluster_duplicates, deduplicate_images, duplicate_images
+
+
+def _figure(size):
+    """
+    Synthetic figure with enough structure for a stable perceptual hash, rendered at the given size
+    """
+    image = np.full((200, 300), 255, np.uint8)
+    cv2.rectangle(image, (20, 30), (140, 170), 0, -1)
+    cv2.circle(image, (220, 80), 50, 90, -1)
+    cv2.line(image, (160, 180), (290, 120), 40, 6)
+    return cv2.resize(image, (size * 3 // 2, size), interpolation=cv2.INTER_AREA)
+
+
+def test_fixed_representatives_are_not_demoted():
+    hashes = {"old.png": 0b0000, "new.png": 0b0001, "other.png": 0b0111}
+    quality = {"old.png": 1, "new.png": 10, "other.png": 5}
+    assert cluster_duplicates(hashes, 1, quality) == {"new.png": ["new.png", "old.png"], "other.png": ["other.png"]}
+    assert cluster_duplicates(hashes, 1, quality, {"old.png"}) == {"old.png": ["new.png", "old.png"], "other.png": ["other.png"]}
+    hashes["older.png"] = 0b0011
+    clusters = cluster_duplicates(hashes, 1, dict(quality, **{"older.png": 1}), {"old.png", "older.png"})
+    assert clusters["old.png"] == ["new.png", "old.png"] and clusters["older.png"] == ["older.png", "other.png"]
+
+
+def test_later_runs_keep_earlier_representatives(tmp_path):
+    cv2.imwrite(str(tmp_path / "a.png"), _figure(200))
+    cv2.imwrite(str(tmp_path / "b.jpg"), _figure(200))
+    assert deduplicate_images(tmp_path) == {"a.png": ["a.png", "b.jpg"]}
+
+    cv2.imwrite(str(tmp_path / "c.png"), _figure(400)) # Larger, so it would win a fresh clustering
+    clusters = deduplicate_images(tmp_path)
+    assert clusters == {"a.png": ["a.png", "b.jpg", "c.png"]}
+    assert duplicate_images(tmp_path) == {"b.jpg", "c.png"}
@@ -0,0 +1,54 @@
+import base64
+
+import cv2
+import numpy as np
+import pytest
+
+from dataraider.image_encoding import compact_encode_image
+
+
+@pytest.fixture
+def transparent_png(tmp_path):
+    """
+    Uncompressed RGBA image with a fully transparent background around an opaque color gradient
+    """
+    image = np.zeros((120, 160, 4), np.uint8)
+    rows, columns = np.mgrid[0:60, 0:80]
+    image[30:90, 40:120, 0] = 60 + rows * 2
+    image[30:90, 40:120, 1] = 40 + columns
+    image[30:90, 40:120, 2] = 200 - rows
+    image[30:90, 40:120, 3] = 255
+    path = tmp_path / "transparent.png"
+    cv2.imwrite(str(path), image, [cv2.IMWRITE_PNG_COMPRESSION, 0])
+    return path, image
+
+
+def _decode(data):
+    return cv2.imdecode(np.frombuffer(base64.b64decode(data), np.uint8), cv2.IMREAD_COLOR)
+
+
+@pytest.mark.parametrize("formats, mime_type", [(("png",), "image/png"),
+                                                (("webp",), "image/webp"),
+                                                (("jpeg",), "image/jpeg")])
+def test_transparent_background_becomes_white(transparent_png, formats, mime_type):
+    path, image = transparent_png
+    data, chosen_mime, original_size, new_size = compact_encode_image(path, formats=formats)
+    assert chosen_mime == mime_type
+    assert new_size < original_size
+    decoded = _decode(data)
+    background = np.ones(image.shape[:2], bool)
+    background[14:106, 24:136] = False # Leaves room for ringing of lossy encodings around the opaque block
+    assert decoded[background].min() >= 250
+    assert decoded[image[:, :, 3] == 0].mean() >= 250
+    composited = np.where(image[:, :, 3:] == 255, image[:, :, :3], 255).astype(np.uint8)
+    assert cv2.PSNR(decoded, composited) >= 40
+
+
+def test_psnr_gate_rejects_lossy_encodings(tmp_path):
+    noise = np.random.default_rng(0).integers(0, 256, (64, 64, 3), dtype=np.uint8)
+    path = tmp_path / "noise.png"
+    cv2.imwrite(str(path), noise)
+    data, mime_type, original_size, new_size = compact_encode_image(path, formats=("jpeg",), quality=10)
+    assert mime_type == "image/png"
+    assert new_size == original_size
+    assert np.array_equal(_decode(data), noise)
@@ -0,0 +1,20 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from mermaidapi import MockServer
+
+
+def _run(seed, requests=200, workers=8):
+    server = MockServer(latency=0.001, latency_jitter=0.001, error_rate=0.2, rate_limit_rate=0.2, seed=seed)
+    body = json.dumps({"model": "mock", "messages": [{"role": "user", "content": "hi"}]}).encode("utf-8")
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        statuses = list(executor.map(lambda _: server.handle("/v1/chat/completions", {}, body)[0], range(requests)))
+    stats = {key: value for key, value in server.stats.items() if key != "peak_in_flight"} # Depends on thread timing
+    return sorted(statuses), stats
+
+
+def test_seeded_server_is_reproducible_under_concurrency():
+    statuses, stats = _run(seed=7)
+    assert (statuses, stats) == _run(seed=7)
+    assert {200, 429} <= set(statuses) and set(statuses) & {500, 503}
+    assert stats["requests"] == stats["ok"] + stats["rate_limited"] + stats["errors"] == 200
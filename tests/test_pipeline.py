@@ -0,0 +1,45 @@
+import threading
+
+import pytest
+
+from dataraider.pipeline import Stage, StagedPipeline
+
+
+def _run_with_timeout(pipeline, items, timeout=10):
+    """
+    Runs the pipeline in a thread and fails the test instead of hanging if run does not return
+    """
+    result = {}
+    thread = threading.Thread(target=lambda: result.update(done=pipeline.run(items)), daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "StagedPipeline.run did not return"
+    return result["done"]
+
+
+@pytest.mark.parametrize("exception", [ValueError("bad item"), SystemExit(1)])
+@pytest.mark.parametrize("failing_stage", [0, 1])
+def test_failing_item_is_reported_and_others_complete(exception, failing_stage):
+    seen = []
+    seen_lock = threading.Lock()
+
+    def work(stage_index):
+        def function(item):
+            if item == 3 and stage_index == failing_stage:
+                raise exception
+            if stage_index == 1:
+                with seen_lock:
+                    seen.append(item)
+        return function
+
+    items = list(range(10))
+    pipeline = StagedPipeline([Stage("first", work(0), workers=2), Stage("second", work(1), workers=1)], queue_size=1)
+    done = _run_with_timeout(pipeline, items)
+
+    assert done == [item for item in items if item != 3]
+    assert sorted(seen) == done
+    assert list(pipeline.errors) == [3]
+    assert pipeline.errors[3].startswith(("first" if failing_stage == 0 else "second") + ": " + type(exception).__name__)
+    report = pipeline.utilisation()
+    assert report["first"]["processed"] == 10
+    assert report["first"]["failed"] + report["second"]["failed"] == 1
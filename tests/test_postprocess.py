@@ -0,0 +1,37 @@
+import pytest
+
+from dataraider.alias_store import AliasStore, set_alias_store
+from dataraider.chemical_dictionary import ChemicalDictionary, set_chemical_dictionary
+from dataraider.postprocess import COMMON_NAMES, _replace_chemical
+
+
+@pytest.fixture
+def aliases():
+    store = AliasStore()
+    set_alias_store(store)
+    set_chemical_dictionary(ChemicalDictionary())
+    yield store
+    set_alias_store(None)
+    set_chemical_dictionary(None)
+
+
+def test_learned_alias_does_not_override_common_names(aliases):
+    aliases.add("DCM", "CCO")
+    assert _replace_chemical(COMMON_NAMES, "DCM") == ("Dichloromethane", False)
+
+
+def test_learned_alias_does_not_override_chemical_dictionary(aliases):
+    set_chemical_dictionary(ChemicalDictionary({"Dichloromethane": "ClCCl"}))
+    aliases.add("Dichloromethane", "CCO")
+    aliases.add("DCM", "CCO")
+    assert _replace_chemical(COMMON_NAMES, "DCM") == ("ClCCl", True)
+
+
+def test_learned_alias_resolves_uncurated_names(aliases):
+    aliases.add("Mystery solvent", "CCO")
+    assert _replace_chemical(COMMON_NAMES, "Mystery solvent") == ("CCO", True)
+
+
+def test_manual_correction_overrides_common_names(aliases):
+    aliases.correct("DCM", "ClCCl")
+    assert _replace_chemical(COMMON_NAMES, "DCM") == ("ClCCl", True)